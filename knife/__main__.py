@@ -4,7 +4,9 @@ import logging
 from flask import Flask
 from flask_cors import CORS
 from knife.routes import setup_routes
+from knife.cache import CachedDriver
 from knife.drivers import DRIVERS, get_driver
+from knife.models import OBJECTS
 
 level = logging.INFO
 if os.environ.get('KNIFE_DEBUG'):
@@ -24,8 +26,28 @@ if not driver:
     logging.error("Available backends: %s", ", ".join(DRIVERS.keys()))
     sys.exit(4)
 
+# Create the tables added since the database was set up
+try:
+    driver.migrate(OBJECTS)
+except Exception as err:
+    logging.error("Failed to create the missing tables: %s", str(err))
+
+# Log the statements lasting longer than this many milliseconds
+if slow_query := os.environ.get('KNIFE_SLOW_QUERY_MS'):
+    driver.slow_query = float(slow_query) / 1000
+
+# Keep the results of this many reads between requests
+if cache_size := os.environ.get('KNIFE_CACHE_SIZE'):
+    driver = CachedDriver(driver, int(cache_size))
+
+# Share the metrics of the workers through files in this directory
+metrics_directory = os.environ.get('KNIFE_METRICS_DIR')
+
+# Allow the clients passing this token to profile the workers
+profile_token = os.environ.get('KNIFE_PROFILE_TOKEN')
+
 APP = Flask(__name__)
-setup_routes(APP, driver)
+setup_routes(APP, driver, metrics_directory, profile_token)
 CORS(APP)
 
 if __name__ == '__main__':
@@ -0,0 +1,263 @@
+"""
+cache.py
+
+Read caches wrapping any driver: shared by the requests of a worker, or
+kept for a single request
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from knife.models import Generation
+from knife.operations import bump_generation
+
+# Number of reads kept by default
+CACHE_SIZE = 1024
+
+
+def tables(model):
+    """Names of the tables read through model, a model or a join"""
+    if isinstance(model, tuple):
+        return tuple(source.table_name for source in model[:2])
+    return (model.table_name, )
+
+
+def freeze(value):
+    """Hashable equivalent of a read argument"""
+    if isinstance(value, (list, tuple)):
+        return tuple(map(freeze, value))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    if isinstance(value, dict):
+        return frozenset((key, freeze(item)) for key, item in value.items())
+    return value
+
+
+class CachedDriver:
+    """
+    Driver answering repeated reads from a bounded LRU cache. Every table
+    has a generation, persisted with the other generations of the database
+    and replaced when a session writes to it. Cached reads are only used
+    while the generations of their tables are unchanged, including after
+    writes from other workers.
+
+    Calls other than read, write and erase go to the wrapped driver.
+    """
+
+    def __init__(self, driver, size=CACHE_SIZE):
+        self.driver = driver
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.state = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def stats(self):
+        return dict(self.driver.stats(),
+                    cache_hits=self.hits,
+                    cache_misses=self.misses,
+                    cache_entries=len(self.entries),
+                    cache_size=self.size)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @contextmanager
+    def session(self, readonly=False):
+        """
+        Session of the wrapped driver, in which the generations are read once
+        and those of the tables written are replaced before committing, or
+        also on failure when the driver cannot roll back
+        """
+        if getattr(self.state, 'generations', None) is not None:
+            yield self
+            return
+
+        with self.driver.session(readonly):
+            self.state.generations = dict(
+                (record[Generation.fields.scope],
+                 record[Generation.fields.generation])
+                for record in self.driver.read(Generation))
+            self.state.written = set()
+
+            failed = False
+
+            try:
+                yield self
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                if not failed or not self.driver.transactional:
+                    for table in sorted(self.state.written):
+                        bump_generation(self.driver, table)
+
+                self.state.generations = None
+
+    def read(self, model, *args, **kwargs):
+        if model is Generation:
+            return self.driver.read(model, *args, **kwargs)
+
+        if getattr(self.state, 'generations', None) is None:
+            with self.session(readonly=True):
+                return self.read(model, *args, **kwargs)
+
+        sources = tables(model)
+
+        # Reads following a write see uncommitted data, kept out of the cache
+        if self.state.written.intersection(sources):
+            return self.driver.read(model, *args, **kwargs)
+
+        try:
+            key = (freeze(model), freeze(args), freeze(kwargs))
+            hash(key)
+        except TypeError:
+            return self.driver.read(model, *args, **kwargs)
+
+        generations = tuple(
+            self.state.generations.get(table) for table in sources)
+
+        with self.lock:
+            if (entry := self.entries.get(key)) and entry[0] == generations:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return [dict(record) for record in entry[1]]
+
+            self.misses += 1
+
+        records = self.driver.read(model, *args, **kwargs)
+
+        with self.lock:
+            self.entries[key] = (generations,
+                                 [dict(record) for record in records])
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        return records
+
+    def write(self, model, *args, **kwargs):
+        if model is Generation:
+            return self.driver.write(model, *args, **kwargs)
+
+        with self.session():
+            self.state.written.update(tables(model))
+            return self.driver.write(model, *args, **kwargs)
+
+    def write_many(self, model, records):
+        with self.session():
+            self.state.written.update(tables(model))
+            return self.driver.write_many(model, records)
+
+    def erase(self, model, *args, **kwargs):
+        with self.session():
+            self.state.written.update(tables(model))
+            return self.driver.erase(model, *args, **kwargs)
+
+
+class Memo:
+    """
+    Results of the reads of a request, with the tables they come from, and
+    how many were reused
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.reads = 0
+        self.saved = 0
+
+
+def duplicate(result):
+    """Copy of a memoized result, for the caller to modify freely"""
+    if isinstance(result, set):
+        return set(result)
+    return [dict(record) for record in result]
+
+
+class ReadMemo:
+    """
+    Driver answering the reads repeated while memoize is active, usually for
+    the duration of a request, without querying the database again. A write
+    forgets the reads made from the tables it changes.
+
+    Calls other than read, transitive_closure and writes go to the wrapped
+    driver.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.state = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    @contextmanager
+    def memoize(self):
+        """Remember the reads of the enclosed block"""
+        if (memo := getattr(self.state, 'memo', None)) is not None:
+            yield memo
+            return
+
+        self.state.memo = Memo()
+
+        try:
+            yield self.state.memo
+        finally:
+            self.state.memo = None
+
+    def _recall(self, method, model, *args, **kwargs):
+        call = getattr(self.driver, method)
+
+        if (memo := getattr(self.state, 'memo', None)) is None:
+            return call(model, *args, **kwargs)
+
+        try:
+            key = (method, freeze(model), freeze(args), freeze(kwargs))
+            hash(key)
+        except TypeError:
+            return call(model, *args, **kwargs)
+
+        memo.reads += 1
+        if key in memo.results:
+            memo.saved += 1
+            return duplicate(memo.results[key][1])
+
+        result = call(model, *args, **kwargs)
+        memo.results[key] = (tables(model), duplicate(result))
+
+        return result
+
+    def _forget(self, model):
+        if (memo := getattr(self.state, 'memo', None)) is None:
+            return
+
+        written = set(tables(model))
+        for key, (sources, _) in list(memo.results.items()):
+            if written.intersection(sources):
+                del memo.results[key]
+
+    def read(self, model, *args, **kwargs):
+        if model is Generation:
+            return self.driver.read(model, *args, **kwargs)
+        return self._recall('read', model, *args, **kwargs)
+
+    def transitive_closure(self, model, *args, **kwargs):
+        return self._recall('transitive_closure', model, *args, **kwargs)
+
+    def write(self, model, *args, **kwargs):
+        self._forget(model)
+        return self.driver.write(model, *args, **kwargs)
+
+    def write_many(self, model, records):
+        self._forget(model)
+        return self.driver.write_many(model, records)
+
+    def erase(self, model, *args, **kwargs):
+        self._forget(model)
+        return self.driver.erase(model, *args, **kwargs)
@@ -1,13 +1,300 @@
 import sys
+import time
 import logging
+import threading
+from contextlib import contextmanager
 from importlib import import_module
 from pkgutil import walk_packages
+from urllib.parse import parse_qsl, urlencode
+
+# Number of rows fetched or sent at a time by the batch methods of SQL drivers
+BATCH_SIZE = 500
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_options(database_location, defaults):
+    """
+    Extract the driver options from the query string of a database location.
+    Only the keys present in defaults are consumed and cast to the type of
+    their default value; other parameters are left in the location.
+    """
+    location, _, query = database_location.partition('?')
+    options = dict(defaults)
+    parameters = parse_qsl(query, keep_blank_values=True)
+
+    if not any(key in defaults for key, _ in parameters):
+        return database_location, options
+
+    remaining = []
+
+    for key, value in parameters:
+        if key not in defaults:
+            remaining.append((key, value))
+        elif isinstance(defaults[key], bool):
+            options[key] = value.lower() in {'1', 'true', 'yes', 'on'}
+        elif defaults[key] is not None:
+            options[key] = type(defaults[key])(value)
+        else:
+            options[key] = value
+
+    if remaining:
+        location = "%s?%s" % (location, urlencode(remaining))
+
+    return location, options
+
+
+class Trace:
+    """
+    Statements run by a driver during a unit of work, such as a request
+    designated by label, as (statement, rows, seconds) tuples
+    """
+
+    def __init__(self, label=None):
+        self.label = label
+        self.statements = []
+
+    @property
+    def queries(self):
+        return len(self.statements)
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, _, seconds in self.statements)
+
+
+def row_count(result):
+    """Number of rows in the result of a driver method"""
+    if isinstance(result, (list, dict, set)):
+        return len(result)
+    return 0
+
+
+def measured(func):
+    """
+    Decoration recording each call of a driver method as a statement, for
+    drivers that do not run statements of their own
+    """
+
+    def wrapper(driver, model, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(driver, model, *args, **kwargs)
+
+        sources = model[:2] if isinstance(model, tuple) else (model, )
+        driver.record(
+            "%s %s" % (func.__name__, ' JOIN '.join(
+                source.table_name for source in sources)),
+            row_count(result),
+            time.perf_counter() - start)
+
+        return result
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+class OneOf(tuple):
+    """
+    Filter value matching the records whose field holds any of its items.
+    Other values, lists included, are compared to the field as they are.
+    """
+
+
+def starting_nodes(start):
+    """Values a transitive closure starts from, given one or a list of them"""
+    if isinstance(start, (list, tuple, set)):
+        return list(start)
+    return [start]
 
 
 class AbstractDriver:
+    OPTIONS = {}
+
+    # Statements lasting longer than this many seconds are logged as slow
+    slow_query = None
+
+    # Whether the writes of a session are discarded when it fails
+    transactional = True
 
     def __init__(self, database_location):
-        self.database_location = database_location
+        self.database_location, self.options = parse_options(
+            database_location, self.OPTIONS)
+        self.local = threading.local()
+
+    @property
+    def in_session(self):
+        return getattr(self.local, 'session', False)
+
+    @contextmanager
+    def trace(self, label=None):
+        """
+        Collect the statements run by the current thread in the enclosed
+        block. Nested traces are merged into the outermost one.
+        """
+        if (trace := getattr(self.local, 'trace', None)) is not None:
+            yield trace
+            return
+
+        self.local.trace = Trace(label)
+
+        try:
+            yield self.local.trace
+        finally:
+            self.local.trace = None
+
+    def record(self, statement, rows, seconds):
+        """Account for a statement, run in seconds and returning rows"""
+        trace = getattr(self.local, 'trace', None)
+
+        if trace is not None:
+            trace.statements.append((statement, rows, seconds))
+
+        if self.slow_query is not None and seconds >= self.slow_query:
+            LOGGER.warning("Slow statement in %s (%.1fms, %d rows): %s",
+                           trace.label if trace else "no request",
+                           1000 * seconds, rows, statement)
+
+    def stats(self):
+        """Gauges describing the state of the driver, by name"""
+        return {}
+
+    def version(self):
+        """
+        Token changing with every write to the database, for the drivers able
+        to tell without storing it, or None
+        """
+        return None
+
+    def migrate(self, models):
+        """Create the tables of models missing from the database"""
+
+    def begin(self, readonly=False):
+        """Open the transaction of a session"""
+
+    def commit(self):
+        """Commit the transaction of a session"""
+
+    def rollback(self):
+        """Discard the transaction of a session"""
+
+    @contextmanager
+    def session(self, readonly=False):
+        """
+        Run the enclosed driver calls as a single unit of work, committed when
+        the block exits and rolled back if it raises. Nested sessions are
+        merged into the outermost one.
+        """
+        if self.in_session:
+            yield self
+            return
+
+        self.begin(readonly)
+        self.local.session = True
+
+        try:
+            yield self
+        except BaseException:
+            self.local.session = False
+            self.rollback()
+            raise
+
+        self.local.session = False
+        self.commit()
+
+    def transitive_closure(self, model, source, target, start):
+        """
+        Follow the edges stored in model, from their source field to their
+        target field, and return every value reachable from start, start
+        included. Start may be a single value or a list of them. Each tier of
+        the graph is fetched with a single read.
+        """
+        nodes = set()
+        to_visit = set(starting_nodes(start))
+
+        while to_visit:
+            next_tier = set()
+
+            for edge in self.read(model,
+                                  columns=(target, ),
+                                  filters=[{
+                                      source: node
+                                  } for node in to_visit]):
+                next_tier.add(edge[target])
+
+            nodes = nodes | to_visit
+            to_visit = next_tier - nodes
+
+        return nodes
+
+    def iterate(self, model, filters=[], columns=['*'], exact=True, order=()):
+        """
+        Yield the records read one by one. Drivers able to fetch the results
+        in batches do so, to keep the memory used independent of their number.
+        Text fields of order sort as Python compares strings, so that ordered
+        iterations can be merged.
+        """
+        yield from self.read(model,
+                             filters=filters,
+                             columns=columns,
+                             exact=exact,
+                             order=order)
+
+    def write_many(self, model, records):
+        """
+        Insert records, all holding the same fields, in a single session.
+        Drivers able to send them in batches do so.
+        """
+        with self.session():
+            for record in records:
+                self.write(model, record)
+
+    def aggregate(self, model, key, value, relations):
+        """
+        Read the record of model whose key field equals value, along with its
+        related records. Relations map a name to a (source, foreign, columns)
+        tuple, where source is a model or a join as accepted by read, and
+        foreign the field of source referencing the record. Returns a
+        (record, {name: records}) tuple, or None if the record does not exist.
+        """
+        if not (records := self.read(model, filters=[{key: value}])):
+            return None
+
+        related = {}
+        for name, (source, foreign, columns) in relations.items():
+            related[name] = self.read(source,
+                                      columns=columns,
+                                      filters=[{
+                                          foreign: value
+                                      }])
+
+        return records[0], related
+
+    def aggregate_many(self, model, key, values, relations):
+        """
+        Read the records of model whose key field is in values, along with
+        their related records, as aggregate does. Every relation is read for
+        all the records at once. Returns a dict mapping the values found to
+        (record, {name: records}) tuples.
+        """
+        aggregates = {}
+
+        for record in self.read(model, filters=[{key: OneOf(values)}]):
+            aggregates[record[key]] = (record,
+                                       dict((name, []) for name in relations))
+
+        if not aggregates:
+            return aggregates
+
+        for name, (source, foreign, columns) in relations.items():
+            for record in self.read(source,
+                                    columns=(foreign, *columns),
+                                    filters=[{
+                                        foreign: OneOf(aggregates)
+                                    }]):
+                aggregates[record[foreign]][1][name].append(
+                    dict((column, record[column]) for column in columns))
+
+        return aggregates
 
 
 DRIVERS = {}
@@ -1,7 +1,18 @@
+import os
+import re
+import json
+import uuid
+import atexit
+import hashlib
+import threading
 from tinydb import (Query, TinyDB)
+from tinydb.middlewares import Middleware
+from tinydb.storages import JSONStorage
 from typing import Any
-from knife.drivers import AbstractDriver
-from knife.models.knife_model import Field, KnifeModel
+from collections.abc import Hashable
+from knife.drivers import AbstractDriver, OneOf, measured
+from knife.models import OBJECTS
+from knife.models.knife_model import Datatypes, Field, KnifeModel
 
 DRIVER_NAME = 'json'
 
@@ -11,7 +22,9 @@ def build_query(filters, exact):
     for rule in filter(None, filters):
         current = None
         for field, value in rule.items():
-            if exact:
+            if isinstance(value, OneOf):
+                fragment = getattr(Query(), field.name).one_of(list(value))
+            elif exact:
                 fragment = getattr(Query(), field.name) == value
             else:
                 fragment = getattr(Query(), field.name).search(value)
@@ -22,7 +35,10 @@ def build_query(filters, exact):
 
 
 def join(db, join_params, query):
-    """Mimic SQL join by querying twice and merging the records"""
+    """
+    Mimic SQL join with a hash join: the right table is read once and keyed on
+    its join field, then probed with every record of the left table
+    """
     model1, model2, field1, field2 = join_params
 
     if query:
@@ -30,15 +46,41 @@ def join(db, join_params, query):
     else:
         lhs = db.table(model1.table_name, cache_size=0).all()
 
+    if not lhs:
+        return
+
+    rhs = {}
+    for other in db.table(model2.table_name, cache_size=0).all():
+        if field2.name in other:
+            rhs.setdefault(other[field2.name], []).append(other)
+
     for document in lhs:
         assert len(document.keys()) == len(model1.fields.fields)
-        query = getattr(Query(), field2.name).matches(document[field1.name])
-        rhs = db.table(model2.table_name, cache_size=0).search(query)
 
-        for other in rhs:
+        for other in rhs.get(document.get(field1.name), []):
             yield document | other
 
 
+def paginate(documents, order=(), after=None, limit=None, offset=0):
+    """
+    Sort documents on the fields of order and slice the page following the
+    keyset cursor after, skipping offset documents and keeping at most limit
+    """
+    if order:
+        key = lambda document: tuple(
+            document.get(field.name) for field in order)
+
+        documents = sorted(documents, key=key)
+
+        if after:
+            documents = [
+                document for document in documents
+                if key(document) > tuple(after)
+            ]
+
+    return documents[offset:None if limit is None else offset + limit]
+
+
 def select(mapping: dict, fields: list[Field], model: KnifeModel):
     """Filter a mapping and return only the fields present in fields"""
     if fields == ['*']:
@@ -60,19 +102,383 @@ def select(mapping: dict, fields: list[Field], model: KnifeModel):
     return dict(cast_fields(mapping, fields))
 
 
+class FileStorage(JSONStorage):
+    """JSONStorage that can skip syncing the file to disk after writes"""
+
+    def __init__(self, path, fsync=True, **kwargs):
+        super().__init__(path, **kwargs)
+        self.fsync = fsync
+
+    def write(self, data):
+        self._handle.seek(0)
+        self._handle.write(json.dumps(data, **self.kwargs))
+        self._handle.truncate()
+        self._handle.flush()
+
+        if self.fsync:
+            os.fsync(self._handle.fileno())
+
+
+class WriteBehindMiddleware(Middleware):
+    """
+    Keep the database in memory and write it to the storage only when writes
+    changes are pending, interval milliseconds after the first of them, or
+    when the database is closed or the process exits. Zero disables a
+    trigger.
+    """
+
+    def __init__(self, storage_cls, lock, writes=0, interval=0):
+        super().__init__(storage_cls)
+        self.lock = lock
+        self.writes = writes
+        self.interval = interval
+        self.cache = None
+        self.pending = 0
+        self.timer = None
+
+        atexit.register(self.flush)
+
+    def read(self):
+        if self.cache is None:
+            self.cache = self.storage.read()
+        return self.cache
+
+    def write(self, data):
+        with self.lock:
+            self.cache = data
+            self.pending += 1
+
+            if self.writes and self.pending >= self.writes:
+                self.flush()
+            elif self.interval and self.timer is None:
+                self.timer = threading.Timer(self.interval / 1000,
+                                             self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        # The lock is the driver's, so that TinyDB is not in the middle of
+        # updating the cache when it gets serialized
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if self.pending:
+                self.storage.write(self.cache)
+                self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.storage.close()
+
+
+def trigrams(value):
+    return set(value[i:i + 3] for i in range(len(value) - 2))
+
+
+class Index:
+    """
+    Hash indexes over a snapshot of the database, mapping the values of the
+    indexed fields of every table to the ids of the documents holding them,
+    and the trigrams of the values of the text fields to the same ids.
+    Rules on fields that are not indexed are checked by scanning the
+    documents of the snapshot.
+    """
+
+    def __init__(self, fields, text_fields=()):
+        self.fields = frozenset(fields)
+        self.text_fields = frozenset(text_fields)
+        self.tables = None
+        self.entries = {}
+        self.grams = {}
+
+    @property
+    def loaded(self):
+        return self.tables is not None
+
+    def load(self, tables):
+        self.tables = {}
+        self.entries = {}
+        self.grams = {}
+
+        for table_name, documents in tables.items():
+            for doc_id, document in documents.items():
+                # Storages may hand out documents TinyDB updates in place
+                self.add(table_name, doc_id, dict(document))
+
+    def clear(self):
+        self.tables = None
+        self.entries = {}
+        self.grams = {}
+
+    def add(self, table_name, doc_id, document):
+        doc_id = str(doc_id)
+        self.tables.setdefault(table_name, {})[doc_id] = document
+        entries = self.entries.setdefault(table_name, {})
+
+        for field_name in self.fields & document.keys():
+            entries.setdefault(field_name, {}).setdefault(
+                document[field_name], set()).add(doc_id)
+
+        grams = self.grams.setdefault(table_name, {})
+        for field_name in self.text_fields & document.keys():
+            if isinstance(document[field_name], str):
+                for gram in trigrams(document[field_name]):
+                    grams.setdefault(field_name,
+                                     {}).setdefault(gram, set()).add(doc_id)
+
+    def remove(self, table_name, doc_id):
+        doc_id = str(doc_id)
+        document = self.tables.get(table_name, {}).pop(doc_id)
+        entries = self.entries.get(table_name, {})
+
+        for field_name in self.fields & document.keys():
+            entries[field_name][document[field_name]].discard(doc_id)
+
+        grams = self.grams.get(table_name, {})
+        for field_name in self.text_fields & document.keys():
+            if isinstance(document[field_name], str):
+                for gram in trigrams(document[field_name]):
+                    grams[field_name][gram].discard(doc_id)
+
+        return document
+
+    def update(self, table_name, doc_id, fields):
+        document = self.remove(table_name, doc_id)
+        self.add(table_name, doc_id, document | fields)
+
+    def candidates(self, table_name, rule, exact=True):
+        """Ids of the documents that can match a rule, or None if unknown"""
+        entries = self.entries.get(table_name, {})
+        grams = self.grams.get(table_name, {})
+        candidates = None
+
+        def _restrict(ids):
+            return ids if candidates is None else candidates & ids
+
+        for field, value in rule.items():
+            # Unhashable values, sent by clients, match no indexed field
+            if isinstance(value, OneOf):
+                if field.name in self.fields:
+                    ids = entries.get(field.name, {})
+                    candidates = _restrict(
+                        set().union(*(ids.get(item, set()) for item in value
+                                      if isinstance(item, Hashable))))
+
+            elif exact and field.name in self.fields:
+                candidates = _restrict(
+                    entries.get(field.name, {}).get(value, set())
+                    if isinstance(value, Hashable) else set())
+
+            # Patterns are regular expressions: only the literal ones can be
+            # looked up, as a string containing them contains their trigrams
+            elif (not exact and field.name in self.text_fields
+                  and isinstance(value, str) and len(value) >= 3
+                  and re.escape(value) == value):
+                for gram in trigrams(value):
+                    candidates = _restrict(
+                        grams.get(field.name, {}).get(gram, set()))
+
+        return candidates
+
+    def search(self, table_name, filters, exact=True):
+        documents = self.tables.get(table_name, {})
+
+        if not (rules := list(filter(None, filters))):
+            return list(documents.values())
+
+        def _match(document, rule):
+            for field, value in rule.items():
+                if field.name not in document:
+                    return False
+                if isinstance(value, OneOf):
+                    if document[field.name] not in value:
+                        return False
+                elif exact and document[field.name] != value:
+                    return False
+                elif not exact and not (isinstance(document[field.name], str)
+                                        and re.search(value,
+                                                      document[field.name])):
+                    return False
+            return True
+
+        matches = set()
+        for rule in rules:
+            candidates = self.candidates(table_name, rule, exact)
+            if candidates is None:
+                candidates = documents.keys()
+
+            matches.update(doc_id for doc_id in candidates
+                           if _match(documents[doc_id], rule))
+
+        # Keep the insertion order, as TinyDB does
+        return [documents[doc_id] for doc_id in sorted(matches, key=int)]
+
+    def join(self, join_params, filters, exact=True):
+        model1, model2, field1, field2 = join_params
+
+        for document in self.search(model1.table_name, filters, exact):
+            if field1.name not in document:
+                continue
+
+            for other in self.search(model2.table_name, [{
+                    field2: document[field1.name]
+            }]):
+                yield document | other
+
+
 class JSONDriver(AbstractDriver):
+    """
+    Driver for TinyDB files. TinyDB has no transactions: sessions only group
+    calls, and writes made before an error are kept.
+
+    Passing `?index=1` in the database location keeps the database in memory
+    with hash indexes on the indexed fields of the models, and trigram
+    indexes on their TEXT_SEARCH fields for lookups. Writes go through
+    to the file and update the indexes; changes made by other processes are
+    detected from the modification time and size of the file, which trigger
+    a reload, within the resolution of the file system timestamps.
+
+    Passing `?write_behind=1` holds writes in memory and writes the file
+    once `flush_writes` of them are pending, `flush_interval` milliseconds
+    after the first one, or at exit; changes not flushed are lost if the
+    process dies. `fsync=0` skips syncing the file after it is written. Both
+    are only fit for a database used by a single process.
+
+    The version of the database is a hash of the contents of the file, as
+    its modification time can stay the same across writes, or a count of the
+    writes of the driver when they are held in memory.
+    """
+    transactional = False
+
+    OPTIONS = {
+        'index': False,
+        'write_behind': False,
+        'flush_writes': 0,
+        'flush_interval': 0,
+        'fsync': True,
+    }
+
+    # Fields that are part of a primary key or declared INDEX or UNIQUE
+    INDEXED_FIELDS = frozenset(
+        field.name for model in OBJECTS for field in model.fields.fields
+        if field.datatype & {
+            Datatypes.PRIMARY_KEY,
+            Datatypes.INDEX,
+            Datatypes.UNIQUE,
+        })
+
+    # Fields whose lookups go through a trigram index
+    SEARCHED_FIELDS = frozenset(
+        field.name for model in OBJECTS for field in model.fields.fields
+        if Datatypes.TEXT_SEARCH in field.datatype)
 
     def __init__(self, database_location):
-        self.db = TinyDB(database_location)
+        super().__init__(database_location)
+        self.lock = threading.RLock()
+        self.stamp = None
+        self.instance = uuid.uuid4().hex
+        self.writes = 0
+
+        storage = FileStorage
+        if self.options['write_behind']:
+            storage = WriteBehindMiddleware(
+                FileStorage,
+                self.lock,
+                writes=self.options['flush_writes'],
+                interval=self.options['flush_interval'])
+
+        self.db = TinyDB(self.database_location,
+                         storage=storage,
+                         fsync=self.options['fsync'])
+
+        self.index = None
+        if self.options['index']:
+            self.index = Index(self.INDEXED_FIELDS, self.SEARCHED_FIELDS)
+
+    def stat(self):
+        try:
+            stat = os.stat(self.database_location)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def version(self):
+        if self.options['write_behind']:
+            return "%s.%d" % (self.instance, self.writes)
+
+        with self.lock:
+            try:
+                with open(self.database_location, 'rb') as datafile:
+                    return hashlib.sha256(datafile.read()).hexdigest()
+            except FileNotFoundError:
+                return ''
+
+    def refresh(self):
+        """Load the database and build the indexes if the file changed"""
+        if (stamp := self.stat()) != self.stamp or not self.index.loaded:
+            self.index.load(self.db.storage.read() or {})
+            self.stamp = stamp
+
+    def snapshot(self, fields):
+        """
+        Return an index of the current state of the database: the driver's in
+        indexed mode, or one built over fields otherwise
+        """
+        if self.index is not None:
+            self.refresh()
+            return self.index
+
+        index = Index(fields)
+        index.load(self.db.storage.read() or {})
+        return index
+
+    def track(self, table_name, before, doc_ids, fields=None):
+        """
+        Report a write on the indexes, or drop them if the file was modified
+        by someone else since they were built
+        """
+        if self.index is None:
+            return
+
+        if not self.index.loaded or self.stamp != before:
+            self.index.clear()
+            return
+
+        for doc_id in doc_ids:
+            if fields is None:
+                self.index.remove(table_name, doc_id)
+            elif str(doc_id) in self.index.tables.get(table_name, {}):
+                self.index.update(table_name, doc_id, fields)
+            else:
+                self.index.add(table_name, doc_id, dict(fields))
+
+        self.stamp = self.stat()
 
+    @measured
     def read(self,
              model: object,
              filters=[],
              columns=['*'],
-             exact=True) -> dict:
+             exact=True,
+             order=(),
+             after=None,
+             limit=None,
+             offset=0) -> dict:
         matches = []
 
-        if isinstance(model, tuple):
+        if self.index is not None:
+            with self.lock:
+                self.refresh()
+
+                if isinstance(model, tuple):
+                    matches = list(self.index.join(model, filters, exact))
+                else:
+                    matches = self.index.search(model.table_name, filters,
+                                                exact)
+
+        elif isinstance(model, tuple):
             # We need to join tables manually
             query = build_query(filters, exact)
 
@@ -85,8 +491,54 @@ class JSONDriver(AbstractDriver):
             else:
                 matches = table.all()
 
+        if order or limit is not None or offset:
+            matches = paginate(matches, order, after, limit, offset)
+
         return list(map(lambda x: select(x, columns, model), matches))
 
+    def aggregate(self, model, key, value, relations):
+        # The value is not looked up, as clients may send unhashable ones
+        aggregates = self.aggregate_many(model, key, [value], relations)
+        return next(iter(aggregates.values()), None)
+
+    @measured
+    def aggregate_many(self, model, key, values, relations):
+        # Every table access reads the whole file, so the database is loaded
+        # once and the documents are joined in memory
+        fields = {key.name}
+        for source, foreign, _ in relations.values():
+            fields.add(foreign.name)
+            if isinstance(source, tuple):
+                fields.add(source[3].name)
+
+        values = OneOf(values)
+        aggregates = {}
+
+        with self.lock:
+            index = self.snapshot(fields)
+
+            for record in index.search(model.table_name, [{key: values}]):
+                aggregates[record[key.name]] = (select(record, ['*'], model),
+                                                dict((name, [])
+                                                     for name in relations))
+
+            for name, (source, foreign, columns) in relations.items():
+                if isinstance(source, tuple):
+                    matches = index.join(source, [{foreign: values}])
+                else:
+                    matches = index.search(source.table_name,
+                                           [{
+                                               foreign: values
+                                           }])
+
+                for match in matches:
+                    if (value := match.get(foreign.name)) in aggregates:
+                        aggregates[value][1][name].append(
+                            select(match, columns, source))
+
+        return aggregates
+
+    @measured
     def write(self, model: object, record: dict, filters=[]) -> None:
         table = self.db.table(model.table_name, cache_size=0)
 
@@ -96,20 +548,49 @@ class JSONDriver(AbstractDriver):
                 record.items(),
             ))
 
-        if filters:
-            query = build_query(filters, True)
-            table.update(cast_record, query)
+        with self.lock:
+            before = self.stat()
 
-        else:
-            table.insert(cast_record)
+            if filters:
+                query = build_query(filters, True)
+                doc_ids = table.update(cast_record, query)
+            else:
+                doc_ids = [table.insert(cast_record)]
+
+            self.writes += 1
+            self.track(model.table_name, before, doc_ids, cast_record)
+
+    @measured
+    def write_many(self, model, records):
+        table = self.db.table(model.table_name, cache_size=0)
+
+        documents = [
+            dict((k.name, v) for (k, v) in record.items())
+            for record in records
+        ]
+
+        # A write rewrites the whole file, so everything is inserted at once
+        with self.lock:
+            before = self.stat()
+            doc_ids = table.insert_multiple(documents)
+            self.writes += 1
 
+            for doc_id, document in zip(doc_ids, documents):
+                self.track(model.table_name, before, [doc_id], document)
+                before = self.stamp
+
+    @measured
     def erase(self, model: object, filters=[]) -> None:
         table = self.db.table(model.table_name, cache_size=0)
 
-        if query := build_query(filters, True):
-            table.remove(query)
-        else:
+        if not (query := build_query(filters, True)):
             raise ValueError(filters)
 
+        with self.lock:
+            before = self.stat()
+            doc_ids = table.remove(query)
+            self.writes += 1
+            self.track(model.table_name, before, doc_ids)
+
 
 DRIVER = JSONDriver
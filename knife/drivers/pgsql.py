@@ -1,36 +1,113 @@
+import os
+import time
+import logging
+import itertools
+import threading
 import psycopg2
-from knife.drivers import AbstractDriver
-from knife.models.knife_model import Datatypes
+import psycopg2.pool
+import psycopg2.extras
+from knife.drivers import BATCH_SIZE, AbstractDriver, OneOf, starting_nodes
+from knife.exceptions import DatabaseBusy
+from knife.models.knife_model import Datatypes, Field
 
 DRIVER_NAME = 'pgsql'
 
 
+def column_name(column):
+    """Quote a field name, as some of them are reserved keywords"""
+    if isinstance(column, Field):
+        return '"%s"' % column.name
+    return column
+
+
+def order_column(column):
+    """
+    Sort text columns on their bytes, in the order Python compares strings,
+    whatever the collation of the database
+    """
+    if isinstance(column, Field) and Datatypes.TEXT in column.datatype:
+        return '%s COLLATE "C"' % column_name(column)
+    return column_name(column)
+
+
 def model_definition(model):
     datatypes = {
         Datatypes.TEXT: 'TEXT',
         Datatypes.INTEGER: 'INTEGER',
         Datatypes.BOOLEAN: 'BOOLEAN',
         Datatypes.REQUIRED: 'NOT NULL',
-        Datatypes.PRIMARY_KEY: ''
+        Datatypes.PRIMARY_KEY: '',
+        Datatypes.INDEX: '',
+        Datatypes.UNIQUE: '',
+        Datatypes.TEXT_SEARCH: '',
     }
 
-    TEMPLATE = "CREATE TABLE %s (%%s)" % model.table_name
+    TEMPLATE = "CREATE TABLE IF NOT EXISTS %s (%%s)" % model.table_name
     columns = []
     pks = []
 
     for field in model.fields.fields:
         modifiers = [datatypes[dt] for dt in field.datatype]
-        columns.append("%s %s" % (field.name, " ".join(modifiers)))
+        columns.append("%s %s" % (column_name(field), " ".join(modifiers)))
 
         if Datatypes.PRIMARY_KEY in field.datatype:
-            pks.append(field.name)
+            pks.append(column_name(field))
 
     columns.append("PRIMARY KEY (%s)" % ", ".join(pks))
 
     return TEMPLATE % (", ".join(columns))
 
 
+def index_definitions(model):
+    """
+    Index the fields declared with INDEX or UNIQUE. The leading column of
+    the primary key is already covered by the primary key index. Fields
+    declared with TEXT_SEARCH get a trigram index, which LIKE patterns use.
+    """
+    TEMPLATE = "CREATE %sINDEX IF NOT EXISTS %s_%s_index ON %s (%s)"
+    statements = []
+
+    for field in model.fields.fields:
+        if Datatypes.UNIQUE in field.datatype:
+            unique = 'UNIQUE '
+        elif Datatypes.INDEX in field.datatype:
+            unique = ''
+        else:
+            continue
+
+        statements.append(TEMPLATE % (unique, model.table_name, field.name,
+                                      model.table_name, column_name(field)))
+
+    searched = [
+        f for f in model.fields.fields if Datatypes.TEXT_SEARCH in f.datatype
+    ]
+
+    if searched:
+        statements.append("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    for field in searched:
+        statements.append("CREATE INDEX IF NOT EXISTS %s_%s_search ON %s "
+                          "USING gin (%s gin_trgm_ops)" %
+                          (model.table_name, field.name, model.table_name,
+                           column_name(field)))
+
+    return statements
+
+
+def join_string(table):
+    """Build the FROM clause of a join read"""
+    if isinstance(table, tuple) and len(table) == 4:
+        return "%s JOIN %s ON %s.%s = %s.%s" % (
+            table[0], table[1], table[0], column_name(table[2]), table[1],
+            column_name(table[3]))
+    return table
+
+
 def match_string(filters: list, exact: bool):
+    """
+    Build the WHERE clause of a statement. Values given as lists match any
+    of their items.
+    """
     parameters = {}
 
     if valid_filters := list(filter(lambda x: x, filters)):
@@ -41,11 +118,28 @@ def match_string(filters: list, exact: bool):
         for index, f in enumerate(valid_filters):
             rule = []
             for column, value in f.items():
+                if isinstance(value, OneOf):
+                    names = [
+                        "%s_%d_%d" % (column.name, index, position)
+                        for position in range(len(value))
+                    ]
+                    rule.append("%s IN (%s)" % (column_name(column), ', '.join(
+                        "%%(%s)s" % name
+                        for name in names)) if names else 'FALSE')
+                    parameters.update(zip(names, value))
+                    continue
+
+                # Columns hold scalars, which other values never equal
+                if isinstance(value, (list, tuple, set, dict)):
+                    rule.append('FALSE')
+                    continue
+
                 if not exact:
                     value = "%%%s%%" % value
-                parameters.update({"%s_%d" % (column, index): value})
-                rule.append("%s %s %%(%s_%d)s" %
-                            (column, match_operator, column, index))
+                parameters.update({"%s_%d" % (column.name, index): value})
+                rule.append("%s %s %%(%s_%d)s" % (column_name(column),
+                                                  match_operator, column.name,
+                                                  index))
             rules.append(" AND ".join(rule))
 
         template += " OR ".join(rules)
@@ -54,73 +148,413 @@ def match_string(filters: list, exact: bool):
     return '', {}
 
 
+def page_string(where: str, order=(), after=None, limit=None, offset=0):
+    """
+    Complete a WHERE clause to select a page of results: records sorting
+    after the values of the keyset cursor after, ordered on the fields of
+    order, skipping offset records and returning at most limit
+    """
+    template, parameters = where, {}
+
+    if after:
+        keyset = "(%s) > (%s)" % (', '.join(map(order_column, order)),
+                                  ', '.join("%%(after_%d)s" % index
+                                            for index in range(len(after))))
+        parameters.update(
+            ("after_%d" % index, value) for index, value in enumerate(after))
+
+        if template:
+            template = " WHERE (%s) AND %s" % (template[len(' WHERE '):],
+                                               keyset)
+        else:
+            template = " WHERE %s" % keyset
+
+    if order:
+        template += " ORDER BY %s" % ', '.join(map(order_column, order))
+
+    if limit is not None:
+        template += " LIMIT %(limit)s"
+        parameters['limit'] = limit
+
+    if offset:
+        template += " OFFSET %(offset)s"
+        parameters['offset'] = offset
+
+    return template, parameters
+
+
+def table_name(model):
+    """Name of the table of a model, or of the tables of a join"""
+    if isinstance(model, tuple):
+        return (model[0].table_name, model[1].table_name, *model[2:])
+    return model.table_name
+
+
+def selected_columns(model, columns):
+    """Fields of the records read from model, '*' standing for all of them"""
+    if columns == ['*']:
+        if isinstance(model, tuple):
+            return model[0].fields.fields + model[1].fields.fields
+        return model.fields.fields
+    return columns
+
+
 def transaction(func):
 
     def wrapper(*args, **kwargs):
         driver, model = args[:2]
 
-        if isinstance(model, tuple):
-            table = (model[0].table_name, model[1].table_name, *model[2:])
-        else:
-            table = model.table_name
-
-        args = (driver, table, *args[2:])
+        args = (driver, table_name(model), *args[2:])
 
-        driver.setup()
-        template, parameters = func(*args, **kwargs)
-        print(template, parameters)
-        driver.cursor.execute(template, parameters)
+        # Statements run in the transaction of the session if one is open
+        session = driver.in_session
+        if not session:
+            driver.setup()
 
         try:
-            data = driver.cursor.fetchall()
-        except psycopg2.ProgrammingError:
-            data = []
+            template, parameters = func(*args, **kwargs)
+
+            logging.debug("%s %s" % (template, str(parameters)))
+
+            start = time.perf_counter()
+            driver.cursor.execute(template, parameters)
+
+            try:
+                data = driver.cursor.fetchall()
+            except psycopg2.ProgrammingError:
+                data = []
 
-        driver.close()
+            driver.record(template,
+                          len(data) or max(driver.cursor.rowcount, 0),
+                          time.perf_counter() - start)
+        finally:
+            if not session:
+                driver.close()
 
         if 'columns' in func.__code__.co_varnames:
-            if (columns := kwargs.get('columns', ['*'])) == ['*']:
-                columns = list(model.fields)
+            columns = selected_columns(model, kwargs.get('columns', ['*']))
             data = [dict(zip(columns, record)) for record in data]
 
         return data
 
     wrapper.__name__ = func.__name__
+    wrapper.__wrapped__ = func
     return wrapper
 
 
 class PostGresDriver(AbstractDriver):
+    """
+    Driver for PostgreSQL databases. Passing `?pool=1` in the database
+    location keeps connections open in a pool shared by the threads of each
+    worker, sized by `pool_min` and `pool_max`. Threads wait up to
+    `pool_timeout` seconds for a connection when all of them are in use.
+    Pooled connections are replaced after
+    `pool_recycle` seconds, and checked with a round trip before being handed
+    out if `pool_ping` is set.
+    """
+    OPTIONS = {
+        'sslmode': 'require',
+        'pool': False,
+        'pool_min': 1,
+        'pool_max': 10,
+        'pool_recycle': 3600,
+        'pool_ping': False,
+        'pool_timeout': 30.0,
+    }
+
+    def __init__(self, database_location):
+        super().__init__(database_location)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pool_pid = None
+        self.slots = None
+        self.birth = {}
+        self.cursors = itertools.count()
+
+    @property
+    def connexion(self):
+        return getattr(self.local, 'connexion', None)
+
+    @connexion.setter
+    def connexion(self, value):
+        self.local.connexion = value
+
+    @property
+    def cursor(self):
+        return getattr(self.local, 'cursor', None)
+
+    @cursor.setter
+    def cursor(self, value):
+        self.local.cursor = value
+
+    def connection_pool(self):
+        # The pool is created lazily so that every forked worker gets its own
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.options['pool_min'],
+                    self.options['pool_max'],
+                    self.database_location,
+                    sslmode=self.options['sslmode'])
+                self.pool_pid = os.getpid()
+                # Checkouts wait for a slot, the pool failing when exhausted
+                self.slots = threading.BoundedSemaphore(
+                    self.options['pool_max'])
+                self.birth = {}
+
+        return self.pool
+
+    def stats(self):
+        # The pool of a forked worker is not created until it is used
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                return {}
+
+            return {
+                'pool_used': len(self.pool._used),
+                'pool_idle': len(self.pool._pool),
+                'pool_max': self.pool.maxconn,
+            }
+
+    def healthy(self, connexion):
+        if connexion.closed:
+            return False
+
+        with self.lock:
+            born = self.birth.setdefault(connexion, time.monotonic())
+        if (self.options['pool_recycle']
+                and time.monotonic() - born > self.options['pool_recycle']):
+            return False
+
+        if self.options['pool_ping']:
+            try:
+                with connexion.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                connexion.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def discard(self, connexion):
+        with self.lock:
+            self.birth.pop(connexion, None)
+        self.pool.putconn(connexion, close=True)
+
+    def checkout(self):
+        pool = self.connection_pool()
+        if not self.slots.acquire(timeout=self.options['pool_timeout']):
+            raise DatabaseBusy()
+
+        try:
+            # Once the idle connections are discarded, new ones are opened
+            for _ in range(self.options['pool_max'] + 1):
+                connexion = pool.getconn()
+
+                if self.healthy(connexion):
+                    return connexion
+
+                self.discard(connexion)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        self.slots.release()
+        raise psycopg2.OperationalError("No healthy database connection")
 
     def setup(self, params=None):
-        self.connexion = psycopg2.connect(self.database_location,
-                                          sslmode='require')
-        self.cursor = self.connexion.cursor()
+        if self.options['pool']:
+            self.connexion = self.checkout()
+        else:
+            self.connexion = psycopg2.connect(self.database_location,
+                                              sslmode=self.options['sslmode'])
+
+        try:
+            self.cursor = self.connexion.cursor()
+        except BaseException:
+            self.drop()
+            raise
+
+    def release(self, connexion, broken=False):
+        if not self.options['pool']:
+            connexion.close()
+            return
+
+        if broken:
+            self.discard(connexion)
+        else:
+            self.pool.putconn(connexion)
+        self.slots.release()
 
     def close(self):
-        self.connexion.commit()
-        self.connexion.close()
+        connexion, self.connexion = self.connexion, None
+
+        try:
+            connexion.commit()
+        except psycopg2.Error:
+            self.release(connexion, broken=True)
+            raise
+
+        self.release(connexion)
+
+    def drop(self):
+        """Give back a connection that failed before its session started"""
+        connexion, self.connexion = self.connexion, None
+        self.release(connexion, broken=True)
+
+    def begin(self, readonly=False):
+        self.setup()
+
+        if readonly:
+            try:
+                self.cursor.execute('SET TRANSACTION READ ONLY')
+            except BaseException:
+                self.drop()
+                raise
+
+    def commit(self):
+        self.close()
+
+    def rollback(self):
+        connexion, self.connexion = self.connexion, None
+
+        try:
+            connexion.rollback()
+        except psycopg2.Error:
+            self.release(connexion, broken=True)
+            raise
+
+        self.release(connexion)
+
+    def migrate(self, models):
+        with self.session():
+            for model in models:
+                self.cursor.execute(model_definition(model))
 
     @transaction
-    def read(self, table, filters=[], columns=['*'], exact=True):
-        if isinstance(table, tuple) and len(table) == 4:
-            table = "%s JOIN %s ON %s.%s = %s.%s" % (
-                table[0], table[1], table[0], table[2], table[1], table[3])
+    def _closure(self, table, source, target, starts):
+        # UNION discards the nodes already visited, which stops on cycles
+        template = ("WITH RECURSIVE closure(node) AS ("
+                    "SELECT unnest(CAST(%%(starts)s AS TEXT[])) UNION "
+                    "SELECT %s.%s FROM %s JOIN closure ON %s.%s = closure.node"
+                    ") SELECT node FROM closure") % (
+                        table, column_name(target), table, table,
+                        column_name(source))
 
-        template = 'SELECT %s FROM %s' % (', '.join(columns), table)
+        return template, {'starts': starts}
+
+    def transitive_closure(self, model, source, target, start):
+        if not (starts := starting_nodes(start)):
+            return set()
+
+        return set(node for (node, ) in self._closure(model, source, target,
+                                                      starts))
+
+    @transaction
+    def _aggregate(self, table, key, value, relations):
+        # Every relation is packed in a JSON array by a correlated subquery,
+        # so the record and its relations come back as a single row
+        subqueries = []
+
+        for source, foreign, selected in relations.values():
+            if isinstance(source, tuple):
+                origin = source[0].table_name
+                source = (source[0].table_name, source[1].table_name,
+                          *source[2:])
+            else:
+                origin = source = source.table_name
+
+            subqueries.append(
+                "COALESCE((SELECT json_agg(json_build_array(%s)) FROM %s "
+                "WHERE %s.%s = parent.%s), '[]')" %
+                (', '.join(map(column_name, selected)), join_string(source),
+                 origin, column_name(foreign), column_name(key)))
+
+        template = ('SELECT parent.*, %s FROM %s AS parent '
+                    'WHERE parent.%s = %%(value)s') % (', '.join(subqueries),
+                                                       table, column_name(key))
+
+        return template, {'value': value}
+
+    def aggregate(self, model, key, value, relations):
+        if not (rows := self._aggregate(model, key, value, relations)):
+            return None
+
+        fields = model.fields.fields
+        record = dict(zip(fields, rows[0][:len(fields)]))
+
+        # psycopg2 decodes json columns on its own
+        related = {}
+        for (name, (_, _, columns)), data in zip(relations.items(),
+                                                 rows[0][len(fields):]):
+            related[name] = [dict(zip(columns, values)) for values in data]
+
+        return record, related
+
+    @transaction
+    def read(self,
+             table,
+             filters=[],
+             columns=['*'],
+             exact=True,
+             order=(),
+             after=None,
+             limit=None,
+             offset=0):
+        template = 'SELECT %s FROM %s' % (', '.join(map(
+            column_name, columns)), join_string(table))
 
         addendum, parameters = match_string(filters, exact)
+        addendum, page = page_string(addendum, order, after, limit, offset)
+        parameters.update(page)
 
         return template + addendum, parameters
 
+    def iterate(self, model, filters=[], columns=['*'], exact=True, order=()):
+        if not self.in_session:
+            with self.session(readonly=True):
+                yield from self.iterate(model, filters, columns, exact, order)
+            return
+
+        template, parameters = PostGresDriver.read.__wrapped__(
+            self, table_name(model), filters, columns, exact, order)
+        columns = selected_columns(model, columns)
+
+        logging.debug("%s %s" % (template, str(parameters)))
+
+        # A named cursor is kept on the server, which sends the rows a batch
+        # at a time instead of all at once
+        cursor = self.connexion.cursor(name="knife_iterate_%d" %
+                                       next(self.cursors))
+        # Only the time spent in the database is measured, not the caller's
+        rows, seconds = 0, 0.0
+        try:
+            start = time.perf_counter()
+            cursor.execute(template, parameters)
+
+            while batch := cursor.fetchmany(BATCH_SIZE):
+                seconds += time.perf_counter() - start
+                rows += len(batch)
+
+                for row in batch:
+                    yield dict(zip(columns, row))
+
+                start = time.perf_counter()
+        finally:
+            cursor.close()
+            self.record(template, rows, seconds)
+
     @transaction
     def write(self, table: str, record: dict, filters=[]) -> None:
         if filters:
             # if filters are there, we update values
 
             # Put a stamp in case a key is both a filter and a target
-            values = ', '.join(
-                ["%s = %%(record_%s)s" % (k, k) for k in record.keys()])
-            stamped_record = dict([('record_' + k, v)
+            values = ', '.join([
+                "%s = %%(record_%s)s" % (column_name(k), k.name)
+                for k in record.keys()
+            ])
+            stamped_record = dict([('record_' + k.name, v)
                                    for (k, v) in record.items()])
 
             template = 'UPDATE %s SET %s' % (table, values)
@@ -135,15 +569,38 @@ class PostGresDriver(AbstractDriver):
 
         else:
             # if not, a simple insert
-            columns = ', '.join(record.keys())
-            values = ', '.join(["%%(%s)s" % key for key in record.keys()])
+            columns = ', '.join(map(column_name, record.keys()))
+            values = ', '.join(["%%(%s)s" % key.name for key in record.keys()])
 
             template = 'INSERT INTO %s (%s) VALUES (%s)' % (table, columns,
                                                             values)
-            parameters = record
+            parameters = dict((k.name, v) for (k, v) in record.items())
 
         return template, parameters
 
+    def write_many(self, model, records):
+        if not records:
+            return
+
+        if not self.in_session:
+            with self.session():
+                return self.write_many(model, records)
+
+        fields = list(records[0].keys())
+        template = 'INSERT INTO %s (%s) VALUES %%s' % (
+            model.table_name, ', '.join(map(column_name, fields)))
+
+        logging.debug("%s (%d records)" % (template, len(records)))
+
+        # Rows are sent BATCH_SIZE at a time in multi-row VALUES statements
+        start = time.perf_counter()
+        psycopg2.extras.execute_values(
+            self.cursor,
+            template, [tuple(record[field] for field in fields)
+                       for record in records],
+            page_size=BATCH_SIZE)
+        self.record(template, len(records), time.perf_counter() - start)
+
     @transaction
     def erase(self, table: str, filters=[]) -> None:
         template = 'DELETE FROM %s' % table
@@ -1,10 +1,37 @@
+import os
+import re
+import json
+import time
 import sqlite3
 import logging
-from knife.drivers import AbstractDriver
-from knife.models.knife_model import Datatypes
+from knife.drivers import BATCH_SIZE, AbstractDriver, OneOf, starting_nodes
+from knife.models.knife_model import Datatypes, Field
 
 DRIVER_NAME = 'sqlite'
 
+# Patterns matching at least this many records through a full-text table
+# are matched by scanning the table instead: the full-text lookups of broad
+# patterns are slower than a scan
+SEARCH_LIMIT = 100
+
+
+def column_name(column):
+    """Quote a field name, as some of them are reserved keywords"""
+    if isinstance(column, Field):
+        return '"%s"' % column.name
+    return column
+
+
+def cast_record(columns, record):
+    """Key a row by the fields selected and restore boolean values"""
+
+    def _cast(field, value):
+        if value is not None and Datatypes.BOOLEAN in field.datatype:
+            return bool(value)
+        return value
+
+    return dict((f, _cast(f, v)) for (f, v) in zip(columns, record))
+
 
 def model_definition(model):
     datatypes = {
@@ -12,26 +39,118 @@ def model_definition(model):
         Datatypes.INTEGER: 'INTEGER',
         Datatypes.BOOLEAN: 'INTEGER',
         Datatypes.REQUIRED: 'NOT NULL',
-        Datatypes.PRIMARY_KEY: ''
+        Datatypes.PRIMARY_KEY: '',
+        Datatypes.INDEX: '',
+        Datatypes.UNIQUE: '',
+        Datatypes.TEXT_SEARCH: '',
     }
 
-    TEMPLATE = "CREATE TABLE %s (%%s)" % model.table_name
+    TEMPLATE = "CREATE TABLE IF NOT EXISTS %s (%%s)" % model.table_name
     columns = []
     pks = []
 
     for field in model.fields.fields:
         modifiers = [datatypes[dt] for dt in field.datatype]
-        columns.append("%s %s" % (field.name, " ".join(modifiers)))
+        columns.append("%s %s" % (column_name(field), " ".join(modifiers)))
 
         if Datatypes.PRIMARY_KEY in field.datatype:
-            pks.append(field.name)
+            pks.append(column_name(field))
 
     columns.append("PRIMARY KEY (%s)" % ", ".join(pks))
 
     return TEMPLATE % (", ".join(columns))
 
 
-def match_string(filters: list, exact: bool):
+def index_definitions(model):
+    """
+    Index the fields declared with INDEX or UNIQUE. The leading column of
+    the primary key is already covered by the primary key index. Fields
+    declared with TEXT_SEARCH get a full-text table, see search_definitions.
+    """
+    TEMPLATE = "CREATE %sINDEX IF NOT EXISTS %s_%s_index ON %s (%s)"
+    statements = []
+
+    for field in model.fields.fields:
+        if Datatypes.UNIQUE in field.datatype:
+            unique = 'UNIQUE '
+        elif Datatypes.INDEX in field.datatype:
+            unique = ''
+        else:
+            continue
+
+        statements.append(TEMPLATE % (unique, model.table_name, field.name,
+                                      model.table_name, column_name(field)))
+
+    return statements + search_definitions(model)
+
+
+def search_table(table_name):
+    return "%s_search" % table_name
+
+
+def search_definitions(model):
+    """
+    Create a trigram FTS5 table over the fields declared with TEXT_SEARCH,
+    kept in sync with the table by triggers. It is filled from the contents
+    of the table when it does not index the same rows, as when it was just
+    created or VACUUM renumbered the rowids.
+    """
+    fields = [
+        column_name(f) for f in model.fields.fields
+        if Datatypes.TEXT_SEARCH in f.datatype
+    ]
+
+    if not fields:
+        return []
+
+    table = model.table_name
+    search = search_table(table)
+    columns = ", ".join(fields)
+    new = ", ".join("new.%s" % f for f in fields)
+    old = ", ".join("old.%s" % f for f in fields)
+
+    insert = "INSERT INTO %s(rowid, %s) VALUES (new.rowid, %s);" % (
+        search, columns, new)
+    delete = ("INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.rowid, %s);"
+              % (search, search, columns, old))
+
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content=%s, "
+        "content_rowid=rowid, tokenize=trigram)" % (search, columns, table),
+        "CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON %s "
+        "BEGIN %s END" % (search, table, insert),
+        "CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON %s "
+        "BEGIN %s END" % (search, table, delete),
+        "CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE ON %s "
+        "BEGIN %s %s END" % (search, table, delete, insert),
+        "INSERT INTO %s(%s) SELECT 'rebuild' WHERE "
+        "(SELECT count(*), total(id) FROM %s_docsize) IS NOT "
+        "(SELECT count(*), total(rowid) FROM %s)" % (search, search, search,
+                                                      table),
+    ]
+
+
+def searchable(pattern):
+    """Whether a LIKE pattern holds a literal run long enough for trigrams"""
+    return any(len(run) >= 3 for run in re.split('[%_]', pattern))
+
+
+def join_string(table):
+    """Build the FROM clause of a join read"""
+    if isinstance(table, tuple) and len(table) == 4:
+        return "%s JOIN %s ON %s.%s = %s.%s" % (
+            table[0], table[1], table[0], column_name(table[2]), table[1],
+            column_name(table[3]))
+    return table
+
+
+def match_string(filters: list, exact: bool, search=None):
+    """
+    Build the WHERE clause of a statement. Values given as lists match any
+    of their items. If search is set, it is called with the TEXT_SEARCH
+    fields and their patterns, and returns the rowids they match, or None
+    to scan the table for them.
+    """
     parameters = {}
 
     if valid_filters := list(filter(None, filters)):
@@ -42,11 +161,32 @@ def match_string(filters: list, exact: bool):
         for index, f in enumerate(valid_filters):
             rule = []
             for column, value in f.items():
+                if isinstance(value, OneOf):
+                    names = [
+                        "%s_%d_%d" % (column.name, index, position)
+                        for position in range(len(value))
+                    ]
+                    rule.append("%s IN (%s)" % (column_name(column), ', '.join(
+                        ":%s" % name for name in names)) if names else '0')
+                    parameters.update(zip(names, value))
+                    continue
+
+                # Columns hold scalars, which other values never equal
+                if isinstance(value, (list, tuple, set, dict)):
+                    rule.append('0')
+                    continue
+
+                condition = "%s %s :%s_%d" % (column_name(column),
+                                              match_operator, column.name,
+                                              index)
+                if (not exact and search
+                        and Datatypes.TEXT_SEARCH in column.datatype
+                        and (rowids := search(column, value)) is not None):
+                    condition = "rowid IN (%s)" % ', '.join(map(str, rowids))
                 if not exact:
                     value = "%%%s%%" % value
-                rule.append("%s %s :%s_%d" %
-                            (column, match_operator, column, index))
-                parameters.update({"%s_%d" % (column, index): value})
+                rule.append(condition)
+                parameters.update({"%s_%d" % (column.name, index): value})
             rules.append(" AND ".join(rule))
 
         template += " OR ".join(rules)
@@ -55,73 +195,331 @@ def match_string(filters: list, exact: bool):
     return '', {}
 
 
+def page_string(where: str, order=(), after=None, limit=None, offset=0):
+    """
+    Complete a WHERE clause to select a page of results: records sorting
+    after the values of the keyset cursor after, ordered on the fields of
+    order, skipping offset records and returning at most limit
+    """
+    template, parameters = where, {}
+
+    if after:
+        keyset = "(%s) > (%s)" % (', '.join(map(column_name, order)),
+                                  ', '.join(":after_%d" % index
+                                            for index in range(len(after))))
+        parameters.update(
+            ("after_%d" % index, value) for index, value in enumerate(after))
+
+        if template:
+            template = " WHERE (%s) AND %s" % (template[len(' WHERE '):],
+                                               keyset)
+        else:
+            template = " WHERE %s" % keyset
+
+    if order:
+        template += " ORDER BY %s" % ', '.join(map(column_name, order))
+
+    if limit is not None or offset:
+        # sqlite only accepts OFFSET after a LIMIT, where -1 means none
+        template += " LIMIT :limit"
+        parameters['limit'] = -1 if limit is None else limit
+
+    if offset:
+        template += " OFFSET :offset"
+        parameters['offset'] = offset
+
+    return template, parameters
+
+
+def table_name(model):
+    """Name of the table of a model, or of the tables of a join"""
+    if isinstance(model, tuple):
+        return (model[0].table_name, model[1].table_name, *model[2:])
+    return model.table_name
+
+
+def selected_columns(model, columns):
+    """Fields of the records read from model, '*' standing for all of them"""
+    if columns == ['*']:
+        if isinstance(model, tuple):
+            return model[0].fields.fields + model[1].fields.fields
+        return model.fields.fields
+    return columns
+
+
 def transaction(func):
 
     def wrapper(*args, **kwargs):
         driver, model = args[:2]
 
-        if isinstance(model, tuple):
-            table_name = (model[0].table_name, model[1].table_name, *model[2:])
-        else:
-            table_name = model.table_name
+        args = (driver, table_name(model), *args[2:])
 
-        args = (driver, table_name, *args[2:])
+        # Statements run in the transaction of the session if one is open
+        session = driver.in_session
+        if not session:
+            driver.setup()
 
-        driver.setup()
-        template, parameters = func(*args, **kwargs)
+        try:
+            template, parameters = func(*args, **kwargs)
 
-        logging.debug("%s %s" % (template, str(parameters)))
+            logging.debug("%s %s" % (template, str(parameters)))
+
+            start = time.perf_counter()
+            driver.cursor.execute(template, parameters)
+            data = driver.cursor.fetchall()
 
-        driver.cursor.execute(template, parameters)
-        data = driver.cursor.fetchall()
-        driver.close()
+            driver.record(template,
+                          len(data) or max(driver.cursor.rowcount, 0),
+                          time.perf_counter() - start)
+        finally:
+            if not session:
+                driver.close()
 
         if 'columns' in func.__code__.co_varnames:
-            if (columns := kwargs.get('columns', ['*'])) == ['*']:
-                columns = list(model.fields)
-            data = [dict(zip(columns, record)) for record in data]
+            columns = selected_columns(model, kwargs.get('columns', ['*']))
+            data = [cast_record(columns, record) for record in data]
 
         return data
 
     wrapper.__name__ = func.__name__
+    wrapper.__wrapped__ = func
     return wrapper
 
 
 class SqliteDriver(AbstractDriver):
+    """
+    Driver for sqlite databases. Passing `?pool=1` in the database location
+    keeps one connection open per thread of each worker instead of opening a
+    new one for every statement.
+
+    Passing `?search=1` matches lookup patterns on TEXT_SEARCH fields through
+    the FTS5 tables created by index_definitions, instead of scanning, when
+    they have a run of three literal characters and match fewer than
+    SEARCH_LIMIT records. The FTS5 tables refer to the implicit rowids of
+    the tables, which VACUUM may change: migrate rebuilds them when they
+    are out of date.
+    """
+    OPTIONS = {
+        'pool': False,
+        'search': False,
+    }
+
+    @property
+    def connexion(self):
+        return getattr(self.local, 'connexion', None)
+
+    @connexion.setter
+    def connexion(self, value):
+        self.local.connexion = value
+
+    @property
+    def cursor(self):
+        return getattr(self.local, 'cursor', None)
+
+    @cursor.setter
+    def cursor(self, value):
+        self.local.cursor = value
 
     def setup(self, params=None):
-        self.connexion = sqlite3.connect(self.database_location)
+        # Connections cannot be shared with a forked worker, so a pooled
+        # connection is only reused by the process that opened it
+        if not (self.options['pool'] and self.connexion
+                and self.local.pid == os.getpid()):
+            self.connexion = sqlite3.connect(self.database_location)
+            self.local.pid = os.getpid()
 
         if params:
             self.connexion.execute(params)
 
         self.cursor = self.connexion.cursor()
 
+    def release(self):
+        if not self.options['pool']:
+            self.connexion.close()
+            self.connexion = None
+
     def close(self):
-        self.connexion.commit()
-        self.connexion.close()
+        try:
+            self.connexion.commit()
+        finally:
+            self.release()
+
+    def begin(self, readonly=False):
+        self.setup()
+        # Take the write lock right away so that the checks made by a request
+        # still hold when it writes
+        self.cursor.execute('BEGIN' if readonly else 'BEGIN IMMEDIATE')
+
+    def commit(self):
+        self.close()
+
+    def rollback(self):
+        try:
+            self.connexion.rollback()
+        finally:
+            self.release()
+
+    def migrate(self, models):
+        with self.session():
+            for model in models:
+                self.cursor.execute(model_definition(model))
+
+                # Also rebuilds the full-text tables whose rowids are out of
+                # date, as after a VACUUM
+                if self.options['search']:
+                    for statement in search_definitions(model):
+                        self.cursor.execute(statement)
+
+    def searched(self, table, column, pattern):
+        """
+        Return the rowids of table whose column matches pattern according to
+        its full-text table, or None if scanning table is expected to be
+        faster
+        """
+        if not searchable(pattern):
+            return None
+
+        # Broad patterns stop at the point where scanning is faster
+        template = "SELECT rowid FROM %s WHERE %s LIKE ? LIMIT %d" % (
+            search_table(table), column_name(column), SEARCH_LIMIT)
+
+        start = time.perf_counter()
+        self.cursor.execute(template, ("%%%s%%" % pattern, ))
+        rowids = [rowid for (rowid, ) in self.cursor.fetchall()]
+        self.record(template, len(rowids), time.perf_counter() - start)
+
+        return rowids if len(rowids) < SEARCH_LIMIT else None
 
     @transaction
-    def read(self, table, filters=[], columns=['*'], exact=True):
-        if isinstance(table, tuple) and len(table) == 4:
-            table = "%s JOIN %s ON %s.%s = %s.%s" % (
-                table[0], table[1], table[0], table[2], table[1], table[3])
+    def _closure(self, table, source, target, starts):
+        # UNION discards the nodes already visited, which stops on cycles.
+        # The start nodes are sent as a single JSON array, as the number of
+        # parameters and of the rows of a VALUES clause are both limited.
+        template = ("WITH RECURSIVE closure(node) AS ("
+                    "SELECT value FROM json_each(:starts) UNION "
+                    "SELECT %s.%s FROM %s JOIN closure ON %s.%s = closure.node"
+                    ") SELECT node FROM closure") % (
+                        table, column_name(target), table, table,
+                        column_name(source))
+
+        return template, {'starts': json.dumps(starts)}
+
+    def transitive_closure(self, model, source, target, start):
+        if not (starts := starting_nodes(start)):
+            return set()
+
+        return set(node for (node, ) in self._closure(model, source, target,
+                                                      starts))
 
-        template = 'SELECT %s FROM %s' % (', '.join(columns), table)
+    @transaction
+    def _aggregate(self, table, key, value, relations):
+        # Every relation is packed in a JSON array by a correlated subquery,
+        # so the record and its relations come back as a single row
+        subqueries = []
+
+        for source, foreign, selected in relations.values():
+            if isinstance(source, tuple):
+                origin = source[0].table_name
+                source = (source[0].table_name, source[1].table_name,
+                          *source[2:])
+            else:
+                origin = source = source.table_name
+
+            subqueries.append(
+                "(SELECT json_group_array(json_array(%s)) FROM %s "
+                "WHERE %s.%s = parent.%s)" %
+                (', '.join(map(column_name, selected)), join_string(source),
+                 origin, column_name(foreign), column_name(key)))
+
+        template = ('SELECT parent.*, %s FROM %s AS parent '
+                    'WHERE parent.%s = :value') % (', '.join(subqueries),
+                                                   table, column_name(key))
+
+        return template, {'value': value}
+
+    def aggregate(self, model, key, value, relations):
+        if not (rows := self._aggregate(model, key, value, relations)):
+            return None
+
+        fields = model.fields.fields
+        record = cast_record(fields, rows[0][:len(fields)])
+
+        related = {}
+        for (name, (_, _, columns)), data in zip(relations.items(),
+                                                 rows[0][len(fields):]):
+            related[name] = [
+                cast_record(columns, values) for values in json.loads(data)
+            ]
+
+        return record, related
 
-        addendum, parameters = match_string(filters, exact)
+    @transaction
+    def read(self,
+             table,
+             filters=[],
+             columns=['*'],
+             exact=True,
+             order=(),
+             after=None,
+             limit=None,
+             offset=0):
+        template = 'SELECT %s FROM %s' % (', '.join(map(
+            column_name, columns)), join_string(table))
+
+        search = None
+        if self.options['search'] and not isinstance(table, tuple):
+            search = lambda column, pattern: self.searched(
+                table, column, pattern)
+
+        addendum, parameters = match_string(filters, exact, search)
+        addendum, page = page_string(addendum, order, after, limit, offset)
+        parameters.update(page)
 
         return template + addendum, parameters
 
+    def iterate(self, model, filters=[], columns=['*'], exact=True, order=()):
+        if not self.in_session:
+            with self.session(readonly=True):
+                yield from self.iterate(model, filters, columns, exact, order)
+            return
+
+        template, parameters = SqliteDriver.read.__wrapped__(
+            self, table_name(model), filters, columns, exact, order)
+        columns = selected_columns(model, columns)
+
+        logging.debug("%s %s" % (template, str(parameters)))
+
+        # A cursor of its own lets several iterations run side by side
+        cursor = self.connexion.cursor()
+        # Only the time spent in the database is measured, not the caller's
+        rows, seconds = 0, 0.0
+        try:
+            start = time.perf_counter()
+            cursor.execute(template, parameters)
+
+            while batch := cursor.fetchmany(BATCH_SIZE):
+                seconds += time.perf_counter() - start
+                rows += len(batch)
+
+                for row in batch:
+                    yield cast_record(columns, row)
+
+                start = time.perf_counter()
+        finally:
+            cursor.close()
+            self.record(template, rows, seconds)
+
     @transaction
     def write(self, table: str, record: dict, filters=[]) -> None:
         if filters:
             # if filters are there, we update values
 
             # Put a stamp in case a key is both a filter and a target
-            values = ', '.join(
-                ["%s = :record_%s" % (k, k) for k in record.keys()])
-            stamped_record = dict([('record_' + k, v)
+            values = ', '.join([
+                "%s = :record_%s" % (column_name(k), k.name)
+                for k in record.keys()
+            ])
+            stamped_record = dict([('record_' + k.name, v)
                                    for (k, v) in record.items()])
 
             template = 'UPDATE %s SET %s' % (table, values)
@@ -136,15 +534,37 @@ class SqliteDriver(AbstractDriver):
 
         else:
             # if not, a simple insert
-            columns = ', '.join(record.keys())
-            values = ', '.join([":%s" % key for key in record.keys()])
+            columns = ', '.join(map(column_name, record.keys()))
+            values = ', '.join([":%s" % key.name for key in record.keys()])
 
             template = 'INSERT INTO %s (%s) VALUES (%s)' % (table, columns,
                                                             values)
-            parameters = record
+            parameters = dict((k.name, v) for (k, v) in record.items())
 
         return template, parameters
 
+    def write_many(self, model, records):
+        if not records:
+            return
+
+        if not self.in_session:
+            with self.session():
+                return self.write_many(model, records)
+
+        # Every record holds the same fields, so the insert statement of the
+        # first one is executed for all of them
+        template, _ = SqliteDriver.write.__wrapped__(self, model.table_name,
+                                                     records[0])
+
+        logging.debug("%s (%d records)" % (template, len(records)))
+
+        start = time.perf_counter()
+        self.cursor.executemany(
+            template,
+            [dict((k.name, v) for (k, v) in record.items())
+             for record in records])
+        self.record(template, len(records), time.perf_counter() - start)
+
     @transaction
     def erase(self, table: str, filters=[]) -> None:
         template = 'DELETE FROM %s' % table
@@ -205,3 +205,13 @@ class DependencyCycle(KnifeError):
 
     def __str__(self):
         return "Dependency cycle detected"
+
+
+class DatabaseBusy(KnifeError):
+
+    def __init__(self):
+        super().__init__()
+        self.status = 503
+
+    def __str__(self):
+        return "No database connection available"
@@ -0,0 +1,83 @@
+"""
+import.py
+
+Load recipe documents into the database configured by DATABASE_TYPE and
+DATABASE_URL, without going through the API:
+
+    python -m knife.import cookbook.ndjson [other.json ...]
+
+Documents are read from the standard input when no file is given.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from knife.drivers import DRIVERS, get_driver
+from knife.exceptions import KnifeError
+from knife.models import OBJECTS
+from knife.operations import (
+    bump_generation,
+    import_documents,
+    parse_documents,
+)
+
+
+def load(driver, documents):
+    """
+    Import documents in a session of their own. The generations of the tables
+    written are replaced, for the servers caching reads to drop theirs.
+    """
+    driver.migrate(OBJECTS)
+
+    with driver.session():
+        report = import_documents(driver, documents)
+
+        bump_generation(driver)
+        for model in OBJECTS:
+            if report.get(model.table_name):
+                bump_generation(driver, model.table_name)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m knife.import',
+        description='Create recipes in bulk from JSON or NDJSON documents')
+    parser.add_argument('files',
+                        nargs='*',
+                        type=argparse.FileType('r', encoding='utf-8'),
+                        default=[sys.stdin])
+    arguments = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+
+    try:
+        database_type = os.environ['DATABASE_TYPE']
+        database_location = os.environ['DATABASE_URL']
+    except KeyError as e:
+        logging.error("Missing environment variable: %s", str(e))
+        return 4
+
+    if not (driver := get_driver(database_type, database_location)):
+        logging.error("Available backends: %s", ", ".join(DRIVERS.keys()))
+        return 4
+
+    try:
+        documents = []
+        for source in arguments.files:
+            documents += parse_documents(source.read())
+
+        report = load(driver, documents)
+    except KnifeError as err:
+        logging.error("Import failed: %s", str(err))
+        return 1
+
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+indexes.py
+
+In-memory indexes kept by each worker to answer frequent queries without
+reaching the database
+"""
+
+import time
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from knife import helpers
+from knife.models import Dependency, Recipe, Requirement
+
+# Seconds after which an index is rebuilt from the database, to pick up the
+# changes made through other workers
+INDEX_TTL = 60
+COMPLETION_LIMIT = 10
+
+
+class CompletionIndex:
+    """
+    Sorted array of the simplified names of the records of a model, for
+    prefix completion. The Store keeps it current with its own writes.
+    """
+
+    def __init__(self, model, ttl=INDEX_TTL):
+        self.model = model
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.built = None
+        self.entries = []
+        self.names = {}
+
+    def build(self, driver):
+        fields = self.model.fields
+        records = driver.read(self.model, columns=[fields.id, fields.name])
+
+        entries = []
+        names = {}
+        for record in records:
+            simple_name = helpers.simplify(record[fields.name])
+            entries.append((simple_name, record[fields.id]))
+            names[record[fields.id]] = (simple_name, record[fields.name])
+
+        entries.sort()
+
+        with self.lock:
+            self.entries, self.names = entries, names
+            self.built = time.monotonic()
+
+    def invalidate(self):
+        """Rebuild the index from the database when it is next used"""
+        with self.lock:
+            self.built = None
+            self.entries, self.names = [], {}
+
+    def add(self, record_id, name):
+        with self.lock:
+            if self.built is None:
+                return
+
+            self._discard(record_id)
+            simple_name = helpers.simplify(name)
+            insort(self.entries, (simple_name, record_id))
+            self.names[record_id] = (simple_name, name)
+
+    def discard(self, record_id):
+        with self.lock:
+            self._discard(record_id)
+
+    def _discard(self, record_id):
+        if (stored := self.names.pop(record_id, None)) is None:
+            return
+
+        index = bisect_left(self.entries, (stored[0], record_id))
+        if index < len(self.entries) and self.entries[index][1] == record_id:
+            self.entries.pop(index)
+
+    def complete(self, driver, prefix, limit=COMPLETION_LIMIT):
+        """Return at most limit records whose simplified name has prefix"""
+        if self.built is None or time.monotonic() - self.built > self.ttl:
+            self.build(driver)
+
+        prefix = helpers.simplify(prefix)
+        fields = self.model.fields
+        matches = []
+
+        with self.lock:
+            index = bisect_left(self.entries, (prefix, ))
+
+            while (len(matches) < limit and index < len(self.entries)
+                   and self.entries[index][0].startswith(prefix)):
+                record_id = self.entries[index][1]
+                matches.append({
+                    fields.id.name: record_id,
+                    fields.name.name: self.names[record_id][1],
+                })
+                index += 1
+
+        return matches
+
+
+class CookableIndex:
+    """
+    Inverted index of the ingredients required by each recipe, to find the
+    recipes that can be cooked from a set of ingredients. Only non-optional
+    requirements and dependencies are indexed. The Store keeps it current
+    with its own writes.
+    """
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.built = None
+        self._reset()
+
+    def _reset(self):
+        # Required ingredients per recipe, and recipes per ingredient
+        self.requirements = {}
+        self.users = {}
+        # Recipes without any required ingredient
+        self.bare = set()
+        # Required dependencies, in both directions
+        self.requisites = {}
+        self.dependents = {}
+
+    def build(self, driver):
+        rf = Requirement.fields
+        df = Dependency.fields
+
+        recipes = driver.read(Recipe, columns=[Recipe.fields.id])
+        requirements = driver.read(
+            Requirement, columns=[rf.recipe_id, rf.ingredient_id, rf.optional])
+        dependencies = driver.read(
+            Dependency, columns=[df.required_by, df.requisite, df.optional])
+
+        with self.lock:
+            self._reset()
+
+            for record in recipes:
+                self._add_recipe(record[Recipe.fields.id])
+
+            for record in requirements:
+                if not record[rf.optional]:
+                    self._add_requirement(record[rf.recipe_id],
+                                          record[rf.ingredient_id])
+
+            for record in dependencies:
+                if not record[df.optional]:
+                    self._add_dependency(record[df.required_by],
+                                         record[df.requisite])
+
+            self.built = time.monotonic()
+
+    def invalidate(self):
+        """Rebuild the index from the database when it is next used"""
+        with self.lock:
+            self.built = None
+            self._reset()
+
+    def _add_recipe(self, recipe_id):
+        if recipe_id not in self.requirements:
+            self.requirements[recipe_id] = set()
+            self.bare.add(recipe_id)
+
+    def _add_requirement(self, recipe_id, ingredient_id):
+        self._add_recipe(recipe_id)
+        self.requirements[recipe_id].add(ingredient_id)
+        self.users.setdefault(ingredient_id, set()).add(recipe_id)
+        self.bare.discard(recipe_id)
+
+    def _discard_requirement(self, recipe_id, ingredient_id):
+        if (required := self.requirements.get(recipe_id)) is None:
+            return
+
+        required.discard(ingredient_id)
+        self.users.get(ingredient_id, set()).discard(recipe_id)
+        if not required:
+            self.bare.add(recipe_id)
+
+    def _add_dependency(self, recipe_id, required_id):
+        self.requisites.setdefault(recipe_id, set()).add(required_id)
+        self.dependents.setdefault(required_id, set()).add(recipe_id)
+
+    def _discard_dependency(self, recipe_id, required_id):
+        self.requisites.get(recipe_id, set()).discard(required_id)
+        self.dependents.get(required_id, set()).discard(recipe_id)
+
+    def add_recipe(self, recipe_id):
+        with self.lock:
+            if self.built is not None:
+                self._add_recipe(recipe_id)
+
+    def discard_recipe(self, recipe_id):
+        """
+        Forget a recipe, its requirements and the dependencies it has. The
+        dependencies on it are kept as in the database, and ignored.
+        """
+        with self.lock:
+            for ingredient_id in self.requirements.pop(recipe_id, set()):
+                self.users.get(ingredient_id, set()).discard(recipe_id)
+
+            for required_id in self.requisites.pop(recipe_id, set()):
+                self.dependents.get(required_id, set()).discard(recipe_id)
+
+            self.bare.discard(recipe_id)
+
+    def set_requirement(self, recipe_id, ingredient_id, optional):
+        with self.lock:
+            if self.built is None:
+                return
+
+            if optional:
+                self._discard_requirement(recipe_id, ingredient_id)
+            else:
+                self._add_requirement(recipe_id, ingredient_id)
+
+    def discard_requirement(self, recipe_id, ingredient_id):
+        with self.lock:
+            self._discard_requirement(recipe_id, ingredient_id)
+
+    def set_dependency(self, recipe_id, required_id, optional):
+        with self.lock:
+            if self.built is None:
+                return
+
+            if optional:
+                self._discard_dependency(recipe_id, required_id)
+            else:
+                self._add_dependency(recipe_id, required_id)
+
+    def discard_dependency(self, recipe_id, required_id):
+        with self.lock:
+            self._discard_dependency(recipe_id, required_id)
+
+    def cookable(self, driver, ingredient_ids):
+        """
+        Return the ids of the recipes whose required ingredients, and those of
+        the recipes they require, are all in ingredient_ids
+        """
+        if self.built is None or time.monotonic() - self.built > self.ttl:
+            self.build(driver)
+
+        with self.lock:
+            # Count the ingredients available to each recipe using them
+            available = Counter()
+            for ingredient_id in set(ingredient_ids):
+                available.update(self.users.get(ingredient_id, ()))
+
+            satisfied = self.bare.union(
+                recipe_id for recipe_id, count in available.items()
+                if count == len(self.requirements[recipe_id]))
+
+            # A recipe is cookable once all the recipes it requires are
+            pending = dict(
+                (recipe_id,
+                 len(self.requisites.get(recipe_id, set())
+                     & self.requirements.keys())) for recipe_id in satisfied)
+            ready = [
+                recipe_id for recipe_id, count in pending.items() if not count
+            ]
+
+            cookable = set()
+            while ready:
+                cookable.add(recipe_id := ready.pop())
+
+                for dependent in self.dependents.get(recipe_id, ()):
+                    if dependent in pending:
+                        pending[dependent] -= 1
+                        if not pending[dependent]:
+                            ready.append(dependent)
+
+            return cookable
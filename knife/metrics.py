@@ -0,0 +1,292 @@
+"""
+metrics.py
+
+Metrics of the requests served, in the Prometheus text format, aggregated
+over the workers of the server through files kept in a shared directory
+"""
+
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from glob import glob
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds between two writes of the metrics of a worker to its file
+FLUSH_INTERVAL = 1
+
+FAMILIES = {
+    'knife_requests_total': ('counter', 'Requests served'),
+    'knife_request_duration_seconds': ('histogram', 'Time to serve requests'),
+    'knife_errors_total': ('counter', 'Requests failed, by error'),
+    'knife_queries_total': ('counter', 'Statements run by the driver'),
+    'knife_query_duration_seconds_total': ('counter',
+                                           'Time spent running statements'),
+}
+
+
+def family(name):
+    """Family of a sample, the histograms having suffixed samples"""
+    if name in FAMILIES:
+        return name
+    return name.rpartition('_')[0]
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (key, escape(value))
+                             for key, value in labels)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def parse_name(path):
+    """Run and pid of the worker that wrote a metrics file"""
+    run, pid, _ = os.path.basename(path).split('-')
+    return int(run), int(pid)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """
+    Counters of the requests served by a worker, and gauges describing its
+    driver. When directory is set, they are written to a file of the worker
+    in it every flush_interval seconds, and the exposition merges the files
+    of all the workers. Counters of the workers that exited are kept, their
+    gauges are not.
+
+    Files are named after the run of the server, which is the pid of the
+    process starting the workers, the pid of the worker and a uuid, as pids
+    get reused. Workers remove the files of the other runs when they start.
+    """
+
+    def __init__(self,
+                 directory=None,
+                 buckets=LATENCY_BUCKETS,
+                 flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.buckets = buckets
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.pid = None
+        self.path = None
+        self.flusher = None
+        self._reset()
+
+    def _reset(self):
+        # Samples by (name, labels), labels being a tuple of (key, value)
+        self.counters = {}
+        self.gauges = {}
+        self.dirty = False
+
+    def _check_process(self):
+        # A forked worker starts from empty counters, kept in its own file
+        if self.pid == os.getpid():
+            return
+
+        self.pid = os.getpid()
+        self._reset()
+
+        if self.directory:
+            self.path = os.path.join(
+                self.directory,
+                '%d-%d-%s.json' % (os.getppid(), self.pid, uuid.uuid4().hex))
+            self._clear()
+
+            self.flusher = threading.Thread(target=self._flush_periodically,
+                                            daemon=True)
+            self.flusher.start()
+            atexit.register(self.flush)
+
+    def threads(self):
+        """Idents of the threads run by the metrics in this process"""
+        if self.pid != os.getpid() or self.flusher is None:
+            return []
+        return [self.flusher.ident]
+
+    def _clear(self):
+        """Remove the files left by the previous runs of the server"""
+        for path in glob(os.path.join(self.directory, '*.json')):
+            try:
+                run, _ = parse_name(path)
+            except ValueError:
+                run = None
+
+            if run == os.getppid():
+                continue
+
+            try:
+                os.remove(path)
+            except OSError as err:
+                LOGGER.warning("Failed to remove %s: %s", path, err)
+
+    def _increment(self, name, labels, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, endpoint, method, status, seconds, trace, stats=None):
+        """
+        Account for a request to endpoint answered with status in seconds,
+        whose statements are in trace. Stats are the gauges of the driver.
+        """
+        labels = (('endpoint', endpoint), )
+
+        with self.lock:
+            self._check_process()
+
+            self._increment('knife_requests_total',
+                            labels + (('method', method),
+                                      ('status', str(status))))
+
+            for bound in self.buckets + (float('inf'), ):
+                self._increment(
+                    'knife_request_duration_seconds_bucket',
+                    labels + (('le', format_value(bound)), ),
+                    int(seconds <= bound))
+            self._increment('knife_request_duration_seconds_sum', labels,
+                            seconds)
+            self._increment('knife_request_duration_seconds_count', labels)
+
+            self._increment('knife_queries_total', labels, trace.queries)
+            self._increment('knife_query_duration_seconds_total', labels,
+                            trace.seconds)
+
+            for key, value in (stats or {}).items():
+                self.gauges[('knife_%s' % key, ())] = value
+
+            self.dirty = True
+
+    def error(self, endpoint, error, status):
+        """Account for a request to endpoint failing with error"""
+        with self.lock:
+            self._check_process()
+            self._increment('knife_errors_total',
+                            (('endpoint', endpoint),
+                             ('error', type(error).__name__),
+                             ('status', str(status))))
+            self.dirty = True
+
+    def _dump(self):
+        return {
+            'counters': [[name, labels, value]
+                         for (name, labels), value in self.counters.items()],
+            'gauges': [[name, labels, value]
+                       for (name, labels), value in self.gauges.items()],
+        }
+
+    def flush(self):
+        """Write the metrics of the worker to its file"""
+        with self.flushing:
+            with self.lock:
+                if not self.directory or not self.dirty:
+                    return
+                dump = self._dump()
+                self.dirty = False
+
+            path = self.path
+            temporary = '%s.tmp' % path
+
+            try:
+                with open(temporary, 'w', encoding='utf-8') as output:
+                    json.dump(dump, output)
+                os.replace(temporary, path)
+            except OSError as err:
+                LOGGER.error("Failed to write metrics to %s: %s", path, err)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _dumps(self):
+        """Metrics of every worker, with whether the worker is running"""
+        if not self.directory:
+            with self.lock:
+                return [(self._dump(), True)]
+
+        self.flush()
+        dumps = []
+
+        for path in sorted(glob(os.path.join(self.directory, '*.json'))):
+            try:
+                with open(path, encoding='utf-8') as source:
+                    dump = json.load(source)
+                _, pid = parse_name(path)
+                modified = os.path.getmtime(path)
+            except (OSError, ValueError) as err:
+                LOGGER.warning("Ignoring metrics in %s: %s", path, err)
+                continue
+
+            dumps.append((dump, pid, modified))
+
+        # A pid reused by a running worker leaves the files of the workers
+        # that had it before, older than the file of the running one
+        latest = {}
+        for _, pid, modified in dumps:
+            latest[pid] = max(latest.get(pid, modified), modified)
+
+        return [(dump, alive(pid) and modified == latest[pid])
+                for dump, pid, modified in dumps]
+
+    def exposition(self):
+        """Metrics of all the workers, in the Prometheus text format"""
+        counters, gauges = {}, {}
+
+        for dump, running in self._dumps():
+            for name, labels, value in dump['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+
+            for name, labels, value in dump['gauges'] if running else []:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+
+        lines = []
+
+        for name, (kind, description) in FAMILIES.items():
+            lines += ['# HELP %s %s' % (name, description),
+                      '# TYPE %s %s' % (name, kind)]
+            lines += [
+                '%s%s %s' % (sample, format_labels(labels),
+                             format_value(value))
+                for (sample, labels), value in counters.items()
+                if family(sample) == name
+            ]
+
+        for (name, labels), value in sorted(gauges.items()):
+            lines += ['# TYPE %s gauge' % name,
+                      '%s%s %s' % (name, format_labels(labels),
+                                   format_value(value))]
+
+        return '\n'.join(lines) + '\n'
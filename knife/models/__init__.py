@@ -5,8 +5,19 @@ from knife.models.recipe import Recipe
 from knife.models.requirement import Requirement
 from knife.models.tag import Tag
 from knife.models.dependency import Dependency
+from knife.models.classification import RecipeClassification
+from knife.models.generation import Generation
 
-OBJECTS = [Recipe, Ingredient, Label, Requirement, Tag, Dependency]
+OBJECTS = [
+    Recipe,
+    Ingredient,
+    Label,
+    Requirement,
+    Tag,
+    Dependency,
+    RecipeClassification,
+    Generation,
+]
 
 
 @dataclass
@@ -0,0 +1,15 @@
+from knife.models.knife_model import Datatypes, FieldList, Field
+
+
+class RecipeClassification:
+    table_name = 'recipe_classifications'
+    fields = FieldList(
+        Field(name='recipe_id',
+              datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
+        Field(name='dairy', datatype=[Datatypes.BOOLEAN], default=False),
+        Field(name='meat', datatype=[Datatypes.BOOLEAN], default=False),
+        Field(name='gluten', datatype=[Datatypes.BOOLEAN], default=False),
+        Field(name='animal_product',
+              datatype=[Datatypes.BOOLEAN],
+              default=False),
+    )
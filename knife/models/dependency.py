@@ -7,7 +7,11 @@ class Dependency:
         Field(name='required_by',
               datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
         Field(name='requisite',
-              datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
+              datatype=[
+                  Datatypes.TEXT,
+                  Datatypes.PRIMARY_KEY,
+                  Datatypes.INDEX,
+              ]),
         Field(name='quantity', datatype=[Datatypes.TEXT], default=""),
         Field(name='optional', datatype=[Datatypes.BOOLEAN], default=False),
     )
@@ -0,0 +1,9 @@
+from knife.models.knife_model import Datatypes, FieldList, Field
+
+
+class Generation:
+    table_name = 'generations'
+    fields = FieldList(
+        Field(name='scope', datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
+        Field(name='generation', datatype=[Datatypes.TEXT]),
+    )
@@ -6,7 +6,12 @@ class Ingredient(KnifeModel):
     fields = FieldList(
         Field(name='id', datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
         Field(name='name', datatype=[Datatypes.TEXT]),
-        Field(name='simple_name', datatype=[Datatypes.TEXT]),
+        Field(name='simple_name',
+              datatype=[
+                  Datatypes.TEXT,
+                  Datatypes.UNIQUE,
+                  Datatypes.TEXT_SEARCH,
+              ]),
         Field(name='dairy', datatype=[Datatypes.BOOLEAN], default=False),
         Field(name='gluten', datatype=[Datatypes.BOOLEAN], default=False),
         Field(name='meat', datatype=[Datatypes.BOOLEAN], default=False),
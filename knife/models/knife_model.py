@@ -12,6 +12,9 @@ class Datatypes():
     REQUIRED = 10
     PRIMARY_KEY = 11
     FOREIGN_KEY = 12
+    INDEX = 13
+    UNIQUE = 14
+    TEXT_SEARCH = 15
 
 
 @dataclass(frozen=True)
@@ -6,5 +6,5 @@ class Label(KnifeModel):
     fields = FieldList(
         Field('id', datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
         Field('name', datatype=[Datatypes.TEXT]),
-        Field('simple_name', datatype=[Datatypes.TEXT]),
+        Field('simple_name', datatype=[Datatypes.TEXT, Datatypes.UNIQUE]),
     )
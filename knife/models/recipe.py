@@ -6,9 +6,16 @@ class Recipe(KnifeModel):
     fields = FieldList(
         Field(name='id', datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
         Field(name='name', datatype=[Datatypes.TEXT]),
-        Field(name='simple_name', datatype=[Datatypes.TEXT]),
+        Field(name='simple_name',
+              datatype=[
+                  Datatypes.TEXT,
+                  Datatypes.UNIQUE,
+                  Datatypes.TEXT_SEARCH,
+              ]),
         Field(name='author', datatype=[Datatypes.TEXT], default=""),
-        Field(name='directions', datatype=[Datatypes.TEXT], default=""),
+        Field(name='directions',
+              datatype=[Datatypes.TEXT, Datatypes.TEXT_SEARCH],
+              default=""),
         Field(name='information', datatype=[Datatypes.TEXT], default=""),
     )
 
@@ -7,7 +7,11 @@ class Requirement(KnifeModel):
         Field(name='recipe_id',
               datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
         Field(name='ingredient_id',
-              datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
+              datatype=[
+                  Datatypes.TEXT,
+                  Datatypes.PRIMARY_KEY,
+                  Datatypes.INDEX,
+              ]),
         Field(name='quantity', datatype=[Datatypes.TEXT]),
         Field(name='optional', datatype=[Datatypes.BOOLEAN], default=False),
         Field(name='group', datatype=[Datatypes.TEXT], default=""),
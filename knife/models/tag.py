@@ -7,5 +7,9 @@ class Tag:
         Field(name='recipe_id',
               datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
         Field(name='label_id',
-              datatype=[Datatypes.TEXT, Datatypes.PRIMARY_KEY]),
+              datatype=[
+                  Datatypes.TEXT,
+                  Datatypes.PRIMARY_KEY,
+                  Datatypes.INDEX,
+              ]),
     )
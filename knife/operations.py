@@ -1,3 +1,12 @@
+import time
+import json
+import uuid
+import random
+import logging
+from knife import helpers
+from knife.drivers import BATCH_SIZE, OneOf
+from knife.exceptions import DependencyCycle, InvalidValue, RecipeNotFound
+from knife.models.knife_model import Datatypes
 from knife.models import (
     Dependency,
     Ingredient,
@@ -6,121 +15,250 @@ from knife.models import (
     Requirement,
     Tag,
     Classifications,
+    Generation,
+    RecipeClassification,
 )
 
+LOGGER = logging.getLogger(__name__)
+
+
+# Generation of the whole store, changed by every write
+STORE_GENERATION = 'store'
+
+# Number of records the store generation is spread over, so that concurrent
+# writers seldom update the same one
+GENERATION_STRIPES = 16
+
+
+def generation_scopes(scope):
+    """Scopes of the records holding the generation of scope"""
+    if scope != STORE_GENERATION:
+        return [scope]
+
+    return ["%s.%d" % (scope, stripe) for stripe in range(GENERATION_STRIPES)]
+
+
+def current_generation(driver, scope=STORE_GENERATION):
+    """
+    Return the generation of scope, or None if it was never written. The
+    store generation is the version of the database for the drivers keeping
+    one.
+    """
+    if scope == STORE_GENERATION and (version := driver.version()) is not None:
+        return version
+
+    gf = Generation.fields
+
+    if not (stored := driver.read(Generation,
+                                  columns=[gf.scope, gf.generation],
+                                  filters=[{
+                                      gf.scope: OneOf(generation_scopes(scope))
+                                  }])):
+        return None
+
+    return '.'.join(record[gf.generation]
+                    for record in sorted(stored, key=lambda x: x[gf.scope]))
+
+
+def bump_generation(driver, scope=STORE_GENERATION):
+    """
+    Give scope a new generation. Generations are random rather than counted
+    so that concurrent writers never end up with the same one. Only one of
+    the stripes of the store generation changes, and none for the drivers
+    keeping a version.
+    """
+    if scope == STORE_GENERATION and driver.version() is not None:
+        return
+
+    gf = Generation.fields
+    stripe = random.choice(generation_scopes(scope))
+    generation = uuid.uuid4().hex
+
+    if driver.read(Generation, filters=[{gf.scope: stripe}]):
+        driver.write(Generation, {gf.generation: generation},
+                     filters=[{
+                         gf.scope: stripe
+                     }])
+    else:
+        driver.write(Generation, {
+            gf.scope: stripe,
+            gf.generation: generation
+        })
+
+
+def read_any(driver, model, field, values, **kwargs):
+    """
+    Read the records of model whose field holds any of values, sending at
+    most BATCH_SIZE of them per query
+    """
+    values = list(values)
+    records = []
+
+    for start in range(0, len(values), BATCH_SIZE):
+        records.extend(
+            driver.read(model,
+                        filters=[{
+                            field: OneOf(values[start:start + BATCH_SIZE])
+                        }],
+                        **kwargs))
+
+    return records
+
 
 def dependency_nodes(driver, recipe_id: str) -> set[str]:
     """
     Recursively follow all dependencies from a recipe, and output all the
     encountered ids. This *should* terminate as a dependency cycle should not
-    be allowed, but there is a failsafe just in case.
+    be allowed, but the drivers stop on visited nodes just in case. SQL
+    drivers resolve the whole graph in a single query.
     """
     df = Dependency.fields
 
-    nodes = set()
-    to_visit = {recipe_id}
+    return driver.transitive_closure(Dependency, df.required_by, df.requisite,
+                                     recipe_id)
 
-    while to_visit:
-        next_tier = set()
 
-        for recipe_id in to_visit:
-            for dependency in driver.read(Dependency,
-                                          columns=(df.requisite, ),
-                                          filters=[{
-                                              df.required_by: recipe_id
-                                          }]):
-                next_tier.add(dependency[df.requisite])
+REQUIREMENT_JOIN = (
+    Requirement,
+    Ingredient,
+    Requirement.fields.ingredient_id,
+    Ingredient.fields.id,
+)
+REQUIREMENT_COLUMNS = (
+    Ingredient.fields.id,
+    Ingredient.fields.name,
+    Requirement.fields.quantity,
+    Requirement.fields.optional,
+    Requirement.fields.group,
+)
+
+DEPENDENCY_JOIN = (
+    Dependency,
+    Recipe,
+    Dependency.fields.requisite,
+    Recipe.fields.id,
+)
+DEPENDENCY_COLUMNS = (
+    Recipe.fields.id,
+    Recipe.fields.name,
+    Dependency.fields.quantity,
+    Dependency.fields.optional,
+)
 
-        nodes = nodes | to_visit
-        to_visit = next_tier - nodes
+TAG_JOIN = (Tag, Label, Tag.fields.label_id, Label.fields.id)
+TAG_COLUMNS = (Label.fields.name, Label.fields.id)
 
-    return nodes
+# Everything a recipe document is made of, as relations for driver.aggregate
+RECIPE_RELATIONS = {
+    'requirements':
+    (REQUIREMENT_JOIN, Requirement.fields.recipe_id, REQUIREMENT_COLUMNS),
+    'dependencies':
+    (DEPENDENCY_JOIN, Dependency.fields.required_by, DEPENDENCY_COLUMNS),
+    'tags': (TAG_JOIN, Tag.fields.recipe_id, TAG_COLUMNS),
+    'classifications':
+    (RecipeClassification, RecipeClassification.fields.recipe_id,
+     RecipeClassification.fields.fields),
+}
 
 
-def requirement_list(driver, recipe_id):
+def format_requirement(record):
     if_ = Ingredient.fields
     rf = Requirement.fields
 
-    data = driver.read((Requirement, Ingredient, rf.ingredient_id, if_.id),
-                       columns=(
-                           if_.id,
-                           if_.name,
-                           rf.quantity,
-                           rf.optional,
-                           rf.group,
-                       ),
+    return {
+        'ingredient': {
+            if_.id.name: record[if_.id],
+            if_.name.name: record[if_.name],
+        },
+        rf.quantity.name: record[rf.quantity],
+        rf.optional.name: record[rf.optional],
+        rf.group.name: record[rf.group]
+    }
+
+
+def format_dependency(record):
+    rf = Recipe.fields
+    df = Dependency.fields
+
+    return {
+        'recipe': {
+            rf.id.name: record[rf.id],
+            rf.name.name: record[rf.name],
+        },
+        df.quantity.name: record[df.quantity],
+        df.optional.name: record[df.optional]
+    }
+
+
+def format_tag(record):
+    return {
+        Label.fields.id.name: record[Label.fields.id],
+        Label.fields.name.name: record[Label.fields.name],
+    }
+
+
+def requirement_list(driver, recipe_id):
+    data = driver.read(REQUIREMENT_JOIN,
+                       columns=REQUIREMENT_COLUMNS,
                        filters=[{
-                           rf.recipe_id: recipe_id
+                           Requirement.fields.recipe_id: recipe_id
                        }])
 
-    def _format(record):
-        return {
-            'ingredient': {
-                if_.id.name: record[if_.id],
-                if_.name.name: record[if_.name],
-            },
-            rf.quantity.name: record[rf.quantity],
-            rf.optional.name: record[rf.optional],
-            rf.group.name: record[Requirement.fields.group]
-        }
-
-    return list(map(_format, data))
+    return list(map(format_requirement, data))
 
 
 def dependency_list(driver, recipe_id):
-    rf = Recipe.fields
-    df = Dependency.fields
-    data = driver.read((Dependency, Recipe, df.requisite, rf.id),
-                       columns=(
-                           rf.id,
-                           rf.name,
-                           df.quantity,
-                           df.optional,
-                       ),
+    data = driver.read(DEPENDENCY_JOIN,
+                       columns=DEPENDENCY_COLUMNS,
                        filters=[{
-                           df.required_by: recipe_id
+                           Dependency.fields.required_by: recipe_id
                        }])
 
-    def _format(record):
-        return {
-            'recipe': {
-                rf.id.name: record[rf.id],
-                rf.name.name: record[rf.name],
-            },
-            df.quantity.name: record[df.quantity],
-            df.optional.name: record[df.optional]
-        }
-
-    return list(map(_format, data))
+    return list(map(format_dependency, data))
 
 
 def tag_list(driver, recipe_id):
-    data = driver.read((Tag, Label, Tag.fields.label_id, Label.fields.id),
+    data = driver.read(TAG_JOIN,
                        filters=[{
                            Tag.fields.recipe_id: recipe_id
                        }],
-                       columns=[Label.fields.name, Label.fields.id])
+                       columns=TAG_COLUMNS)
 
-    def _format(record):
-        return {
-            Label.fields.id.name: record[Label.fields.id],
-            Label.fields.name.name: record[Label.fields.name],
-        }
+    return list(map(format_tag, data))
+
+
+def ingredient_classifications(record):
+    """Extract the classifications from an ingredient record"""
+    if_ = Ingredient.fields
 
-    return list(map(_format, data))
+    return Classifications(
+        bool(record.get(if_.dairy, False)),
+        bool(record.get(if_.meat, False)),
+        bool(record.get(if_.gluten, False)),
+        bool(record.get(if_.animal_product, False)),
+    )
 
 
 def classify(driver, recipe_id):
-    data = driver.read(
+    """
+    Merge the classifications of the ingredients required by a recipe and its
+    dependencies. The dependency graph is resolved first so that sub-recipes
+    shared by several branches are only considered once, then the
+    ingredients of every recipe found are read at once.
+    """
+    start = time.perf_counter()
+    nodes = dependency_nodes(driver, recipe_id)
+
+    data = read_any(
+        driver,
         (
             Requirement,
             Ingredient,
             Requirement.fields.ingredient_id,
             Ingredient.fields.id,
         ),
-        filters=[{
-            Requirement.fields.recipe_id: recipe_id
-        }],
+        Requirement.fields.recipe_id,
+        nodes,
         columns=[
             Ingredient.fields.dairy,
             Ingredient.fields.meat,
@@ -132,27 +270,648 @@ def classify(driver, recipe_id):
     final = Classifications()
 
     for constraints in data:
-        final += Classifications(
-            constraints[Ingredient.fields.dairy],
-            constraints[Ingredient.fields.meat],
-            constraints[Ingredient.fields.gluten],
-            constraints[Ingredient.fields.animal_product],
-        )
-
-    data = driver.read(
-        Dependency,
-        filters=[{
-            Dependency.fields.required_by: recipe_id
-        }],
-        columns=[
-            Dependency.fields.requisite,
-        ],
-    )
+        final += ingredient_classifications(constraints)
 
-    for node in data:
-        final += classify(
-            driver,
-            node[Dependency.fields.requisite],
-        )
+    LOGGER.debug("Classified %s from %d recipes in %.3fms", recipe_id,
+                 len(nodes), 1000 * (time.perf_counter() - start))
 
     return final
+
+
+def dependent_recipes(driver, recipe_ids) -> set[str]:
+    """
+    Output the given recipes and all the recipes requiring them, directly or
+    through other dependencies
+    """
+    df = Dependency.fields
+
+    return driver.transitive_closure(Dependency, df.requisite, df.required_by,
+                                     list(recipe_ids))
+
+
+def stored_record_classifications(record):
+    """Extract the classifications from a recipe_classifications record"""
+    cf = RecipeClassification.fields
+
+    return Classifications(
+        bool(record[cf.dairy]),
+        bool(record[cf.meat]),
+        bool(record[cf.gluten]),
+        bool(record[cf.animal_product]),
+    )
+
+
+def stored_classifications(driver, recipe_id):
+    """
+    Read the classifications of a recipe from the recipe_classifications
+    table, or compute them if they were never stored
+    """
+    cf = RecipeClassification.fields
+
+    if not (stored := driver.read(RecipeClassification,
+                                  filters=[{
+                                      cf.recipe_id: recipe_id
+                                  }])):
+        return classify(driver, recipe_id)
+
+    return stored_record_classifications(stored[0])
+
+
+def store_classifications(driver, recipe_id, classifications):
+    cf = RecipeClassification.fields
+
+    driver.erase(RecipeClassification, filters=[{cf.recipe_id: recipe_id}])
+    driver.write(
+        RecipeClassification, {
+            cf.recipe_id: recipe_id,
+            cf.dairy: classifications.dairy,
+            cf.meat: classifications.meat,
+            cf.gluten: classifications.gluten,
+            cf.animal_product: classifications.animal_product,
+        })
+
+
+def reclassify(driver, recipe_ids, added=None):
+    """
+    Update the stored classifications of recipes and of every recipe
+    depending on them. Classifications only ever get merged, so when the
+    change only adds constraints they are merged into the stored values;
+    otherwise all the affected recipes are classified again.
+    """
+    if added == Classifications():
+        return
+
+    for recipe_id in dependent_recipes(driver, recipe_ids):
+        if added is not None:
+            updated = stored_classifications(driver, recipe_id) + added
+        else:
+            updated = classify(driver, recipe_id)
+
+        store_classifications(driver, recipe_id, updated)
+
+
+def recipe_document(driver, record, related):
+    """Build the document of a recipe from its record and relations"""
+    recipe_id = record[Recipe.fields.id]
+
+    if stored := related['classifications']:
+        classifications = stored_record_classifications(stored[0])
+    else:
+        classifications = classify(driver, recipe_id)
+
+    return Recipe(record).serializable(
+        requirements=list(map(format_requirement, related['requirements'])),
+        dependencies=list(map(format_dependency, related['dependencies'])),
+        tags=list(map(format_tag, related['tags'])),
+        classifications=classifications,
+    )
+
+
+def recipe_details(driver, recipe_id):
+    """
+    Assemble the full document of a recipe, or return None if it does not
+    exist. SQL drivers fetch the recipe and all its relations in a single
+    query.
+    """
+    if not (aggregate := driver.aggregate(Recipe, Recipe.fields.id, recipe_id,
+                                          RECIPE_RELATIONS)):
+        return None
+
+    return recipe_document(driver, *aggregate)
+
+
+def recipe_batch(driver, recipe_ids):
+    """
+    Assemble the documents of several recipes, reading each relation once
+    for all of them. Returns a dict mapping the ids found to their document.
+    """
+    aggregates = driver.aggregate_many(Recipe, Recipe.fields.id, recipe_ids,
+                                       RECIPE_RELATIONS)
+
+    return dict((recipe_id, recipe_document(driver, *aggregate))
+                for recipe_id, aggregate in aggregates.items())
+
+
+def shopping_list(driver, recipe_ids):
+    """
+    List the ingredients needed to cook the given recipes and everything
+    they depend on, merged per ingredient. An ingredient is optional when
+    no recipe reached through required dependencies needs it. Quantities are
+    free text, so each recipe's quantity is listed rather than summed.
+    """
+    df = Dependency.fields
+    rf = Requirement.fields
+
+    nodes = driver.transitive_closure(Dependency, df.required_by,
+                                      df.requisite, list(recipe_ids))
+
+    names = dict((record[Recipe.fields.id], record[Recipe.fields.name])
+                 for record in read_any(
+                     driver,
+                     Recipe,
+                     Recipe.fields.id,
+                     nodes,
+                     columns=[Recipe.fields.id, Recipe.fields.name]))
+
+    for recipe_id in recipe_ids:
+        if recipe_id not in names:
+            raise RecipeNotFound(recipe_id)
+
+    required_edges = {}
+    for edge in read_any(driver,
+                         Dependency,
+                         df.required_by,
+                         nodes,
+                         columns=[df.required_by, df.requisite, df.optional]):
+        if not edge[df.optional]:
+            required_edges.setdefault(edge[df.required_by],
+                                      []).append(edge[df.requisite])
+
+    required = set(recipe_ids)
+    to_visit = list(required)
+    while to_visit:
+        for requisite in required_edges.get(to_visit.pop(), []):
+            if requisite not in required:
+                required.add(requisite)
+                to_visit.append(requisite)
+
+    ingredients = {}
+    for record in read_any(driver,
+                           REQUIREMENT_JOIN,
+                           rf.recipe_id,
+                           nodes,
+                           columns=(rf.recipe_id, *REQUIREMENT_COLUMNS)):
+        recipe_id = record[rf.recipe_id]
+        optional = bool(record[rf.optional]) or recipe_id not in required
+
+        entry = ingredients.setdefault(
+            record[Ingredient.fields.id], {
+                'ingredient': {
+                    Ingredient.fields.id.name: record[Ingredient.fields.id],
+                    Ingredient.fields.name.name:
+                    record[Ingredient.fields.name],
+                },
+                rf.optional.name: True,
+                'quantities': [],
+            })
+
+        entry[rf.optional.name] = entry[rf.optional.name] and optional
+        entry['quantities'].append({
+            'recipe': {
+                Recipe.fields.id.name: recipe_id,
+                Recipe.fields.name.name: names.get(recipe_id),
+            },
+            rf.quantity.name: record[rf.quantity],
+            rf.optional.name: optional,
+        })
+
+    return sorted(ingredients.values(),
+                  key=lambda entry: (helpers.simplify(entry['ingredient'][
+                      Ingredient.fields.name.name]), entry['ingredient'][
+                          Ingredient.fields.id.name]))
+
+
+# Relations included in the documents of an export
+EXPORT_RELATIONS = ('requirements', 'dependencies', 'tags')
+
+
+def recipe_export(driver):
+    """
+    Yield the document of every recipe, ordered by id. The recipes and their
+    relations are iterated in parallel, sorted on the recipe id, and merged,
+    so that a single document is held in memory at a time.
+    """
+    rf = Recipe.fields
+    recipes = driver.iterate(Recipe, order=(rf.id, ))
+
+    streams = {}
+    for name in EXPORT_RELATIONS:
+        source, foreign, columns = RECIPE_RELATIONS[name]
+        streams[name] = (foreign,
+                         driver.iterate(source,
+                                        columns=(foreign, *columns),
+                                        order=(foreign, )))
+
+    pending = dict((name, next(stream, None))
+                   for name, (_, stream) in streams.items())
+
+    try:
+        for record in recipes:
+            recipe_id = record[rf.id]
+            related = {}
+
+            for name, (foreign, stream) in streams.items():
+                related[name] = []
+                current = pending[name]
+
+                # Skip the rows referencing recipes that do not exist
+                while current is not None and current[foreign] < recipe_id:
+                    current = next(stream, None)
+
+                while current is not None and current[foreign] == recipe_id:
+                    related[name].append(current)
+                    current = next(stream, None)
+
+                pending[name] = current
+
+            yield Recipe(record).serializable(
+                requirements=list(map(format_requirement,
+                                      related['requirements'])),
+                dependencies=list(map(format_dependency,
+                                      related['dependencies'])),
+                tags=list(map(format_tag, related['tags'])),
+            )
+    finally:
+        recipes.close()
+        for _, stream in streams.values():
+            stream.close()
+
+
+def _named(document, field):
+    """Return the name of a document, which must be a dict with one"""
+    if not isinstance(document, dict):
+        raise InvalidValue(field, document)
+
+    if not isinstance(name := document.get(field.name), str) or \
+            not helpers.simplify(name):
+        raise InvalidValue(field, name)
+
+    return name
+
+
+def _typed(document, model):
+    """
+    Check the fields of model set in document hold values of their type, as
+    the drivers store them as they are
+    """
+    types = {
+        Datatypes.TEXT: str,
+        Datatypes.INTEGER: int,
+        Datatypes.BOOLEAN: bool,
+    }
+
+    for field in model.fields.fields:
+        if (value := document.get(field.name)) is None:
+            continue
+
+        for datatype, kind in types.items():
+            if datatype in field.datatype and not isinstance(value, kind):
+                raise InvalidValue(field, value)
+
+
+def _validated(document):
+    """Check the types of the fields of a recipe document and its relations"""
+    _typed(document, Recipe)
+
+    for key, model in [('requirements', Requirement),
+                       ('dependencies', Dependency), ('tags', Label)]:
+        if not isinstance(items := document.get(key, []), list):
+            raise InvalidValue(key, items)
+
+        # Relations that are not objects are rejected with the whole import
+        for item in filter(lambda x: isinstance(x, dict), items):
+            _typed(item, model)
+
+            for reference, referenced in [('ingredient', Ingredient),
+                                          ('recipe', Recipe)]:
+                if isinstance(item.get(reference), dict):
+                    _typed(item[reference], referenced)
+
+
+def _topological(edges):
+    """
+    Order the imported recipes so that each comes after the imported recipes
+    it requires, failing on cycles. The graph is walked depth first with an
+    explicit stack, as chains of dependencies can be arbitrarily long.
+    """
+    order = []
+    done = set()
+
+    for root in edges:
+        if root in done:
+            continue
+
+        visiting = {root}
+        stack = [(root, iter(edges[root]))]
+
+        while stack:
+            recipe_id, requisites = stack[-1]
+
+            for requisite in requisites:
+                if requisite in visiting:
+                    raise DependencyCycle()
+                if requisite in edges and requisite not in done:
+                    visiting.add(requisite)
+                    stack.append((requisite, iter(edges[requisite])))
+                    break
+            else:
+                stack.pop()
+                visiting.remove(recipe_id)
+                done.add(recipe_id)
+                order.append(recipe_id)
+
+    return order
+
+
+def parse_documents(text):
+    """
+    Read the recipe documents of an import, given as a JSON array or object,
+    or as NDJSON with one document per line
+    """
+    try:
+        documents = json.loads(text)
+    except ValueError:
+        try:
+            documents = [
+                json.loads(line) for line in text.splitlines() if line.strip()
+            ]
+        except ValueError as err:
+            raise InvalidValue('documents', str(err))
+
+    if isinstance(documents, dict):
+        return [documents]
+
+    if not isinstance(documents, list):
+        raise InvalidValue('documents', documents)
+
+    return documents
+
+
+def _relations(document, recipes, recipe_ids):
+    """
+    Check the relations of an imported recipe document, and return its
+    requirements with the name of their ingredient, its dependencies with
+    the id of their recipe, and its tags with the name of their label.
+    Required recipes are looked up by id or name in recipes and recipe_ids.
+    """
+    rf = Recipe.fields
+    requirements = []
+    dependencies = []
+    tags = []
+
+    for requirement in document.get('requirements', []):
+        if not isinstance(requirement, dict):
+            raise InvalidValue('requirements', requirement)
+
+        name = _named(requirement.get('ingredient'), Ingredient.fields.name)
+
+        if not requirement.get(Requirement.fields.quantity.name):
+            raise InvalidValue(Requirement.fields.quantity,
+                               requirement.get('quantity'))
+
+        requirements.append((name, requirement))
+
+    for dependency in document.get('dependencies', []):
+        if not isinstance(dependency, dict):
+            raise InvalidValue('dependencies', dependency)
+
+        if not isinstance(reference := dependency.get('recipe'), dict):
+            raise InvalidValue('recipe', reference)
+
+        if (requisite := reference.get(rf.id.name)) not in recipe_ids:
+            name = _named(reference, rf.name)
+            if (requisite := recipes.get(helpers.simplify(name))) is None:
+                raise RecipeNotFound(name)
+
+        dependencies.append((requisite, dependency))
+
+    for tag in document.get('tags', []):
+        name = _named(tag, Label.fields.name)
+
+        if " " in name:
+            raise InvalidValue(Label.fields.name, name)
+
+        tags.append((name, tag))
+
+    return requirements, dependencies, tags
+
+
+def import_documents(driver, documents):
+    """
+    Create the recipes described by documents, in the format of the export,
+    with the ingredients and labels they name that do not exist yet.
+    Recipes whose id or simple name is already taken, in the database or
+    earlier in documents, are skipped. Dependencies reference a recipe by id
+    or name, either stored or imported. Everything is validated before
+    anything is written, then every model is inserted in bulk.
+    Returns the number of records written for each table, and the rate at
+    which they were. Invalid documents are skipped and listed in the report,
+    by position, with the first field at fault, as are the documents
+    requiring a recipe that is missing or skipped as invalid.
+    """
+    start = time.perf_counter()
+    rf = Recipe.fields
+    if_ = Ingredient.fields
+    lf = Label.fields
+
+    recipes = dict((record[rf.simple_name], record[rf.id])
+                   for record in driver.read(Recipe,
+                                             columns=(rf.id, rf.simple_name)))
+    recipe_ids = set(recipes.values())
+    ingredients = dict((record[if_.simple_name], record)
+                       for record in driver.read(Ingredient))
+    ingredient_ids = set(record[if_.id] for record in ingredients.values())
+    labels = dict((record[lf.simple_name], record[lf.id])
+                  for record in driver.read(Label,
+                                            columns=(lf.id, lf.simple_name)))
+    label_ids = set(labels.values())
+
+    created = dict((model, []) for model in [
+        Ingredient,
+        Label,
+        Recipe,
+        Requirement,
+        Dependency,
+        Tag,
+        RecipeClassification,
+    ])
+    imported = []
+    invalid = []
+
+    for index, document in enumerate(documents):
+        try:
+            _named(document, rf.name)
+            _validated(document)
+        except InvalidValue as err:
+            invalid.append({
+                'document': index,
+                'field': getattr(err.field, 'name', err.field),
+                'value': err.value,
+            })
+            continue
+
+        recipe = Recipe(document)
+
+        if recipe.simple_name in recipes or recipe.id in recipe_ids:
+            continue
+
+        recipes[recipe.simple_name] = recipe.id
+        recipe_ids.add(recipe.id)
+        imported.append((index, recipe))
+
+    # Relations are checked once every imported recipe can be referenced
+    relations = {}
+
+    for index, recipe in imported:
+        try:
+            relations[recipe.id] = _relations(documents[index], recipes,
+                                              recipe_ids)
+        except InvalidValue as err:
+            invalid.append({
+                'document': index,
+                'field': getattr(err.field, 'name', err.field),
+                'value': err.value,
+            })
+        except RecipeNotFound as err:
+            invalid.append({
+                'document': index,
+                'field': 'recipe',
+                'value': err.recipe_id,
+            })
+
+    # Recipes requiring a skipped one are skipped in turn, until none is
+    positions = dict((recipe.id, index) for index, recipe in imported)
+    names = dict((recipe.id, recipe.name) for _, recipe in imported)
+    skipped = set(positions) - set(relations)
+
+    while skipped:
+        dependents = set()
+
+        for recipe_id, (_, dependencies, _) in relations.items():
+            for requisite, _ in dependencies:
+                if requisite in skipped:
+                    dependents.add(recipe_id)
+                    invalid.append({
+                        'document': positions[recipe_id],
+                        'field': 'recipe',
+                        'value': names[requisite],
+                    })
+                    break
+
+        for recipe_id in dependents:
+            relations.pop(recipe_id)
+
+        skipped = dependents
+
+    invalid.sort(key=lambda entry: entry['document'])
+    accepted = [recipe for _, recipe in imported if recipe.id in relations]
+
+    # Classifications of the imported recipes, from their own ingredients
+    # and, once the graph is known, from their dependencies
+    classifications = {}
+    edges = {}
+
+    for recipe in accepted:
+        recipe_id = recipe.id
+        requirements, dependencies, tags = relations[recipe_id]
+        created[Recipe].append(recipe.params)
+        classifications[recipe_id] = Classifications()
+        required = set()
+
+        for name, requirement in requirements:
+            if (simple_name := helpers.simplify(name)) not in ingredients:
+                ingredient = Ingredient(requirement['ingredient'])
+                if ingredient.id in ingredient_ids:
+                    ingredient = Ingredient(name=name)
+
+                ingredients[simple_name] = ingredient.params
+                ingredient_ids.add(ingredient.id)
+                created[Ingredient].append(ingredient.params)
+
+            ingredient = ingredients[simple_name]
+            if ingredient[if_.id] in required:
+                continue
+
+            required.add(ingredient[if_.id])
+            classifications[recipe_id] += ingredient_classifications(
+                ingredient)
+            created[Requirement].append(
+                Requirement(requirement | {
+                    Requirement.fields.recipe_id.name: recipe_id,
+                    Requirement.fields.ingredient_id.name: ingredient[if_.id],
+                }).params)
+
+        edges[recipe_id] = []
+
+        for requisite, dependency in dependencies:
+            if requisite in edges[recipe_id]:
+                continue
+
+            edges[recipe_id].append(requisite)
+            created[Dependency].append({
+                Dependency.fields.required_by:
+                recipe_id,
+                Dependency.fields.requisite:
+                requisite,
+                Dependency.fields.quantity:
+                dependency.get('quantity', ''),
+                Dependency.fields.optional:
+                bool(dependency.get('optional', False)),
+            })
+
+        tagged = set()
+
+        for name, tag in tags:
+            if (simple_name := helpers.simplify(name)) not in labels:
+                label = Label(tag)
+                if label.id in label_ids:
+                    label = Label(name=name)
+
+                labels[simple_name] = label.id
+                label_ids.add(label.id)
+                created[Label].append(label.params)
+
+            if (label_id := labels[simple_name]) in tagged:
+                continue
+
+            tagged.add(label_id)
+            created[Tag].append({
+                Tag.fields.recipe_id: recipe_id,
+                Tag.fields.label_id: label_id,
+            })
+
+    order = _topological(edges)
+
+    # Stored recipes required by the imported ones have their classifications
+    # read at once
+    cf = RecipeClassification.fields
+    known = {}
+    if stored := set(requisite for requisites in edges.values()
+                     for requisite in requisites) - set(classifications):
+        for record in read_any(driver, RecipeClassification, cf.recipe_id,
+                               stored):
+            known[record[cf.recipe_id]] = stored_record_classifications(record)
+
+    for recipe_id in order:
+        merged = classifications[recipe_id]
+
+        for requisite in edges[recipe_id]:
+            if requisite not in known:
+                known[requisite] = classify(driver, requisite)
+            merged += known[requisite]
+
+        known[recipe_id] = merged
+        created[RecipeClassification].append({
+            cf.recipe_id: recipe_id,
+            cf.dairy: merged.dairy,
+            cf.meat: merged.meat,
+            cf.gluten: merged.gluten,
+            cf.animal_product: merged.animal_product,
+        })
+
+    for model, records in created.items():
+        driver.write_many(model, records)
+
+    elapsed = time.perf_counter() - start
+    rows = sum(map(len, created.values()))
+
+    LOGGER.info("Imported %d records in %.3fs", rows, elapsed)
+
+    return dict((model.table_name, len(records))
+                for model, records in created.items()) | {
+                    'skipped': len(documents) - len(accepted),
+                    'invalid': invalid,
+                    'rows': rows,
+                    'seconds': round(elapsed, 3),
+                    'rows_per_second': round(rows / elapsed) if elapsed else 0,
+                }
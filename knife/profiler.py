@@ -0,0 +1,92 @@
+"""
+profiler.py
+
+Sampling profiler recording the stacks of the threads of a worker, in the
+collapsed format read by flame graph tools
+"""
+
+import sys
+import time
+import threading
+from collections import Counter
+
+# Seconds between two samples of the stacks
+SAMPLE_INTERVAL = 0.01
+
+# Longest profile accepted, in seconds
+PROFILE_LIMIT = 60
+
+# Only the part of the stacks starting in these packages is kept
+PACKAGE = 'knife'
+
+
+def frame_name(frame):
+    """Module and qualified name of the function running in frame"""
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return "%s.%s" % (frame.f_globals.get('__name__', '?'), name)
+
+
+def collapse(frame, package=PACKAGE):
+    """
+    Stack of frame, from the outermost call, as a line of the collapsed
+    format. Calls made before entering package are dropped; stacks that do
+    not enter it give None.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+
+    for index, name in enumerate(names):
+        if name.startswith(package + '.'):
+            return ';'.join(names[index:])
+
+    return None
+
+
+class Profiler:
+    """
+    Sampler of the stacks of the threads of the process, other than the one
+    sampling and the ones it is told to ignore. It only runs during a
+    profile, and a single profile runs at a time.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, package=PACKAGE):
+        self.interval = interval
+        self.package = package
+        self.lock = threading.Lock()
+
+    def sample(self, seconds, ignored=()):
+        """
+        Count the stacks seen every interval for seconds, or return None if
+        a profile is already running. Threads whose ident is in ignored are
+        not sampled.
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+
+        try:
+            skipped = {threading.get_ident(), *ignored}
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+
+            while time.monotonic() < deadline:
+                for thread, frame in sys._current_frames().items():
+                    if thread in skipped:
+                        continue
+                    if stack := collapse(frame, self.package):
+                        stacks[stack] += 1
+
+                time.sleep(self.interval)
+
+            return stacks
+        finally:
+            self.lock.release()
+
+
+def format_stacks(stacks):
+    """Collapsed stacks, one per line followed by its count"""
+    return ''.join("%s %d\n" % (stack, count)
+                   for stack, count in sorted(stacks.items()))
@@ -7,11 +7,15 @@ BACK_END = Store(None)
 
 ROUTES = (
     (['GET'], BACK_END.ingredient_lookup, '/ingredients'),
+    (['GET'], BACK_END.ingredient_complete, '/ingredients/complete'),
     (['GET'], BACK_END.ingredient_show, '/ingredients/<ingredient_id>'),
     (['POST'], BACK_END.ingredient_create, '/ingredients/new'),
     (['PUT'], BACK_END.ingredient_edit, '/ingredients/<ingredient_id>'),
     (['DELETE'], BACK_END.ingredient_delete, '/ingredients/<ingredient_id>'),
     (['GET'], BACK_END.recipe_lookup, '/recipes'),
+    (['GET'], BACK_END.recipe_complete, '/recipes/complete'),
+    (['POST'], BACK_END.recipe_batch, '/recipes/batch'),
+    (['POST'], BACK_END.recipe_cookable, '/recipes/cookable'),
     (['GET'], BACK_END.recipe_get, '/recipes/<recipe_id>'),
     (['GET'], BACK_END.recipe_requirements,
      '/recipes/<recipe_id>/requirements'),
@@ -21,7 +25,11 @@ ROUTES = (
     (['POST'], BACK_END.recipe_create, '/recipes/new'),
     (['PUT'], BACK_END.recipe_edit, '/recipes/<recipe_id>'),
     (['DELETE'], BACK_END.recipe_delete, '/recipes/<recipe_id>'),
+    (['POST'], BACK_END.shopping_list, '/shopping-list'),
+    (['GET'], BACK_END.export, '/export'),
+    (['POST'], BACK_END.import_documents, '/import'),
     (['GET'], BACK_END.label_lookup, '/labels'),
+    (['GET'], BACK_END.label_complete, '/labels/complete'),
     (['POST'], BACK_END.label_create, '/labels/new'),
     (['GET'], BACK_END.label_show, '/labels/<label_id>'),
     (['PUT'], BACK_END.label_edit, '/labels/<label_id>'),
@@ -40,11 +48,18 @@ ROUTES = (
      '/recipes/<recipe_id>/dependencies/<required_id>'),
     (['POST'], BACK_END.tag_add, '/recipes/<recipe_id>/tags/add'),
     (['DELETE'], BACK_END.tag_delete, '/recipes/<recipe_id>/tags/<label_id>'),
+    (['GET'], BACK_END.metrics, '/metrics'),
+    (['GET'], BACK_END.profile, '/debug/profile'),
 )
 
 
-def setup_routes(application, driver):
+def setup_routes(application,
+                 driver,
+                 metrics_directory=None,
+                 profile_token=None):
     BACK_END.driver = driver
+    BACK_END.monitor.directory = metrics_directory
+    BACK_END.profile_token = profile_token
 
     for methods, view_func, rule in ROUTES:
         application.add_url_rule(rule=rule,
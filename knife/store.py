@@ -4,26 +4,54 @@ store.py
 Implementation of the Store class
 """
 
+import hmac
+import json
+import time
+import base64
+import logging
+import binascii
+import threading
 import traceback
 import werkzeug
 from typing import Any
-from flask import request, make_response
+from contextlib import contextmanager
+from urllib.parse import urlencode
+from flask import Response, request, make_response
 from knife import helpers
+from knife.cache import ReadMemo
+from knife.drivers import BATCH_SIZE, OneOf
+from knife.indexes import COMPLETION_LIMIT, CompletionIndex, CookableIndex
+from knife.metrics import CONTENT_TYPE, Metrics
+from knife.profiler import PROFILE_LIMIT, Profiler, format_stacks
 from knife.models.knife_model import Datatypes, Field
 from knife.models import (
+    Classifications,
     Dependency,
     Ingredient,
     Label,
     Recipe,
+    RecipeClassification,
     Requirement,
     Tag,
 )
 from knife.operations import (
+    bump_generation,
+    current_generation,
     dependency_list,
     dependency_nodes,
+    dependent_recipes,
+    import_documents,
+    ingredient_classifications,
+    parse_documents,
+    reclassify,
+    recipe_batch,
+    recipe_details,
+    recipe_export,
     requirement_list,
+    shopping_list,
+    store_classifications,
+    stored_classifications,
     tag_list,
-    classify,
 )
 from knife.exceptions import (
     DependencyAlreadyExists,
@@ -46,6 +74,8 @@ from knife.exceptions import (
     TagNotFound,
 )
 
+LOGGER = logging.getLogger(__name__)
+
 
 def validate_query(
     args_dict: dict[str, str],
@@ -84,6 +114,182 @@ def _convert(form, model):
             yield (field, form.get(field.name))
 
 
+# Maximum number of recipes read by a batch request
+BATCH_LIMIT = 100
+
+
+def batch_ids(form, limit=BATCH_LIMIT):
+    """
+    Extract the ids of a batch request, passed as a list or under the `ids`
+    key of the form. No more than limit ids are accepted, when it is set.
+    """
+    ids = form.get('ids') if isinstance(form, dict) else form
+
+    if not isinstance(ids, list) or not all(
+            isinstance(item, str) for item in ids):
+        raise InvalidValue('ids', ids)
+
+    if limit is not None and len(ids) > limit:
+        raise InvalidValue('ids', "more than %d ids" % limit)
+
+    return ids
+
+
+def completion_query(args):
+    """Extract the prefix and the number of results of a completion query"""
+    for key in args:
+        if key not in {'name', 'limit'}:
+            raise InvalidQuery({key: args.get(key)})
+
+    try:
+        limit = int(args.get('limit', COMPLETION_LIMIT))
+    except ValueError:
+        raise InvalidValue('limit', args.get('limit'))
+
+    if limit < 1:
+        raise InvalidValue('limit', limit)
+
+    return args.get('name', ''), min(limit, COMPLETION_LIMIT)
+
+
+class Page(list):
+    """
+    Records returned by a paginated lookup. The cursor designates the last
+    record of the page when more may follow, and is None otherwise.
+    """
+
+    def __init__(self, records, cursor=None):
+        super().__init__(records)
+        self.cursor = cursor
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise InvalidValue('cursor', cursor)
+
+    # Pages are ordered on text fields, the cursor holding their values
+    if not isinstance(values, list) or not all(
+            isinstance(value, str) for value in values):
+        raise InvalidValue('cursor', cursor)
+
+    return values
+
+
+def page_query(args):
+    """
+    Split the pagination parameters from the rest of the args of a lookup.
+    Returns the remaining args and the keyword arguments of the read.
+    """
+    args = dict(args)
+    page = {}
+
+    for key in ['limit', 'offset']:
+        if key not in args:
+            continue
+
+        value = args.pop(key)
+
+        try:
+            page[key] = int(value)
+        except ValueError:
+            raise InvalidValue(key, value)
+
+        if page[key] < 0:
+            raise InvalidValue(key, page[key])
+
+    if 'cursor' in args:
+        page['after'] = decode_cursor(args.pop('cursor'))
+
+    return args, page
+
+
+def paginated_read(driver, model, filters, page):
+    """
+    Read the id and name of the records of model matching filters, one page
+    at a time when page is set. Pages are ordered by simple name and id,
+    which the cursor of the next page points into.
+    """
+    columns = (model.fields.id, model.fields.name)
+
+    if not page:
+        return Page(
+            map(lambda x: format_as_index(x, model),
+                driver.read(model, filters=filters, columns=columns,
+                            exact=False)))
+
+    order = (model.fields.simple_name, model.fields.id)
+
+    if (after := page.get('after')) is not None and len(after) != len(order):
+        raise InvalidValue('cursor', after)
+
+    records = driver.read(model,
+                          filters=filters,
+                          columns=columns + order[:1],
+                          exact=False,
+                          order=order,
+                          **page)
+
+    cursor = None
+    if records and len(records) == page.get('limit'):
+        cursor = encode_cursor([records[-1][field] for field in order])
+
+    return Page(map(lambda x: format_as_index(x, model), records), cursor)
+
+
+def paginated_ids(driver, model, ids, page, size=BATCH_SIZE):
+    """
+    Same as paginated_read, for the records of model whose id is in ids. The
+    ids are read size at a time, to stay under the limits of the databases
+    on the number of parameters of a statement, and paged in memory.
+    """
+    ids = sorted(ids)
+    order = (model.fields.simple_name, model.fields.id)
+    records = []
+
+    for start in range(0, len(ids), size):
+        records += driver.read(
+            model,
+            filters=[{
+                model.fields.id: OneOf(ids[start:start + size])
+            }],
+            columns=(model.fields.id, model.fields.name) + order[:1])
+
+    cursor = None
+
+    if page:
+        key = lambda record: [record[field] for field in order]
+        records.sort(key=key)
+
+        if (after := page.get('after')) is not None:
+            if len(after) != len(order):
+                raise InvalidValue('cursor', after)
+
+            records = [record for record in records if key(record) > after]
+
+        offset, limit = page.get('offset', 0), page.get('limit')
+        records = records[offset:None if limit is None else offset + limit]
+
+        if records and len(records) == limit:
+            cursor = encode_cursor(key(records[-1]))
+
+    return Page(map(lambda x: format_as_index(x, model), records), cursor)
+
+
+def next_page(cursor):
+    """URL of the page following the current request, starting at cursor"""
+    args = request.args.to_dict()
+    args.pop('offset', None)
+    args['cursor'] = cursor
+
+    return "%s?%s" % (request.base_url, urlencode(args))
+
+
 def format_as_index(record, model):
     return {
         model.fields.id.name: record[model.fields.id],
@@ -91,31 +297,115 @@ def format_as_index(record, model):
     }
 
 
+def entity_tag(generation):
+    """ETag of the response to the current request, at a store generation"""
+    return helpers.hash256("%s %s" % (generation, request.full_path))
+
+
+def cache_headers(response, etag):
+    # Caches may keep the response, but must check it is current before use
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+
+
+def not_modified(etag):
+    response = make_response(('', 304))
+    cache_headers(response, etag)
+
+    return response
+
+
+def trace_headers(response, trace, seconds):
+    """Report the statements of a request, which took seconds in total"""
+    response.headers['X-Query-Count'] = str(trace.queries)
+    response.headers['Server-Timing'] = (
+        'db;dur=%.3f;desc="%d queries", total;dur=%.3f' %
+        (1000 * trace.seconds, trace.queries, 1000 * seconds))
+
+
+def read_only(func):
+    """
+    Mark a handler answering requests other than GET without writing, so
+    that it runs in a read only session and keeps the store generation
+    """
+    func.read_only = True
+    return func
+
+
+def untagged(func):
+    """
+    Mark a handler answering GET requests from an in-memory index, which may
+    lag behind the store generation, so that its responses are not tagged
+    """
+    func.untagged = True
+    return func
+
+
 def format_output(func):
     """
     Decoration, encasing the output of the function into a dict for it to be
     sent via the api.
+    The function runs in a single driver session, rolled back on error.
+    Responses to GET requests are tagged with the generation of the store,
+    which every other request changes, and are not computed again when the
+    client already has the current version. Handlers marked untagged are
+    always run.
+    Reads repeated by the function are only sent to the database once,
+    until it writes. The in-memory indexes of the store only change once the
+    session is committed.
     Exceptions are caught and parsed to have a clear error message
+    The statements run for the request are timed and counted in the headers
+    of the response, and in the metrics of the store with its duration.
     """
 
-    def wrapper(*orig_args, **orig_kwargs):
+    def respond(*orig_args, **orig_kwargs):
         request_args = helpers.fix_args(dict(request.args))
         request_form = {}
+        store = func.__self__
+        driver = store.driver
+        monitor = store.monitor
+        # Flask answers HEAD requests with the GET view
+        safe = request.method in ('GET', 'HEAD')
+        readonly = safe or getattr(func, 'read_only', False)
+        etag = None
 
         try:
             if request.is_json:
                 request_form = request.get_json()
-            data = func(*orig_args,
-                        **orig_kwargs,
-                        args=request_args,
-                        form=request_form)
+            with store.deferred(driver.transactional), \
+                    driver.session(readonly=readonly), \
+                    driver.memoize() as memo:
+                if safe and not getattr(func, 'untagged', False):
+                    etag = entity_tag(current_generation(driver))
+
+                    if request.if_none_match.contains(etag):
+                        return not_modified(etag)
+
+                try:
+                    data = func(*orig_args,
+                                **orig_kwargs,
+                                args=request_args,
+                                form=request_form)
+                except BaseException:
+                    # Drivers without rollback keep the writes made before
+                    if not readonly and not driver.transactional:
+                        bump_generation(driver)
+                    raise
+
+                if not readonly:
+                    bump_generation(driver)
+
+            LOGGER.debug("%s %s: %d of %d reads answered from memory",
+                         request.method, request.path, memo.saved, memo.reads)
         except KnifeError as kerr:
+            monitor.error(request.endpoint, kerr, kerr.status)
             return make_response(({
                 'accept': False,
                 'error': str(kerr),
                 'data': kerr.data
             }, kerr.status))
         except werkzeug.exceptions.BadRequest as err:
+            monitor.error(request.endpoint, err, 400)
             return make_response(({
                 'accept': False,
                 'error': str(err),
@@ -123,12 +413,43 @@ def format_output(func):
             }, 400))
         except Exception as err:
             traceback.print_exc()
+            monitor.error(request.endpoint, err, 500)
             return make_response(({
                 'accept': False,
                 'error': str(err),
                 'data': None
             }, 500))
-        return make_response(({'accept': True, 'data': data}, 200))
+
+        # Streamed responses are sent as is
+        if isinstance(data, Response):
+            response = data
+        else:
+            output = {'accept': True, 'data': data}
+            if isinstance(data, Page) and data.cursor:
+                output['next'] = next_page(data.cursor)
+
+            response = make_response((output, 200))
+
+        if etag:
+            cache_headers(response, etag)
+
+        return response
+
+    def wrapper(*orig_args, **orig_kwargs):
+        start = time.perf_counter()
+        driver = func.__self__.driver
+        endpoint = "%s %s" % (request.method, request.url_rule)
+
+        with driver.trace(endpoint) as trace:
+            response = respond(*orig_args, **orig_kwargs)
+
+        seconds = time.perf_counter() - start
+        trace_headers(response, trace, seconds)
+        func.__self__.monitor.observe(request.endpoint, request.method,
+                                      response.status_code, seconds, trace,
+                                      driver.stats())
+
+        return response
 
     wrapper.__name__ = func.__name__.strip('_')
     return wrapper
@@ -142,21 +463,36 @@ class Store:
 
     def __init__(self, driver):
         self.driver = driver
+        self.completions = dict((model, CompletionIndex(model))
+                                for model in [Ingredient, Recipe, Label])
+        self.cookable = CookableIndex()
+        self.monitor = Metrics()
+        self.local = threading.local()
+        self.profiler = Profiler()
+        # Token required to profile the worker, which is refused when unset
+        self.profile_token = None
 
         for method in [
                 self._dependency_add,
                 self._dependency_delete,
                 self._dependency_edit,
+                self._export,
+                self._import_documents,
+                self._ingredient_complete,
                 self._ingredient_create,
                 self._ingredient_delete,
                 self._ingredient_edit,
                 self._ingredient_lookup,
                 self._ingredient_show,
+                self._label_complete,
                 self._label_create,
                 self._label_delete,
                 self._label_edit,
                 self._label_lookup,
                 self._label_show,
+                self._recipe_batch,
+                self._recipe_complete,
+                self._recipe_cookable,
                 self._recipe_create,
                 self._recipe_delete,
                 self._recipe_edit,
@@ -168,12 +504,101 @@ class Store:
                 self._requirement_add,
                 self._requirement_delete,
                 self._requirement_edit,
+                self._shopping_list,
                 self._tag_add,
                 self._tag_delete,
         ]:
             formatted = format_output(method)
             self.__setattr__(formatted.__name__, formatted)
 
+    @property
+    def driver(self):
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver):
+        # Requests remember their reads through the memo
+        self._driver = ReadMemo(driver) if driver else driver
+
+    @contextmanager
+    def deferred(self, transactional=True):
+        """
+        Hold the changes of the in-memory indexes made in the enclosed block
+        and apply them when it exits, unless it fails and its writes are
+        rolled back
+        """
+        self.local.pending = []
+
+        try:
+            yield
+        except BaseException:
+            if not transactional:
+                self._apply()
+            raise
+        else:
+            self._apply()
+        finally:
+            self.local.pending = None
+
+    def _apply(self):
+        for func, args in self.local.pending:
+            func(*args)
+
+    def on_commit(self, func, *args):
+        """
+        Call func with args once the writes of the current request are
+        committed, or right away outside of a request
+        """
+        if (pending := getattr(self.local, 'pending', None)) is None:
+            func(*args)
+        else:
+            pending.append((func, args))
+
+    def metrics(self):
+        """Metrics of the requests served by every worker"""
+        return Response(self.monitor.exposition(), content_type=CONTENT_TYPE)
+
+    def profile(self):
+        """
+        Stacks of the requests running in the other threads of the worker,
+        sampled for the number of seconds in the query, in the collapsed
+        format of flame graphs. The token of the store must be passed as a
+        bearer token. Workers answering a request at a time, such as the sync
+        workers of gunicorn, have nothing else to show.
+        """
+
+        def refuse(error, status):
+            return make_response(({
+                'accept': False,
+                'error': error,
+                'data': None
+            }, status))
+
+        if not self.profile_token:
+            return refuse("Profiling is disabled", 404)
+
+        scheme, _, token = request.headers.get('Authorization',
+                                               '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(
+                token.encode(), self.profile_token.encode()):
+            return refuse("Invalid token", 403)
+
+        try:
+            seconds = float(request.args.get('seconds', 1))
+        except ValueError:
+            seconds = -1
+
+        if not 0 < seconds <= PROFILE_LIMIT:
+            return refuse(
+                str(InvalidValue('seconds', request.args.get('seconds'))), 400)
+
+        # The threads of the metrics are not serving requests
+        if (stacks := self.profiler.sample(
+                seconds, ignored=self.monitor.threads())) is None:
+            return refuse("A profile is already running", 409)
+
+        return Response(format_stacks(stacks), mimetype='text/plain')
+
     #  _                          _ _            _
     # (_)_ __   __ _ _ __ ___  __| (_) ___ _ __ | |_
     # | | '_ \ / _` | '__/ _ \/ _` | |/ _ \ '_ \| __|
@@ -211,12 +636,24 @@ class Store:
                 format_as_index(stored[0], Ingredient))
 
         self.driver.write(Ingredient, ing.params)
+        self.on_commit(self.completions[Ingredient].add, ing.id, ing.name)
         return ing.serializable()
 
+    @untagged
+    def _ingredient_complete(self, args=None, form=None):
+        """
+        Get the ingredients whose name starts with the name passed in args
+        """
+        prefix, limit = completion_query(args)
+
+        return self.completions[Ingredient].complete(self.driver, prefix,
+                                                     limit)
+
     def _ingredient_lookup(self, args=None, form=None):
         """
         Get an ingredient list, matching the parameters passed in args
         """
+        args, page = page_query(args)
         filters = validate_query(args, [
             Ingredient.fields.id,
             Ingredient.fields.name,
@@ -226,15 +663,7 @@ class Store:
             filters[Ingredient.fields.simple_name] = helpers.simplify(pattern)
             filters.pop(Ingredient.fields.name)
 
-        read = self.driver.read(
-            Ingredient,
-            filters=[filters],
-            columns=[Ingredient.fields.id, Ingredient.fields.name],
-            exact=False)
-
-        format_ing = lambda x: format_as_index(x, Ingredient)
-
-        return list(map(format_ing, read))
+        return paginated_read(self.driver, Ingredient, [filters], page)
 
     def _ingredient_show(self, ingredient_id, args=None, form=None):
         """
@@ -281,12 +710,13 @@ class Store:
                           filters=[{
                               Ingredient.fields.id: ingredient_id
                           }])
+        self.on_commit(self.completions[Ingredient].discard, ingredient_id)
 
     def _ingredient_edit(self, ingredient_id, args=None, form=None):
-        if not self.driver.read(Ingredient,
-                                filters=[{
-                                    Ingredient.fields.id: ingredient_id
-                                }]):
+        if not (stored := self.driver.read(
+                Ingredient, filters=[{
+                    Ingredient.fields.id: ingredient_id
+                }])):
             raise IngredientNotFound(ingredient_id)
 
         validate_query(form, [
@@ -325,6 +755,31 @@ class Store:
                               Ingredient.fields.id: ingredient_id
                           }])
 
+        if Ingredient.fields.name.name in form:
+            self.on_commit(self.completions[Ingredient].add, ingredient_id,
+                           form[Ingredient.fields.name.name])
+
+        before = ingredient_classifications(stored[0])
+        after = ingredient_classifications(
+            self.driver.read(Ingredient,
+                             filters=[{
+                                 Ingredient.fields.id: ingredient_id
+                             }])[0])
+
+        if before != after:
+            recipes = self.driver.read(Requirement,
+                                       columns=[Requirement.fields.recipe_id],
+                                       filters=[{
+                                           Requirement.fields.ingredient_id:
+                                           ingredient_id
+                                       }])
+            recipe_ids = set(r[Requirement.fields.recipe_id] for r in recipes)
+
+            if before + after == after:
+                reclassify(self.driver, recipe_ids, added=after)
+            else:
+                reclassify(self.driver, recipe_ids)
+
     #      _ _     _
     #   __| (_)___| |__
     #  / _` | / __| '_ \
@@ -361,12 +816,41 @@ class Store:
             raise RecipeAlreadyExists(format_as_index(recipes[0], Recipe))
 
         self.driver.write(Recipe, recipe.params)
+        store_classifications(self.driver, recipe.id, Classifications())
+        self.on_commit(self.completions[Recipe].add, recipe.id, recipe.name)
+        self.on_commit(self.cookable.add_recipe, recipe.id)
         return recipe.serializable()
 
+    @untagged
+    def _recipe_complete(self, args=None, form=None):
+        """
+        Get the recipes whose name starts with the name passed in args
+        """
+        prefix, limit = completion_query(args)
+
+        return self.completions[Recipe].complete(self.driver, prefix, limit)
+
+    @read_only
+    def _recipe_cookable(self, args=None, form=None):
+        """
+        Get the recipes that can be cooked from the ingredients of the ids
+        passed in the form, as a list or under the `ids` key. Optional
+        requirements and dependencies are not needed.
+        """
+        args, page = page_query(args or {})
+        if args:
+            raise InvalidQuery(args)
+
+        ingredient_ids = batch_ids(form, limit=None)
+        recipe_ids = self.cookable.cookable(self.driver, ingredient_ids)
+
+        return paginated_ids(self.driver, Recipe, recipe_ids, page)
+
     def _recipe_lookup(self, args=None, form=None):
         """
         Get a recipe list, matching the parameters passed in args
         """
+        args, page = page_query(args)
         filters = validate_query(args, [
             Recipe.fields.name,
             Recipe.fields.id,
@@ -378,14 +862,7 @@ class Store:
             filters[Recipe.fields.simple_name] = helpers.simplify(pattern)
             filters.pop(Recipe.fields.name)
 
-        read = self.driver.read(Recipe,
-                                filters=[filters],
-                                columns=(Recipe.fields.id, Recipe.fields.name),
-                                exact=False)
-
-        format_recipe = lambda x: format_as_index(x, Recipe)
-
-        return list(map(format_recipe, read))
+        return paginated_read(self.driver, Recipe, [filters], page)
 
     def _recipe_delete(self, recipe_id, args=None, form=None):
         """
@@ -397,6 +874,8 @@ class Store:
                                 }]):
             raise RecipeNotFound(recipe_id)
 
+        dependents = dependent_recipes(self.driver, [recipe_id]) - {recipe_id}
+
         for requirement in self.driver.read(Requirement,
                                             filters=[{
                                                 Requirement.fields.recipe_id:
@@ -418,28 +897,46 @@ class Store:
             self.driver.erase(Dependency, filters=[dependency])
 
         self.driver.erase(Recipe, filters=[{Recipe.fields.id: recipe_id}])
+        self.on_commit(self.completions[Recipe].discard, recipe_id)
+        self.on_commit(self.cookable.discard_recipe, recipe_id)
+        self.driver.erase(RecipeClassification,
+                          filters=[{
+                              RecipeClassification.fields.recipe_id: recipe_id
+                          }])
+
+        reclassify(self.driver, dependents)
 
     def _recipe_get(self, recipe_id, args=None, form=None):
         """
         Get full details about the recipe of the specified id
         """
-        rf = Recipe.fields
-        if not (results := self.driver.read(Recipe,
-                                            filters=[{
-                                                rf.id: recipe_id
-                                            }])):
+        if not (recipe_data := recipe_details(self.driver, recipe_id)):
             raise RecipeNotFound(recipe_id)
 
-        extra = dict(
-            requirements=requirement_list(self.driver, recipe_id),
-            dependencies=dependency_list(self.driver, recipe_id),
-            tags=tag_list(self.driver, recipe_id),
-            classifications=classify(self.driver, recipe_id),
-        )
+        return recipe_data
 
-        recipe_data = Recipe(results[0]).serializable(**extra)
+    @read_only
+    def _recipe_batch(self, args=None, form=None):
+        """
+        Get full details about the recipes of the ids passed in the form, as
+        a list or under the `ids` key, in the order given
+        """
+        recipe_ids = batch_ids(form)
+        documents = recipe_batch(self.driver, set(recipe_ids))
 
-        return recipe_data
+        for recipe_id in recipe_ids:
+            if recipe_id not in documents:
+                raise RecipeNotFound(recipe_id)
+
+        return [documents[recipe_id] for recipe_id in recipe_ids]
+
+    @read_only
+    def _shopping_list(self, args=None, form=None):
+        """
+        List the ingredients needed to cook the recipes of the ids passed in
+        the form, as a list or under the `ids` key, and all their dependencies
+        """
+        return shopping_list(self.driver, batch_ids(form))
 
     def _recipe_requirements(self, recipe_id, args=None, form=None):
         if not self.driver.read(Recipe,
@@ -510,6 +1007,10 @@ class Store:
                               Recipe.fields.id: recipe_id
                           }])
 
+        if Recipe.fields.name.name in form:
+            self.on_commit(self.completions[Recipe].add, recipe_id,
+                           form[Recipe.fields.name.name])
+
         return self._recipe_get(recipe_id)
 
     def _tag_add(self, recipe_id, args=None, form=None):
@@ -537,6 +1038,7 @@ class Store:
             label = Label(**format_as_index(stored[0], Label))
         else:
             self.driver.write(Label, label.params)
+            self.on_commit(self.completions[Label].add, label.id, label.name)
 
         if self.driver.read(Tag,
                             filters=[{
@@ -625,6 +1127,10 @@ class Store:
             raise DependencyCycle()
 
         self.driver.write(Dependency, params)
+        self.on_commit(self.cookable.set_dependency, recipe_id, required_id,
+                       params[Dependency.fields.optional])
+        reclassify(self.driver, [recipe_id],
+                   added=stored_classifications(self.driver, required_id))
 
     def _dependency_edit(self, recipe_id, required_id, args=None, form=None):
         """
@@ -650,6 +1156,10 @@ class Store:
                               Dependency.fields.requisite: required_id
                           }])
 
+        if Dependency.fields.optional in params:
+            self.on_commit(self.cookable.set_dependency, recipe_id,
+                           required_id, params[Dependency.fields.optional])
+
     def _dependency_delete(self, recipe_id, required_id, args=None, form=None):
         """
         Delete a recipe requirement for a recipe
@@ -667,6 +1177,9 @@ class Store:
                               Dependency.fields.required_by: recipe_id,
                               Dependency.fields.requisite: required_id
                           }])
+        self.on_commit(self.cookable.discard_dependency, recipe_id,
+                       required_id)
+        reclassify(self.driver, [recipe_id])
 
     #                       _                               _
     #  _ __ ___  __ _ _   _(_)_ __ ___ _ __ ___   ___ _ __ | |_
@@ -696,10 +1209,10 @@ class Store:
                 Requirement.fields.ingredient_id.name)):
             raise InvalidValue(Requirement.fields.ingredient_id, None)
 
-        if not self.driver.read(Ingredient,
-                                filters=[{
-                                    Ingredient.fields.id: ingredient_id
-                                }]):
+        if not (ingredient := self.driver.read(
+                Ingredient, filters=[{
+                    Ingredient.fields.id: ingredient_id
+                }])):
             raise IngredientNotFound(ingredient_id)
 
         if not (quantity := form.get(Requirement.fields.quantity.name)):
@@ -717,6 +1230,10 @@ class Store:
         requirement = Requirement(**form, recipe_id=recipe_id)
 
         self.driver.write(Requirement, requirement.params)
+        self.on_commit(self.cookable.set_requirement, recipe_id, ingredient_id,
+                       requirement.optional)
+        reclassify(self.driver, [recipe_id],
+                   added=ingredient_classifications(ingredient[0]))
 
     def _requirement_edit(self,
                           recipe_id,
@@ -739,8 +1256,9 @@ class Store:
                 }]):
             raise RequirementNotFound(recipe_id, ingredient_id)
 
+        params = dict(_convert(form, Requirement))
         self.driver.write(Requirement,
-                          dict(_convert(form, Requirement)),
+                          params,
                           filters=[{
                               Requirement.fields.recipe_id:
                               recipe_id,
@@ -748,6 +1266,10 @@ class Store:
                               ingredient_id
                           }])
 
+        if Requirement.fields.optional in params:
+            self.on_commit(self.cookable.set_requirement, recipe_id,
+                           ingredient_id, params[Requirement.fields.optional])
+
     def _requirement_delete(self,
                             recipe_id,
                             ingredient_id,
@@ -771,11 +1293,15 @@ class Store:
                               Requirement.fields.ingredient_id:
                               ingredient_id
                           }])
+        self.on_commit(self.cookable.discard_requirement, recipe_id,
+                       ingredient_id)
+        reclassify(self.driver, [recipe_id])
 
     def _label_lookup(self, args=None, form=None):
         """
         Get all labels which match the parameters in args
         """
+        args, page = page_query(args)
         filters = validate_query(args, [
             Label.fields.id,
             Label.fields.name,
@@ -784,14 +1310,7 @@ class Store:
         if Label.fields.name in filters:
             filters[Label.fields.name] = filters.pop(Label.fields.name)
 
-        saved = self.driver.read(Label,
-                                 filters=[filters],
-                                 columns=(Label.fields.id, Label.fields.name),
-                                 exact=False)
-
-        format_label = lambda x: format_as_index(x, Label)
-
-        return list(map(format_label, saved))
+        return paginated_read(self.driver, Label, [filters], page)
 
     def _label_delete(self, label_id, args=None, form=None):
         if not self.driver.read(Label, filters=[{Label.fields.id: label_id}]):
@@ -804,6 +1323,7 @@ class Store:
             self.driver.erase(Tag, filters=[tag])
 
         self.driver.erase(Label, filters=[{Label.fields.id: label_id}])
+        self.on_commit(self.completions[Label].discard, label_id)
 
     def _label_create(self, args=None, form=None):
         validate_query(form, [Label.fields.name])
@@ -821,9 +1341,19 @@ class Store:
             raise LabelAlreadyExists(format_as_index(stored[0], Label))
         else:
             self.driver.write(Label, label.params)
+            self.on_commit(self.completions[Label].add, label.id, label.name)
 
         return label.serializable
 
+    @untagged
+    def _label_complete(self, args=None, form=None):
+        """
+        Get the labels whose name starts with the name passed in args
+        """
+        prefix, limit = completion_query(args)
+
+        return self.completions[Label].complete(self.driver, prefix, limit)
+
     def _label_show(self, label_id, args=None, form=None):
         """
         Show recipes tagged with the label
@@ -879,3 +1409,58 @@ class Store:
                 Label.fields.id: label_id
             }],
         )
+
+        if Label.fields.name.name in form:
+            self.on_commit(self.completions[Label].add, label_id,
+                           form[Label.fields.name.name])
+
+    #                             _
+    #   _____  ___ __   ___  _ __| |_
+    #  / _ \ \/ / '_ \ / _ \| '__| __|
+    # |  __/>  <| |_) | (_) | |  | |_
+    #  \___/_/\_\ .__/ \___/|_|   \__|
+    #           |_|
+
+    def _export(self, args=None, form=None):
+        """
+        Stream the documents of all the recipes, one JSON object per line
+        """
+        for key in args:
+            if key != 'format':
+                raise InvalidQuery({key: args.get(key)})
+
+        if (export_format := args.get('format', 'ndjson')) != 'ndjson':
+            raise InvalidValue('format', export_format)
+
+        def _stream():
+            # The response is sent after the session of the request closed,
+            # so the export reads in a session of its own
+            with self.driver.session(readonly=True):
+                for document in recipe_export(self.driver):
+                    yield json.dumps(document) + '\n'
+
+        return Response(_stream(), mimetype='application/x-ndjson')
+
+    def _import_documents(self, args=None, form=None):
+        """
+        Create recipes in bulk from the documents sent as JSON, or as NDJSON
+        in the body of the request
+        """
+        if args:
+            raise InvalidQuery(args)
+
+        if isinstance(form, list):
+            documents = form
+        elif form:
+            documents = [form]
+        else:
+            documents = parse_documents(request.get_data(as_text=True))
+
+        report = import_documents(self.driver, documents)
+
+        # Imported names are picked up when the indexes are next used
+        for index in self.completions.values():
+            self.on_commit(index.invalidate)
+        self.on_commit(self.cookable.invalidate)
+
+        return report
@@ -0,0 +1,264 @@
+"""
+Time Store handlers against the database described by DATABASE_TYPE and
+DATABASE_URL. SQL databases need their tables created beforehand, see
+db_definition.py.
+
+Compare connection modes by running the same workload with a different
+DATABASE_URL:
+
+    DATABASE_TYPE=pgsql DATABASE_URL=postgresql://... benchmark.py recipe_get
+    DATABASE_TYPE=pgsql DATABASE_URL=postgresql://...?pool=1 benchmark.py recipe_get
+
+Joins are best compared on a larger dataset, generated in bulk:
+
+    DATABASE_TYPE=json DATABASE_URL=bench.json benchmark.py requirement_join -r 20000
+"""
+
+import os
+import sys
+import time
+import argparse
+from knife.cache import CachedDriver
+from knife.drivers import DRIVERS, get_driver
+from knife.drivers.json import JSONDriver
+from knife.models import (
+    Ingredient,
+    Recipe,
+    RecipeClassification,
+    Requirement,
+)
+from knife.store import Store
+
+INGREDIENTS = 100
+REQUIREMENTS_PER_RECIPE = 10
+BATCH_SIZE = 21
+
+
+def populate(store, size):
+    """Create a chain of recipes, each requiring a few ingredients"""
+    ingredients = [
+        store._ingredient_create({}, dict(name="Benchmark ingredient %d" % i))
+        for i in range(3)
+    ]
+
+    recipes = []
+    for index in range(size):
+        recipe = store._recipe_create({},
+                                      dict(name="Benchmark recipe %d" % index))
+        recipes.append(recipe['id'])
+
+        for ingredient in ingredients:
+            store._requirement_add(
+                recipe['id'], {},
+                dict(ingredient_id=ingredient['id'], quantity='1'))
+
+        if index:
+            store._dependency_add(recipe['id'], {},
+                                  dict(requisite=recipes[index - 1]))
+
+    return recipes
+
+
+def bulk_write(driver, model, records):
+    if isinstance(driver, JSONDriver):
+        # A write rewrites the whole file, so insert everything at once
+        driver.db.table(model.table_name).insert_multiple(
+            dict((k.name, v) for (k, v) in record.items())
+            for record in records)
+    else:
+        with driver.session():
+            for record in records:
+                driver.write(model, record)
+
+
+def generate(driver, count):
+    """
+    Write count requirements directly through the driver, spread over
+    recipes requiring REQUIREMENTS_PER_RECIPE of INGREDIENTS ingredients,
+    and the classifications of the recipes, as the Store would
+    """
+    ingredients = [
+        Ingredient(name="Generated ingredient %d" % i)
+        for i in range(INGREDIENTS)
+    ]
+    recipes = [
+        Recipe(name="Generated recipe %d" % i)
+        for i in range(-(-count // REQUIREMENTS_PER_RECIPE))
+    ]
+
+    requirements = []
+    for index in range(count):
+        recipe, rank = divmod(index, REQUIREMENTS_PER_RECIPE)
+        ingredient = ingredients[(recipe + 7 * rank) % INGREDIENTS]
+        requirements.append(
+            Requirement(recipe_id=recipes[recipe].id,
+                        ingredient_id=ingredient.id,
+                        quantity='1').params)
+
+    bulk_write(driver, Ingredient, [i.params for i in ingredients])
+    bulk_write(driver, Recipe, [r.params for r in recipes])
+    bulk_write(driver, Requirement, requirements)
+    bulk_write(driver, RecipeClassification, [{
+        RecipeClassification.fields.recipe_id: recipe.id,
+        RecipeClassification.fields.dairy: False,
+        RecipeClassification.fields.meat: False,
+        RecipeClassification.fields.gluten: False,
+        RecipeClassification.fields.animal_product: False,
+    } for recipe in recipes])
+
+    return [recipe.id for recipe in recipes]
+
+
+def ingredient_show(store, recipes, iterations):
+    ingredients = store.driver.read(Ingredient, columns=[Ingredient.fields.id])
+
+    for index in range(iterations):
+        store._ingredient_show(ingredients[index % len(ingredients)][
+            Ingredient.fields.id])
+
+
+def recipe_create(store, recipes, iterations):
+    for index in range(iterations):
+        store._recipe_create({}, dict(name="Created recipe %d" % index))
+
+
+def recipe_get(store, recipes, iterations):
+    for index in range(iterations):
+        store._recipe_get(recipes[index % len(recipes)])
+
+
+def recipe_batch(store, recipes, iterations):
+    """Read BATCH_SIZE recipes per call, to compare with as many recipe_get"""
+    for index in range(iterations):
+        store._recipe_batch({}, [
+            recipes[(index * BATCH_SIZE + offset) % len(recipes)]
+            for offset in range(BATCH_SIZE)
+        ])
+
+
+def recipe_cookable(store, recipes, iterations):
+    """Find the recipes cookable from pantries of most of the ingredients"""
+    ingredients = [
+        record[Ingredient.fields.id] for record in store.driver.read(
+            Ingredient, columns=[Ingredient.fields.id])
+    ]
+
+    for index in range(iterations):
+        store._recipe_cookable({}, [
+            ingredient_id
+            for rank, ingredient_id in enumerate(ingredients)
+            if (rank + index) % 10
+        ])
+
+
+def recipe_lookup(store, recipes, iterations):
+    for index in range(iterations):
+        store._recipe_lookup(dict(name="recipe %d" % index))
+
+
+def recipe_search(store, recipes, iterations):
+    """Look up the last recipes by number, as typed in a search box"""
+    for index in range(iterations):
+        number = len(recipes) - 1 - index % len(recipes)
+        store._recipe_lookup(dict(name="%d" % number))
+
+
+def shopping_list(store, recipes, iterations):
+    """List the ingredients of the top of the dependency chain"""
+    for _ in range(iterations):
+        store._shopping_list({}, recipes[-1:])
+
+
+def requirement_edit(store, recipes, iterations):
+    """Add and remove a requirement at the bottom of the dependency chain"""
+    ingredient = store._ingredient_create({},
+                                          dict(name="Benchmark ingredient"))
+
+    for index in range(iterations):
+        if index % 2:
+            store._requirement_delete(recipes[0], ingredient['id'])
+        else:
+            store._requirement_add(
+                recipes[0], {},
+                dict(ingredient_id=ingredient['id'], quantity='1'))
+
+
+def requirement_list(store, recipes, iterations):
+    for index in range(iterations):
+        store._recipe_requirements(recipes[index % len(recipes)])
+
+
+def requirement_join(store, recipes, iterations):
+    rf = Requirement.fields
+    for _ in range(iterations):
+        store.driver.read((Requirement, Ingredient, rf.ingredient_id,
+                           Ingredient.fields.id))
+
+
+WORKLOADS = {
+    'ingredient_show': ingredient_show,
+    'recipe_create': recipe_create,
+    'recipe_batch': recipe_batch,
+    'recipe_cookable': recipe_cookable,
+    'recipe_get': recipe_get,
+    'recipe_lookup': recipe_lookup,
+    'recipe_search': recipe_search,
+    'requirement_edit': requirement_edit,
+    'requirement_list': requirement_list,
+    'requirement_join': requirement_join,
+    'shopping_list': shopping_list,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('workload', choices=WORKLOADS.keys())
+    parser.add_argument('-n',
+                        '--iterations',
+                        type=int,
+                        default=200,
+                        help="calls to the handler")
+    parser.add_argument('-s',
+                        '--size',
+                        type=int,
+                        default=10,
+                        help="recipes created before the run")
+    parser.add_argument('-r',
+                        '--requirements',
+                        type=int,
+                        default=0,
+                        help="requirements generated in bulk before the run")
+    parser.add_argument('-c',
+                        '--cache',
+                        type=int,
+                        default=0,
+                        help="reads kept by a CachedDriver, none by default")
+    arguments = parser.parse_args()
+
+    try:
+        driver = get_driver(os.environ['DATABASE_TYPE'],
+                            os.environ['DATABASE_URL'])
+    except KeyError as err:
+        print("Missing environment variable: %s" % str(err), file=sys.stderr)
+        sys.exit(4)
+
+    if not driver:
+        print("Available backends: %s" % ", ".join(DRIVERS.keys()),
+              file=sys.stderr)
+        sys.exit(4)
+
+    if arguments.cache:
+        driver = CachedDriver(driver, arguments.cache)
+
+    store = Store(driver)
+    recipes = populate(store, arguments.size)
+    if arguments.requirements:
+        recipes = generate(driver, arguments.requirements)
+
+    start = time.perf_counter()
+    WORKLOADS[arguments.workload](store, recipes, arguments.iterations)
+    elapsed = time.perf_counter() - start
+
+    print("%s: %d calls in %.3fs, %.2fms/call, %.1f calls/s" %
+          (arguments.workload, arguments.iterations, elapsed,
+           1000 * elapsed / arguments.iterations,
+           arguments.iterations / elapsed))
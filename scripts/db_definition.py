@@ -12,8 +12,13 @@ def default(value):
     raise ValueError("Driver not found")
 
 
+def no_indexes(value):
+    return []
+
+
 if __name__ == '__main__':
     serializer = default
+    indexes = no_indexes
 
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
@@ -28,6 +33,17 @@ if __name__ == '__main__':
 
         if driver_name == driver_module.__getattribute__('DRIVER_NAME'):
             serializer = driver_module.__getattribute__('model_definition')
+            indexes = getattr(driver_module, 'index_definitions', no_indexes)
 
     for obj in OBJECTS:
         print("%s;" % serializer(obj))
+
+    # Unique indexes fail on databases holding duplicate values, which have
+    # to be renamed or deleted first
+    print("-- Find the duplicates preventing a unique index with:")
+    print("-- SELECT simple_name FROM <table> GROUP BY simple_name "
+          "HAVING count(*) > 1;")
+
+    for obj in OBJECTS:
+        for statement in indexes(obj):
+            print("%s;" % statement)
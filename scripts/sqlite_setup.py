@@ -2,10 +2,31 @@ import sys
 import os
 import logging
 from knife.models import OBJECTS
-from knife.drivers.sqlite import SqliteDriver, model_definition
+from knife.models.knife_model import Datatypes
+from knife.drivers.sqlite import (
+    SqliteDriver,
+    column_name,
+    index_definitions,
+    model_definition,
+)
+
+
+def duplicates(connexion, model):
+    """Values of the UNIQUE fields of model held by several records"""
+    for field in model.fields.fields:
+        if Datatypes.UNIQUE not in field.datatype:
+            continue
+
+        values = connexion.execute(
+            "SELECT %s FROM %s GROUP BY %s HAVING count(*) > 1" %
+            (column_name(field), model.table_name,
+             column_name(field))).fetchall()
+
+        if values:
+            yield field, [value for (value, ) in values]
 
 if __name__ == '__main__':
-    driver = SqliteDriver()
+    driver = SqliteDriver(os.environ['DATABASE_URL'])
     driver.setup()
 
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
@@ -19,4 +40,24 @@ if __name__ == '__main__':
 
         #driver.connexion.execute("DELETE FROM %s" % obj.table_name)
 
+    # Databases created before the unique indexes may hold duplicate values,
+    # whose records must be renamed or deleted before they can be indexed
+    conflicts = False
+    for obj in OBJECTS:
+        for field, values in duplicates(driver.connexion, obj):
+            conflicts = True
+            print("Duplicate values of %s.%s, rename or delete the records "
+                  "holding them: %s" %
+                  (obj.table_name, field.name, ', '.join(map(str, values))),
+                  file=sys.stderr)
+
+    if conflicts:
+        driver.close()
+        sys.exit(1)
+
+    # Indexes are created even if the tables exist, to upgrade databases
+    for obj in OBJECTS:
+        for statement in index_definitions(obj):
+            driver.connexion.execute(statement)
+
     driver.close()
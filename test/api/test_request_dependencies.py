@@ -231,3 +231,50 @@ class TestDependencyDelete(APITestCase):
         query = requests.delete("%s/%s" % (self.url, 'nonexistent'))
 
         self.assertFalse(query.ok, msg=query.json())
+
+
+class TestShoppingList(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        create_objects()
+        cls.ingredient_id = requests.post(
+            "%s/ingredients/new" % SERVER, json={
+                'name': 'Pomme de terre'
+            }).json().get('data').get('id')
+
+    @classmethod
+    def tearDownClass(cls):
+        requests.delete("%s/recipes/%s/requirements/%s" %
+                        (SERVER, RECIPE_IDS[1], cls.ingredient_id))
+        requests.delete("%s/ingredients/%s" % (SERVER, cls.ingredient_id))
+        delete_objects()
+
+    def setUp(self):
+        self.url = "%s/shopping-list" % SERVER
+        clear_dependencies()
+
+    def test_shopping_list(self):
+        requests.post("%s/recipes/%s/requirements/add" %
+                      (SERVER, RECIPE_IDS[1]),
+                      json={
+                          'ingredient_id': self.ingredient_id,
+                          'quantity': '1kg'
+                      })
+        requests.post("%s/recipes/%s/dependencies/add" %
+                      (SERVER, RECIPE_IDS[0]),
+                      json={'requisite': RECIPE_IDS[1]})
+
+        query = requests.post(self.url, json={'ids': RECIPE_IDS[:1]})
+
+        self.assertTrue(query.ok, msg=query.json())
+        shopping = query.json().get('data')
+        self.assertListEqual(
+            [entry.get('ingredient').get('id') for entry in shopping],
+            [self.ingredient_id])
+        self.assertFalse(shopping[0].get('optional'))
+
+    def test_shopping_list_nonexistent(self):
+        query = requests.post(self.url, json=['missing'])
+
+        self.assertEqual(query.status_code, 404, msg=query.json())
@@ -0,0 +1,75 @@
+import json
+import requests
+from test.api import APITestCase, SERVER
+
+
+def clear_recipes():
+    query = requests.get("%s/recipes" % SERVER)
+    for recipe in query.json().get('data'):
+        requests.delete("%s/recipes/%s" % (SERVER, recipe.get('id')))
+
+
+class TestExport(APITestCase):
+
+    def setUp(self):
+        endpoint = 'export'
+        self.url = "%s/%s" % (SERVER, endpoint)
+
+        clear_recipes()
+        for name in ['Tartare', 'Carpaccio']:
+            requests.post("%s/recipes/new" % SERVER, json={'name': name})
+
+    def tearDown(self):
+        clear_recipes()
+
+    def test_export(self):
+        query = requests.get(self.url, params={'format': 'ndjson'})
+
+        self.assertTrue(query.ok)
+        self.assertEqual(query.headers['Content-Type'], 'application/x-ndjson')
+
+        documents = list(map(json.loads, query.text.splitlines()))
+        self.assertSetEqual(set(document['name'] for document in documents),
+                            {'Tartare', 'Carpaccio'})
+        for document in documents:
+            self.assertListEqual(document['requirements'], [])
+
+    def test_export_wrong_format(self):
+        query = requests.get(self.url, params={'format': 'csv'})
+
+        self.assertFalse(query.ok, msg=query.json())
+
+
+class TestImport(APITestCase):
+
+    def setUp(self):
+        endpoint = 'import'
+        self.url = "%s/%s" % (SERVER, endpoint)
+
+        clear_recipes()
+
+    def tearDown(self):
+        clear_recipes()
+
+    def test_import_json(self):
+        documents = [{'name': 'Tartare'}, {'name': 'Carpaccio'}]
+        query = requests.post(self.url, json=documents)
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertEqual(query.json().get('data').get('recipes'), 2)
+
+    def test_import_ndjson(self):
+        documents = [{'name': 'Tartare'}, {'name': 'Tartare'}]
+        query = requests.post(
+            self.url,
+            data='\n'.join(map(json.dumps, documents)),
+            headers={'Content-Type': 'application/x-ndjson'})
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertEqual(query.json().get('data').get('recipes'), 1)
+        self.assertEqual(query.json().get('data').get('skipped'), 1)
+
+    def test_import_invalid(self):
+        query = requests.post(self.url, data='{"name": ')
+
+        self.assertFalse(query.ok, msg=query.json())
@@ -54,6 +54,79 @@ class TestLabelIndex(APITestCase):
         self.assertFalse(query.ok, msg=query.json())
 
 
+class TestLabelIndexPage(APITestCase):
+
+    def setUp(self):
+        endpoint = 'labels'
+        self.url = "%s/%s" % (SERVER, endpoint)
+
+        clear_labels()
+        for name in ['french', 'fresh', 'italian']:
+            requests.post("%s/labels/new" % SERVER, json={'name': name})
+
+    def tearDown(self):
+        clear_labels()
+
+    def test_index_pages(self):
+        query = requests.get(self.url, params={'limit': 2})
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertEqual(len(query.json().get('data')), 2)
+        self.assertIn('next', query.json())
+
+        query = requests.get(query.json().get('next'))
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertListEqual(
+            [label.get('name') for label in query.json().get('data')],
+            ['italian'])
+        self.assertNotIn('next', query.json())
+
+    def test_index_wrong_limit(self):
+        query = requests.get(self.url, params={'limit': 'all'})
+
+        self.assertFalse(query.ok, msg=query.json())
+
+
+class TestLabelComplete(APITestCase):
+
+    def setUp(self):
+        endpoint = 'labels/complete'
+        self.url = "%s/%s" % (SERVER, endpoint)
+
+        clear_labels()
+        for name in ['french', 'fresh', 'italian']:
+            requests.post("%s/labels/new" % SERVER, json={'name': name})
+
+    def tearDown(self):
+        clear_labels()
+
+    def test_complete(self):
+        query = requests.get(self.url, params={'name': 'fr'})
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertListEqual(
+            [label.get('name') for label in query.json().get('data')],
+            ['french', 'fresh'])
+
+    def test_complete_untagged(self):
+        query = requests.get(self.url, params={'name': 'fr'})
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertNotIn('ETag', query.headers)
+
+    def test_complete_limit(self):
+        query = requests.get(self.url, params={'name': 'fr', 'limit': 1})
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertEqual(len(query.json().get('data')), 1)
+
+    def test_complete_wrong_field(self):
+        query = requests.get(self.url, params={'wrong_field': 'fr'})
+
+        self.assertFalse(query.ok, msg=query.json())
+
+
 class TestLabelCreate(APITestCase):
 
     def setUp(self):
@@ -306,3 +306,116 @@ class TestRecipeShow(APITestCase):
     def test_show_nonexistent(self):
         query = requests.get(self.url + '_bis')
         self.assertFalse(query.ok, msg=query.json())
+
+
+class TestRecipeBatch(APITestCase):
+
+    def setUp(self):
+        endpoint = 'recipes/batch'
+        self.url = "%s/%s" % (SERVER, endpoint)
+
+        clear_recipes()
+        self.recipe_ids = [
+            requests.post("%s/recipes/new" % SERVER, json={
+                'name': name
+            }).json().get('data').get('id')
+            for name in ['Tartare', 'Carpaccio']
+        ]
+
+    def tearDown(self):
+        clear_recipes()
+
+    def test_batch(self):
+        query = requests.post(self.url, json={'ids': self.recipe_ids[::-1]})
+
+        self.assertTrue(query.ok, msg=query.json())
+        self.assertListEqual(
+            [recipe.get('name') for recipe in query.json().get('data')],
+            ['Carpaccio', 'Tartare'])
+        self.assertIn('requirements', query.json().get('data')[0])
+
+    def test_batch_nonexistent(self):
+        query = requests.post(self.url, json=self.recipe_ids + ['missing'])
+
+        self.assertEqual(query.status_code, 404, msg=query.json())
+
+    def test_batch_invalid(self):
+        query = requests.post(self.url, json={'ids': 'Tartare'})
+
+        self.assertFalse(query.ok, msg=query.json())
+
+
+class TestRecipeCache(APITestCase):
+
+    def setUp(self):
+        clear_recipes()
+        recipe_id = requests.post("%s/recipes/new" % SERVER,
+                                  json={
+                                      'name': 'Tartare'
+                                  }).json().get('data').get('id')
+        self.url = "%s/recipes/%s" % (SERVER, recipe_id)
+
+    def tearDown(self):
+        clear_recipes()
+
+    def test_not_modified(self):
+        query = requests.get(self.url)
+        etag = query.headers.get('ETag')
+
+        self.assertTrue(etag, msg=query.headers)
+        self.assertIn('no-cache', query.headers.get('Cache-Control'))
+
+        query = requests.get(self.url, headers={'If-None-Match': etag})
+
+        self.assertEqual(query.status_code, 304)
+        self.assertEqual(query.headers.get('ETag'), etag)
+
+    def test_modified(self):
+        etag = requests.get(self.url).headers.get('ETag')
+        index_etag = requests.get("%s/recipes" % SERVER).headers.get('ETag')
+
+        requests.put(self.url, json={'author': 'jb'})
+
+        query = requests.get(self.url, headers={'If-None-Match': etag})
+
+        self.assertEqual(query.status_code, 200)
+        self.assertNotEqual(query.headers.get('ETag'), etag)
+        self.assertEqual(query.json().get('data').get('author'), 'jb')
+
+        query = requests.get("%s/recipes" % SERVER,
+                             headers={'If-None-Match': index_etag})
+
+        self.assertEqual(query.status_code, 200)
+
+    def test_timing(self):
+        query = requests.get(self.url)
+
+        self.assertGreater(int(query.headers.get('X-Query-Count')), 0)
+        self.assertIn('db;dur=', query.headers.get('Server-Timing'))
+        self.assertIn('total;dur=', query.headers.get('Server-Timing'))
+
+    def test_metrics(self):
+        requests.get(self.url)
+        query = requests.get("%s/metrics" % SERVER)
+
+        self.assertTrue(query.ok)
+        self.assertTrue(query.headers['Content-Type'].startswith('text/plain'))
+        self.assertIn('knife_requests_total{endpoint="recipe_get"', query.text)
+        self.assertIn('knife_request_duration_seconds_bucket', query.text)
+
+    def test_profile_disabled(self):
+        query = requests.get("%s/debug/profile" % SERVER)
+
+        self.assertEqual(query.status_code, 404)
+
+    def test_head(self):
+        etag = requests.get(self.url).headers.get('ETag')
+
+        query = requests.head(self.url)
+
+        self.assertEqual(query.status_code, 200)
+        self.assertEqual(query.headers.get('ETag'), etag)
+
+        query = requests.get(self.url, headers={'If-None-Match': etag})
+
+        self.assertEqual(query.status_code, 304)
@@ -239,3 +239,44 @@ class TestRequirementEdit(APITestCase):
         query = requests.get(self.url)
         self.assertTrue(query.ok, msg=query.json())
         self.assertNotEqual(new_quantity, query.json()['data'][0]['quantity'])
+
+
+class TestRecipeCookable(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        create_objects()
+
+    @classmethod
+    def tearDownClass(cls):
+        delete_objects()
+
+    def setUp(self):
+        clear_requirements()
+        self.url = "%s/recipes/cookable" % SERVER
+        default_requirements()
+
+    def tearDown(self):
+        clear_requirements()
+
+    def cookable(self, ingredient_ids):
+        query = requests.post(self.url, json={'ids': ingredient_ids})
+
+        self.assertTrue(query.ok, msg=query.json())
+        return [recipe.get('id') for recipe in query.json().get('data')]
+
+    def test_cookable(self):
+        self.assertNotIn(RECIPE_ID, self.cookable(INGREDIENT_IDS[1:]))
+        self.assertIn(RECIPE_ID, self.cookable(INGREDIENT_IDS))
+
+    def test_cookable_optional(self):
+        requests.put("%s/recipes/%s/requirements/%s" %
+                     (SERVER, RECIPE_ID, INGREDIENT_IDS[0]),
+                     json={'optional': True})
+
+        self.assertIn(RECIPE_ID, self.cookable([]))
+
+    def test_cookable_invalid(self):
+        query = requests.post(self.url, json={'ids': INGREDIENT_IDS[0]})
+
+        self.assertEqual(query.status_code, 400, msg=query.json())
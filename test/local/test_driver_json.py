@@ -1,13 +1,16 @@
+import os
 from pathlib import Path
 from knife.store import Store
 from knife.models import Recipe, Dependency
 from knife.models.knife_model import Field
+from knife.drivers import OneOf
 from knife.drivers.json import JSONDriver
 from test import TestCase
 from tempfile import NamedTemporaryFile
 
 
 class TestDriverJSONRead(TestCase):
+    location = ''
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -85,13 +88,91 @@ class TestDriverJSONRead(TestCase):
             self.datafile = temp
             self.datafile.write(json)
 
-        self.driver = JSONDriver(self.datafile.name)
+        self.driver = JSONDriver(self.datafile.name + self.location)
 
     def tearDown(self):
         self.datafile.close()
         self.driver.db.close()
         Path(self.datafile.name).unlink()
 
+    def test_aggregate_many(self):
+        fajitas_id = '7fa1f29e27a48cc8dc73cbdcdec7231ff4923bd1520fc8e6e3413547172d490d'
+        guacamole_id = '06faab5fe9048cf9a5d009952e3e491fb4b785cf38a6230f450167004f3733ed'
+        rf = Recipe.fields
+        df = Dependency.fields
+        relations = {
+            'dependencies': ((Dependency, Recipe, df.requisite, rf.id),
+                             df.required_by, (rf.name, )),
+        }
+
+        aggregates = self.driver.aggregate_many(
+            Recipe, rf.id, [fajitas_id, guacamole_id, 'missing'], relations)
+
+        self.assertSetEqual(set(aggregates), {fajitas_id, guacamole_id})
+        self.assertEqual(aggregates[fajitas_id][0][rf.name], 'Fajitas')
+        self.assertCountEqual(aggregates[fajitas_id][1]['dependencies'],
+                              [{
+                                  rf.name: 'Guacamole'
+                              }, {
+                                  rf.name: 'Chipotle Chicken'
+                              }])
+        self.assertListEqual(aggregates[guacamole_id][1]['dependencies'],
+                             [{
+                                 rf.name: 'Pico de Gallo'
+                             }])
+
+    def test_trace(self):
+        with self.driver.trace() as trace:
+            self.driver.read(Recipe, columns=[Recipe.fields.name])
+            self.driver.read((Dependency, Recipe, Dependency.fields.requisite,
+                              Recipe.fields.id))
+
+        self.assertListEqual(
+            [statement for statement, _, _ in trace.statements],
+            ['read recipes', 'read dependencies JOIN recipes'])
+        self.assertGreater(trace.statements[0][1], 0)
+
+    def test_read_in(self):
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name:
+                                    OneOf(['Fajitas', 'Guacamole', 'Salsa'])
+                                }],
+                                columns=[Recipe.fields.name])
+
+        self.assertCountEqual(dump, [{
+            Recipe.fields.name: 'Fajitas'
+        }, {
+            Recipe.fields.name: 'Guacamole'
+        }])
+
+    def test_read_page(self):
+        order = (Recipe.fields.simple_name, Recipe.fields.id)
+        names = lambda records: [r[Recipe.fields.name] for r in records]
+
+        page = self.driver.read(Recipe, order=order, limit=2)
+        self.assertListEqual(names(page),
+                             ['Chipotle Chicken', 'Chipotle Chicken Jaliscan'])
+
+        page = self.driver.read(Recipe, order=order, limit=2, offset=3)
+        self.assertListEqual(names(page), ['Guacamole', 'Pico de Gallo'])
+
+        page = self.driver.read(Recipe,
+                                order=order,
+                                after=('fajitas', ''),
+                                limit=10)
+        self.assertListEqual(names(page), ['Fajitas', 'Guacamole',
+                                           'Pico de Gallo'])
+
+        page = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name: 'Chi'
+                                }],
+                                exact=False,
+                                order=order,
+                                after=('chipotle_chicken', 'f'))
+        self.assertListEqual(names(page), ['Chipotle Chicken Jaliscan'])
+
     def test_read_model(self):
         dump = self.driver.read(Recipe)
 
@@ -211,6 +292,42 @@ class TestDriverJSONRead(TestCase):
         ids = set(filter(None, map(lambda x: x.get(Recipe.fields.id), dump)))
         self.assertSetEqual({fajitas_id}, ids)
 
+    def test_aggregate(self):
+        fajitas_id = '7fa1f29e27a48cc8dc73cbdcdec7231ff4923bd1520fc8e6e3413547172d490d'
+        guacamole_id = '06faab5fe9048cf9a5d009952e3e491fb4b785cf38a6230f450167004f3733ed'
+        rf = Recipe.fields
+        df = Dependency.fields
+        relations = {
+            'dependencies': ((Dependency, Recipe, df.requisite, rf.id),
+                             df.required_by, (rf.name, df.optional)),
+            'required_by': (Dependency, df.requisite, (df.required_by, )),
+        }
+
+        record, related = self.driver.aggregate(Recipe, rf.id, fajitas_id,
+                                                relations)
+        self.assertEqual(record[rf.name], 'Fajitas')
+        self.assertCountEqual(related['dependencies'], [
+            {
+                rf.name: 'Guacamole',
+                df.optional: False
+            },
+            {
+                rf.name: 'Chipotle Chicken',
+                df.optional: False
+            },
+        ])
+        self.assertListEqual(related['required_by'], [])
+
+        _, related = self.driver.aggregate(Recipe, rf.id, guacamole_id,
+                                           relations)
+        self.assertListEqual(related['required_by'],
+                             [{
+                                 df.required_by: fajitas_id
+                             }])
+
+        self.assertIsNone(
+            self.driver.aggregate(Recipe, rf.id, 'missing', relations))
+
     def test_read_join_model_columns(self):
         dump = self.driver.read(
             (
@@ -232,7 +349,70 @@ class TestDriverJSONRead(TestCase):
         })
 
 
+class TestDriverJSONReadIndexed(TestDriverJSONRead):
+    location = '?index=1'
+
+    def test_index_write(self):
+        rf = Recipe.fields
+        self.driver.read(Recipe)
+        self.driver.write(Recipe, Recipe(name='Tacos').params)
+        self.driver.write(Recipe, {rf.author: 'me'},
+                          filters=[{
+                              rf.simple_name: 'tacos'
+                          }])
+        self.driver.erase(Recipe, filters=[{rf.simple_name: 'guacamole'}])
+
+        # The writes were applied to the indexes without reloading the file
+        self.assertTrue(self.driver.index.loaded)
+        self.assertEqual(self.driver.stamp, self.driver.stat())
+
+        dump = self.driver.read(Recipe, filters=[{rf.simple_name: 'tacos'}])
+        self.assertEqual(len(dump), 1)
+        self.assertEqual(dump[0][rf.author], 'me')
+        self.assertListEqual(
+            self.driver.read(Recipe, filters=[{
+                rf.simple_name: 'guacamole'
+            }]), [])
+
+    def test_index_search(self):
+        rf = Recipe.fields
+        self.driver.read(Recipe)
+        self.assertIsNotNone(
+            self.driver.index.candidates('recipes', {rf.simple_name: 'otle'},
+                                         exact=False))
+
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    rf.simple_name: 'otle_chick'
+                                }],
+                                exact=False)
+        self.assertEqual(len(dump), 2)
+
+        self.driver.write(Recipe, {rf.simple_name: 'salsa'},
+                          filters=[{
+                              rf.simple_name: 'chipotle_chicken'
+                          }])
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    rf.simple_name: 'otle_chick'
+                                }],
+                                exact=False)
+        self.assertEqual(len(dump), 1)
+
+    def test_index_reload(self):
+        rf = Recipe.fields
+        self.driver.read(Recipe)
+
+        other = JSONDriver(self.datafile.name)
+        other.write(Recipe, Recipe(name='Tacos').params)
+        other.db.close()
+
+        dump = self.driver.read(Recipe, filters=[{rf.simple_name: 'tacos'}])
+        self.assertEqual(len(dump), 1)
+
+
 class TestDriverJSONWrite(TestCase):
+    location = ''
 
     def setUp(self):
         json = """{
@@ -255,7 +435,7 @@ class TestDriverJSONWrite(TestCase):
             self.datafile = temp
             self.datafile.write(json)
 
-        self.driver = JSONDriver(self.datafile.name)
+        self.driver = JSONDriver(self.datafile.name + self.location)
 
     def tearDown(self):
         self.datafile.close()
@@ -299,6 +479,63 @@ class TestDriverJSONWrite(TestCase):
         self.assertIn("Fajititas", dump)
         self.assertIn("fajititas", dump)
 
+    def test_version(self):
+        version = self.driver.version()
+
+        self.driver.write(Recipe, Recipe(name='Guacamole').params)
+        self.assertNotEqual(self.driver.version(), version)
+
+    def test_version_same_stat(self):
+        recipe = Recipe(name='Guacamole', author='jb')
+        self.driver.write(Recipe, recipe.params)
+        stat = os.stat(self.datafile.name)
+        version = self.driver.version()
+
+        # A write of the same size within the resolution of the timestamps
+        self.driver.write(Recipe, {Recipe.fields.author: 'jc'},
+                          filters=[{
+                              Recipe.fields.id: recipe.id
+                          }])
+        os.utime(self.datafile.name, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertNotEqual(self.driver.version(), version)
+
+
+class TestDriverJSONWriteBehind(TestDriverJSONWrite):
+    location = '?write_behind=1&flush_writes=1&fsync=0'
+
+    def dump(self):
+        with open(self.datafile.name, 'r') as datafile:
+            return datafile.read()
+
+    def test_flush_writes(self):
+        self.driver.db.storage.writes = 2
+
+        self.driver.write(Recipe, Recipe(name='Guacamole').params)
+        self.assertNotIn('Guacamole', self.dump())
+        self.assertEqual(len(self.driver.read(Recipe)), 2)
+
+        self.driver.write(Recipe, Recipe(name='Tacos').params)
+        self.assertIn('Guacamole', self.dump())
+        self.assertIn('Tacos', self.dump())
+
+    def test_flush_interval(self):
+        self.driver.db.storage.writes = 0
+        self.driver.db.storage.interval = 50
+
+        self.driver.write(Recipe, Recipe(name='Guacamole').params)
+        self.driver.db.storage.timer.join()
+        self.assertIn('Guacamole', self.dump())
+
+    def test_flush_close(self):
+        self.driver.db.storage.writes = 0
+
+        self.driver.write(Recipe, Recipe(name='Guacamole').params)
+        self.assertNotIn('Guacamole', self.dump())
+
+        self.driver.db.close()
+        self.assertIn('Guacamole', self.dump())
+
 
 class TestDriverJSONErase(TestCase):
 
@@ -0,0 +1,310 @@
+import os
+import unittest
+import threading
+import psycopg2
+from knife.models import Recipe, Dependency
+from knife.drivers import OneOf
+from knife.exceptions import DatabaseBusy
+from knife.drivers.pgsql import PostGresDriver, model_definition
+from test import TestCase
+
+# These tests need a disposable database, for instance:
+# PGSQL_TEST_URL=postgresql://postgres@/knife_test?host=/tmp&sslmode=disable
+LOCATION = os.environ.get('PGSQL_TEST_URL')
+
+
+@unittest.skipUnless(LOCATION, "PGSQL_TEST_URL is not set")
+class TestDriverPgsql(TestCase):
+    options = ''
+
+    def setUp(self):
+        separator = '&' if '?' in LOCATION else '?'
+        self.driver = PostGresDriver(LOCATION + separator + self.options)
+
+        self.driver.setup()
+        for model in [Recipe, Dependency]:
+            self.driver.cursor.execute("DROP TABLE IF EXISTS %s" %
+                                       model.table_name)
+            self.driver.cursor.execute(model_definition(model))
+        self.driver.close()
+
+        self.fajitas = Recipe(name='Fajitas')
+        self.driver.write(Recipe, self.fajitas.params)
+
+    def tearDown(self):
+        self.driver.setup()
+        for model in [Recipe, Dependency]:
+            self.driver.cursor.execute("DROP TABLE %s" % model.table_name)
+        self.driver.close()
+
+        if self.driver.pool:
+            self.driver.pool.closeall()
+
+    def test_read(self):
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name: 'Fajitas'
+                                }])
+        self.assertEqual(len(dump), 1)
+        self.assertEqual(dump[0][Recipe.fields.id], self.fajitas.id)
+
+    def test_read_in(self):
+        names = lambda records: sorted(r[Recipe.fields.name] for r in records)
+
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name:
+                                    OneOf(['Fajitas', 'Guacamole', 'Salsa'])
+                                }])
+        self.assertListEqual(names(dump), ['Fajitas'])
+
+        # Lists are compared as they are, matching no column
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name: ['Fajitas']
+                                }])
+        self.assertListEqual(dump, [])
+
+    def test_iterate(self):
+        with self.driver.session(readonly=True):
+            records = list(
+                self.driver.iterate(Recipe, order=(Recipe.fields.id, )))
+
+        self.assertListEqual(records, self.driver.read(Recipe))
+
+    def test_iterate_collation(self):
+        # Locale collations ignore punctuation and case, unlike Python
+        self.driver.setup()
+        try:
+            self.driver.cursor.execute('ALTER TABLE recipes ALTER COLUMN id '
+                                       'TYPE TEXT COLLATE "unicode"')
+        except psycopg2.Error as err:
+            self.driver.connexion.rollback()
+            self.skipTest("No locale collation: %s" % err)
+        finally:
+            self.driver.close()
+
+        ids = ['B', '_b', 'a', 'a-c', 'ab']
+        self.driver.write_many(Recipe, [
+            Recipe(id=recipe_id, name=recipe_id).params for recipe_id in ids
+        ])
+        ids = sorted(ids + [self.fajitas.id])
+
+        with self.driver.session(readonly=True):
+            records = self.driver.iterate(Recipe,
+                                          columns=(Recipe.fields.id, ),
+                                          order=(Recipe.fields.id, ))
+            self.assertListEqual([r[Recipe.fields.id] for r in records], ids)
+
+        page = self.driver.read(Recipe,
+                                columns=(Recipe.fields.id, ),
+                                order=(Recipe.fields.id, ),
+                                after=['_b'])
+        self.assertListEqual([r[Recipe.fields.id] for r in page],
+                             ids[ids.index('_b') + 1:])
+
+    def test_write_many(self):
+        recipes = [Recipe(name='Recipe %d' % index) for index in range(10)]
+        self.driver.write_many(Recipe, [recipe.params for recipe in recipes])
+
+        self.assertEqual(len(self.driver.read(Recipe)), 11)
+
+    def test_write(self):
+        self.driver.write(Recipe, {Recipe.fields.author: 'me'},
+                          filters=[{
+                              Recipe.fields.id: self.fajitas.id
+                          }])
+
+        dump = self.driver.read(Recipe, columns=[Recipe.fields.author])
+        self.assertListEqual(dump, [{Recipe.fields.author: 'me'}])
+
+    def test_trace(self):
+        with self.driver.trace() as trace:
+            self.driver.read(Recipe)
+            self.driver.write_many(Recipe, [Recipe(name='Salsa').params])
+
+        self.assertEqual(trace.queries, 2)
+        self.assertListEqual([rows for _, rows, _ in trace.statements],
+                             [1, 1])
+
+    def test_transitive_closure(self):
+        df = Dependency.fields
+        for required_by, requisite in [('a', 'b'), ('b', 'c'), ('c', 'a'),
+                                       ('d', 'a')]:
+            self.driver.write(
+                Dependency, {
+                    df.required_by: required_by,
+                    df.requisite: requisite,
+                    df.quantity: '',
+                    df.optional: False,
+                })
+
+        nodes = self.driver.transitive_closure(Dependency, df.required_by,
+                                               df.requisite, 'a')
+        self.assertSetEqual(nodes, {'a', 'b', 'c'})
+
+        nodes = self.driver.transitive_closure(Dependency, df.requisite,
+                                               df.required_by, ['b', 'e'])
+        self.assertSetEqual(nodes, {'a', 'b', 'c', 'd', 'e'})
+
+    def test_aggregate(self):
+        rf = Recipe.fields
+        df = Dependency.fields
+        relations = {
+            'dependencies': ((Dependency, Recipe, df.requisite, rf.id),
+                             df.required_by, (rf.name, df.optional)),
+            'required_by': (Dependency, df.requisite, (df.required_by, )),
+        }
+        guacamole = Recipe(name='Guacamole')
+        self.driver.write(Recipe, guacamole.params)
+        self.driver.write(
+            Dependency, {
+                df.required_by: self.fajitas.id,
+                df.requisite: guacamole.id,
+                df.quantity: '',
+                df.optional: False,
+            })
+
+        record, related = self.driver.aggregate(Recipe, rf.id,
+                                                self.fajitas.id, relations)
+        self.assertEqual(record, self.fajitas.params)
+        self.assertListEqual(related['dependencies'], [{
+            rf.name: 'Guacamole',
+            df.optional: False
+        }])
+        self.assertListEqual(related['required_by'], [])
+
+        self.assertIsNone(
+            self.driver.aggregate(Recipe, rf.id, 'missing', relations))
+
+    def test_aggregate_many(self):
+        rf = Recipe.fields
+        df = Dependency.fields
+        relations = {
+            'required_by': (Dependency, df.requisite, (df.required_by, )),
+        }
+        guacamole = Recipe(name='Guacamole')
+        self.driver.write(Recipe, guacamole.params)
+        self.driver.write(
+            Dependency, {
+                df.required_by: self.fajitas.id,
+                df.requisite: guacamole.id,
+                df.quantity: '',
+                df.optional: False,
+            })
+
+        aggregates = self.driver.aggregate_many(
+            Recipe, rf.id, [self.fajitas.id, guacamole.id], relations)
+
+        self.assertEqual(aggregates[self.fajitas.id],
+                         (self.fajitas.params, {
+                             'required_by': []
+                         }))
+        self.assertEqual(aggregates[guacamole.id],
+                         (guacamole.params, {
+                             'required_by': [{
+                                 df.required_by: self.fajitas.id
+                             }]
+                         }))
+        self.assertDictEqual(
+            self.driver.aggregate_many(Recipe, rf.id, [], relations), {})
+
+    def test_session_rollback(self):
+        with self.assertRaises(KeyError):
+            with self.driver.session():
+                self.driver.erase(Recipe,
+                                  filters=[{
+                                      Recipe.fields.id: self.fajitas.id
+                                  }])
+                self.assertEqual(len(self.driver.read(Recipe)), 0)
+                raise KeyError()
+
+        self.assertEqual(len(self.driver.read(Recipe)), 1)
+
+
+class TestDriverPgsqlPool(TestDriverPgsql):
+    options = 'pool=1&pool_min=1&pool_max=2'
+
+    def test_connexion_reused(self):
+        self.driver.setup()
+        connexion = self.driver.connexion
+        self.driver.close()
+
+        self.driver.setup()
+        self.assertIs(self.driver.connexion, connexion)
+        self.driver.close()
+
+    def test_connexion_broken(self):
+        self.driver.setup()
+        connexion = self.driver.connexion
+        self.driver.close()
+        connexion.close()
+
+        self.assertEqual(len(self.driver.read(Recipe)), 1)
+        self.driver.setup()
+        self.assertIsNot(self.driver.connexion, connexion)
+        self.driver.close()
+
+    def test_connexion_recycled(self):
+        self.driver.options['pool_recycle'] = 1
+        self.driver.setup()
+        connexion = self.driver.connexion
+        self.driver.close()
+
+        self.driver.birth[connexion] -= 2
+        self.driver.setup()
+        self.assertIsNot(self.driver.connexion, connexion)
+        self.driver.close()
+
+    def test_connexion_exhausted(self):
+        # Threads wait for the connections in use instead of failing
+        self.driver.setup()
+        busy = self.driver.checkout()
+
+        done = threading.Event()
+
+        def _read():
+            self.driver.read(Recipe)
+            done.set()
+
+        reader = threading.Thread(target=_read)
+        reader.start()
+        self.assertFalse(done.wait(0.2))
+
+        self.driver.release(busy)
+        reader.join()
+        self.assertTrue(done.is_set())
+
+        self.driver.close()
+
+    def test_connexion_stale(self):
+        # Connections cut by the server look open until they are used
+        stale, other = self.driver.checkout(), self.driver.checkout()
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)',
+                           (stale.get_backend_pid(), ))
+        other.commit()
+
+        # Only the stale connection is kept idle, the pool holding one
+        self.driver.release(stale)
+        self.driver.release(other)
+
+        with self.assertRaises(psycopg2.Error):
+            with self.driver.session(readonly=True):
+                pass
+
+        self.assertEqual(self.driver.stats()['pool_used'], 0)
+        with self.driver.session(readonly=True):
+            self.assertEqual(len(self.driver.read(Recipe)), 1)
+
+    def test_connexion_timeout(self):
+        self.driver.options['pool_timeout'] = 0.1
+        busy = [self.driver.checkout() for _ in range(2)]
+
+        with self.assertRaises(DatabaseBusy):
+            self.driver.read(Recipe)
+
+        for connexion in busy:
+            self.driver.release(connexion)
+        self.assertEqual(len(self.driver.read(Recipe)), 1)
+
@@ -0,0 +1,523 @@
+import sqlite3
+import threading
+from pathlib import Path
+from unittest.mock import patch
+from knife.cache import CachedDriver
+from knife.models import Recipe, Dependency, Generation
+from knife.drivers import BATCH_SIZE, OneOf, parse_options
+from knife.operations import bump_generation, current_generation
+from knife.drivers.sqlite import (
+    SqliteDriver,
+    index_definitions,
+    model_definition,
+    search_definitions,
+)
+from test import TestCase
+from tempfile import NamedTemporaryFile
+
+
+class TestDriverSqlite(TestCase):
+    location = None
+
+    def setUp(self):
+        with NamedTemporaryFile(delete=False, suffix='.sqlite') as temp:
+            self.datafile = temp
+
+        self.driver = SqliteDriver(self.datafile.name +
+                                   (self.location or ''))
+        self.driver.setup()
+        for model in [Recipe, Dependency]:
+            self.driver.connexion.execute(model_definition(model))
+        self.driver.close()
+
+        self.fajitas = Recipe(name='Fajitas')
+        self.guacamole = Recipe(name='Guacamole')
+        self.driver.write(Recipe, self.fajitas.params)
+        self.driver.write(Recipe, self.guacamole.params)
+        self.driver.write(
+            Dependency, {
+                Dependency.fields.required_by: self.fajitas.id,
+                Dependency.fields.requisite: self.guacamole.id,
+                Dependency.fields.quantity: '',
+                Dependency.fields.optional: False,
+            })
+
+    def tearDown(self):
+        if self.driver.connexion:
+            self.driver.connexion.close()
+        Path(self.datafile.name).unlink()
+
+    def test_read(self):
+        dump = self.driver.read(Recipe)
+        self.assertEqual(len(dump), 2)
+        self.assertSetEqual(set(dump[0].keys()), set(Recipe.fields.fields))
+
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name: 'Fajitas'
+                                }],
+                                columns=[Recipe.fields.id])
+        self.assertListEqual(dump, [{Recipe.fields.id: self.fajitas.id}])
+
+    def test_read_in(self):
+        names = lambda records: sorted(r[Recipe.fields.name] for r in records)
+
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name:
+                                    OneOf(['Fajitas', 'Guacamole', 'Salsa'])
+                                }])
+        self.assertListEqual(names(dump), ['Fajitas', 'Guacamole'])
+
+        # Lists are compared as they are, matching no column
+        dump = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name: ['Fajitas']
+                                }])
+        self.assertListEqual(dump, [])
+
+    def test_read_page(self):
+        order = (Recipe.fields.simple_name, Recipe.fields.id)
+        names = lambda records: [r[Recipe.fields.name] for r in records]
+
+        page = self.driver.read(Recipe,
+                                columns=[Recipe.fields.name],
+                                order=order,
+                                limit=1)
+        self.assertListEqual(names(page), ['Fajitas'])
+
+        page = self.driver.read(Recipe,
+                                columns=[Recipe.fields.name],
+                                order=order,
+                                offset=1)
+        self.assertListEqual(names(page), ['Guacamole'])
+
+        page = self.driver.read(Recipe,
+                                filters=[{
+                                    Recipe.fields.name: 'a'
+                                }],
+                                columns=[Recipe.fields.name],
+                                exact=False,
+                                order=order,
+                                after=('fajitas', self.fajitas.id))
+        self.assertListEqual(names(page), ['Guacamole'])
+
+    def test_trace(self):
+        with self.driver.trace('test') as trace:
+            self.driver.read(Recipe)
+            self.driver.write(Recipe, {Recipe.fields.author: 'me'},
+                              filters=[{
+                                  Recipe.fields.id: self.fajitas.id
+                              }])
+            list(self.driver.iterate(Recipe))
+
+        self.assertEqual(trace.queries, 3)
+        self.assertListEqual([rows for _, rows, _ in trace.statements],
+                             [2, 1, 2])
+        self.assertTrue(trace.statements[1][0].startswith('UPDATE recipes'))
+        self.assertIsNone(self.driver.local.trace)
+
+        self.driver.slow_query = 0
+        with self.assertLogs('knife.drivers', 'WARNING') as logs:
+            with self.driver.trace('GET /recipes'):
+                self.driver.read(Recipe)
+
+        self.assertIn('GET /recipes', logs.output[0])
+        self.assertIn('SELECT * FROM recipes', logs.output[0])
+
+    def test_iterate(self):
+        order = (Recipe.fields.simple_name, )
+        records = self.driver.iterate(Recipe, order=order)
+
+        self.assertListEqual(list(records), self.driver.read(Recipe,
+                                                             order=order))
+
+        with self.driver.session(readonly=True):
+            recipes = self.driver.iterate(Recipe,
+                                          columns=[Recipe.fields.id],
+                                          order=order)
+            dependencies = self.driver.iterate(
+                (Dependency, Recipe, Dependency.fields.requisite,
+                 Recipe.fields.id),
+                columns=[Recipe.fields.name])
+
+            self.assertDictEqual(next(recipes),
+                                 {Recipe.fields.id: self.fajitas.id})
+            self.assertDictEqual(next(dependencies),
+                                 {Recipe.fields.name: 'Guacamole'})
+            self.assertDictEqual(next(recipes),
+                                 {Recipe.fields.id: self.guacamole.id})
+
+            recipes.close()
+            dependencies.close()
+
+    def test_write_many(self):
+        recipes = [Recipe(name='Recipe %d' % index) for index in range(10)]
+        self.driver.write_many(Recipe, [recipe.params for recipe in recipes])
+
+        self.assertEqual(len(self.driver.read(Recipe)), 12)
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.driver.session():
+                self.driver.write_many(Recipe, [Recipe(name='Last').params] +
+                                       [recipes[0].params])
+
+        self.assertEqual(len(self.driver.read(Recipe)), 12)
+
+    def test_read_join(self):
+        dump = self.driver.read(
+            (Dependency, Recipe, Dependency.fields.requisite,
+             Recipe.fields.id),
+            filters=[{
+                Dependency.fields.required_by: self.fajitas.id
+            }],
+            columns=[Recipe.fields.name])
+        self.assertListEqual(dump, [{Recipe.fields.name: 'Guacamole'}])
+
+    def test_erase(self):
+        self.driver.erase(Recipe,
+                          filters=[{
+                              Recipe.fields.id: self.guacamole.id
+                          }])
+        self.assertEqual(len(self.driver.read(Recipe)), 1)
+
+    def test_aggregate(self):
+        rf = Recipe.fields
+        df = Dependency.fields
+        relations = {
+            'dependencies': ((Dependency, Recipe, df.requisite, rf.id),
+                             df.required_by, (rf.name, df.optional)),
+            'required_by': (Dependency, df.requisite, (df.required_by, )),
+        }
+
+        record, related = self.driver.aggregate(Recipe, rf.id,
+                                                self.fajitas.id, relations)
+        self.assertEqual(record, self.fajitas.params)
+        self.assertListEqual(related['dependencies'], [{
+            rf.name: 'Guacamole',
+            df.optional: False
+        }])
+        self.assertListEqual(related['required_by'], [])
+
+        self.assertIsNone(
+            self.driver.aggregate(Recipe, rf.id, 'missing', relations))
+
+    def test_aggregate_many(self):
+        rf = Recipe.fields
+        df = Dependency.fields
+        relations = {
+            'dependencies': ((Dependency, Recipe, df.requisite, rf.id),
+                             df.required_by, (rf.name, )),
+            'required_by': (Dependency, df.requisite, (df.required_by, )),
+        }
+
+        aggregates = self.driver.aggregate_many(
+            Recipe, rf.id, [self.fajitas.id, self.guacamole.id, 'missing'],
+            relations)
+
+        self.assertSetEqual(set(aggregates),
+                            {self.fajitas.id, self.guacamole.id})
+        self.assertEqual(aggregates[self.fajitas.id],
+                         (self.fajitas.params, {
+                             'dependencies': [{
+                                 rf.name: 'Guacamole'
+                             }],
+                             'required_by': [],
+                         }))
+        self.assertEqual(aggregates[self.guacamole.id],
+                         (self.guacamole.params, {
+                             'dependencies': [],
+                             'required_by': [{
+                                 df.required_by: self.fajitas.id
+                             }],
+                         }))
+
+        self.assertDictEqual(
+            self.driver.aggregate_many(Recipe, rf.id, [], relations), {})
+
+    def test_index_definitions(self):
+        self.assertListEqual(index_definitions(Dependency), [
+            'CREATE INDEX IF NOT EXISTS dependencies_requisite_index '
+            'ON dependencies ("requisite")'
+        ])
+
+        self.driver.setup()
+        for statement in index_definitions(Recipe):
+            self.driver.cursor.execute(statement)
+        self.driver.close()
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.driver.write(Recipe, Recipe(name='Fajitas').params)
+
+    def test_search(self):
+        self.driver.setup()
+        for statement in index_definitions(Recipe):
+            self.driver.cursor.execute(statement)
+        self.driver.close()
+
+        driver = SqliteDriver(self.datafile.name + '?search=1')
+        rf = Recipe.fields
+
+        def _lookup(pattern):
+            return driver.read(Recipe,
+                               filters=[{
+                                   rf.simple_name: pattern
+                               }],
+                               columns=[rf.name],
+                               exact=False)
+
+        self.assertListEqual(_lookup('uacam'), [{rf.name: 'Guacamole'}])
+
+        driver.write(Recipe, {
+            rf.name: 'Salsa',
+            rf.simple_name: 'salsa'
+        },
+                     filters=[{
+                         rf.id: self.guacamole.id
+                     }])
+        self.assertListEqual(_lookup('uacam'), [])
+        self.assertListEqual(_lookup('als'), [{rf.name: 'Salsa'}])
+
+        driver.erase(Recipe, filters=[{rf.id: self.guacamole.id}])
+        self.assertListEqual(_lookup('als'), [])
+
+    def test_search_fallback(self):
+        driver = SqliteDriver(self.datafile.name + '?search=1')
+        driver.migrate([Recipe])
+
+        def _lookup(pattern):
+            with driver.trace() as trace:
+                records = driver.read(Recipe,
+                                      filters=[{
+                                          Recipe.fields.simple_name: pattern
+                                      }],
+                                      columns=[Recipe.fields.name],
+                                      exact=False)
+            return records, 'rowid IN' in trace.statements[-1][0]
+
+        self.assertTupleEqual(_lookup('uacam'),
+                              ([{Recipe.fields.name: 'Guacamole'}], True))
+
+        # Too short for trigrams
+        self.assertTupleEqual(_lookup('ua'),
+                              ([{Recipe.fields.name: 'Guacamole'}], False))
+        self.assertTupleEqual(_lookup('a_i'),
+                              ([{Recipe.fields.name: 'Fajitas'}], False))
+
+        # Matching too many records
+        with patch('knife.drivers.sqlite.SEARCH_LIMIT', 1):
+            self.assertTupleEqual(_lookup('ole'),
+                                  ([{Recipe.fields.name: 'Guacamole'}],
+                                   False))
+
+    def test_search_vacuum(self):
+        driver = SqliteDriver(self.datafile.name + '?search=1')
+        driver.migrate([Recipe])
+        driver.erase(Recipe, filters=[{Recipe.fields.id: self.fajitas.id}])
+
+        # VACUUM renumbers the rowids, which migrate indexes again
+        connexion = sqlite3.connect(self.datafile.name)
+        connexion.execute('VACUUM')
+        connexion.close()
+        driver.migrate([Recipe])
+
+        self.assertListEqual(
+            driver.read(Recipe,
+                        filters=[{
+                            Recipe.fields.simple_name: 'uacam'
+                        }],
+                        columns=[Recipe.fields.name],
+                        exact=False), [{
+                            Recipe.fields.name: 'Guacamole'
+                        }])
+
+    def test_search_migrate(self):
+        driver = SqliteDriver(self.datafile.name + '?search=1')
+        driver.migrate([Recipe])
+
+        # Up to date full-text tables are not rebuilt
+        with driver.session():
+            changes = driver.connexion.total_changes
+            for statement in search_definitions(Recipe):
+                driver.cursor.execute(statement)
+            self.assertEqual(driver.connexion.total_changes, changes)
+
+    def test_connexion_closed(self):
+        self.driver.read(Recipe)
+        self.assertIsNone(self.driver.connexion)
+
+    def test_generation(self):
+        # Databases created before the generations were stored lack the table
+        self.driver.migrate([Recipe, Generation])
+        self.assertIsNone(current_generation(self.driver))
+
+        generations = set()
+        for _ in range(3):
+            bump_generation(self.driver)
+            generations.add(current_generation(self.driver))
+
+        self.assertEqual(len(generations), 3)
+        self.assertLessEqual(len(self.driver.read(Generation)), 3)
+
+    def test_cache_workers(self):
+        self.driver.setup()
+        self.driver.connexion.execute(model_definition(Generation))
+        self.driver.close()
+
+        workers = [
+            CachedDriver(SqliteDriver(self.datafile.name)) for _ in range(2)
+        ]
+        filters = [{Recipe.fields.id: self.fajitas.id}]
+        for worker in workers:
+            worker.read(Recipe, filters=filters)
+
+        workers[0].write(Recipe, {Recipe.fields.author: 'me'},
+                         filters=filters)
+
+        for worker in workers:
+            self.assertEqual(
+                worker.read(Recipe, filters=filters)[0][Recipe.fields.author],
+                'me')
+            self.assertEqual(worker.hits, 0)
+
+        self.assertEqual(workers[1].read(Recipe, filters=filters),
+                         workers[0].read(Recipe, filters=filters))
+        self.assertEqual(workers[1].hits, 1)
+
+    def test_transitive_closure(self):
+        df = Dependency.fields
+        nodes = self.driver.transitive_closure(Dependency, df.required_by,
+                                               df.requisite, self.fajitas.id)
+        self.assertSetEqual(nodes, {self.fajitas.id, self.guacamole.id})
+
+        nodes = self.driver.transitive_closure(Dependency, df.requisite,
+                                               df.required_by,
+                                               self.guacamole.id)
+        self.assertSetEqual(nodes, {self.fajitas.id, self.guacamole.id})
+
+    def test_transitive_closure_many(self):
+        df = Dependency.fields
+        nodes = self.driver.transitive_closure(
+            Dependency, df.requisite, df.required_by,
+            [self.guacamole.id, 'missing'])
+        self.assertSetEqual(nodes,
+                            {self.fajitas.id, self.guacamole.id, 'missing'})
+
+        self.assertSetEqual(
+            self.driver.transitive_closure(Dependency, df.requisite,
+                                           df.required_by, []), set())
+
+    def test_transitive_closure_large(self):
+        df = Dependency.fields
+        starts = ["missing_%d" % index for index in range(2 * BATCH_SIZE)]
+
+        with self.driver.trace() as trace:
+            nodes = self.driver.transitive_closure(
+                Dependency, df.requisite, df.required_by,
+                starts + [self.guacamole.id, self.fajitas.id])
+
+        self.assertSetEqual(nodes,
+                            {self.fajitas.id, self.guacamole.id, *starts})
+        self.assertEqual(trace.queries, 1)
+
+    def test_transitive_closure_cycle(self):
+        df = Dependency.fields
+        self.driver.write(
+            Dependency, {
+                df.required_by: self.guacamole.id,
+                df.requisite: self.fajitas.id,
+                df.quantity: '',
+                df.optional: False,
+            })
+
+        nodes = self.driver.transitive_closure(Dependency, df.required_by,
+                                               df.requisite, self.fajitas.id)
+        self.assertSetEqual(nodes, {self.fajitas.id, self.guacamole.id})
+
+    def test_session(self):
+        with self.driver.session():
+            connexion = self.driver.connexion
+            self.driver.erase(Recipe,
+                              filters=[{
+                                  Recipe.fields.id: self.guacamole.id
+                              }])
+            self.assertEqual(len(self.driver.read(Recipe)), 1)
+            self.assertIs(self.driver.connexion, connexion)
+
+        self.assertEqual(len(self.driver.read(Recipe)), 1)
+
+    def test_session_rollback(self):
+        with self.assertRaises(KeyError):
+            with self.driver.session():
+                self.driver.erase(Recipe,
+                                  filters=[{
+                                      Recipe.fields.id: self.guacamole.id
+                                  }])
+                raise KeyError()
+
+        self.assertEqual(len(self.driver.read(Recipe)), 2)
+
+    def test_session_nested(self):
+        with self.driver.session():
+            with self.driver.session(readonly=True):
+                self.driver.erase(Recipe,
+                                  filters=[{
+                                      Recipe.fields.id: self.guacamole.id
+                                  }])
+            self.assertTrue(self.driver.in_session)
+
+        self.assertFalse(self.driver.in_session)
+        self.assertEqual(len(self.driver.read(Recipe)), 1)
+
+
+class TestDriverSqlitePool(TestDriverSqlite):
+    location = '?pool=1'
+
+    def test_connexion_closed(self):
+        pass
+
+    def test_connexion_reused(self):
+        self.driver.read(Recipe)
+        connexion = self.driver.connexion
+        self.assertIsNotNone(connexion)
+
+        self.driver.read(Recipe)
+        self.assertIs(self.driver.connexion, connexion)
+
+    def test_connexion_per_thread(self):
+        self.driver.read(Recipe)
+        connexions = []
+
+        def _read():
+            self.driver.read(Recipe)
+            connexions.append(self.driver.connexion)
+            self.driver.connexion.close()
+
+        thread = threading.Thread(target=_read)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(len(connexions), 1)
+        self.assertIsNot(connexions[0], self.driver.connexion)
+
+
+class TestParseOptions(TestCase):
+
+    def test_parse_options(self):
+        location, options = parse_options('/tmp/knife.sqlite?pool=1',
+                                          {'pool': False})
+        self.assertEqual(location, '/tmp/knife.sqlite')
+        self.assertDictEqual(options, {'pool': True})
+
+    def test_parse_options_foreign_parameters(self):
+        location, options = parse_options(
+            'postgresql://knife@localhost/knife?sslmode=disable&size=4',
+            {'size': 1})
+        self.assertEqual(location,
+                         'postgresql://knife@localhost/knife?sslmode=disable')
+        self.assertDictEqual(options, {'size': 4})
+
+    def test_parse_options_defaults(self):
+        location, options = parse_options('/tmp/knife.json', {'pool': False})
+        self.assertEqual(location, '/tmp/knife.json')
+        self.assertDictEqual(options, {'pool': False})
@@ -0,0 +1,131 @@
+import os
+import json
+from pathlib import Path
+from knife.drivers import Trace
+from knife.metrics import Metrics
+from test import TestCase
+from tempfile import TemporaryDirectory
+
+
+def traced(queries):
+    trace = Trace()
+    trace.statements = [('SELECT 1', 1, 0.001)] * queries
+    return trace
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_exposition(self):
+        self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(3))
+        self.metrics.observe('recipe_get', 'GET', 404, 0.2, traced(1))
+        self.metrics.error('recipe_get', KeyError('id'), 404)
+
+        lines = self.metrics.exposition().splitlines()
+
+        self.assertIn('# TYPE knife_requests_total counter', lines)
+        self.assertIn(
+            'knife_requests_total{endpoint="recipe_get",method="GET",'
+            'status="200"} 1', lines)
+        self.assertIn(
+            'knife_request_duration_seconds_bucket{endpoint="recipe_get",'
+            'le="0.01"} 0', lines)
+        self.assertIn(
+            'knife_request_duration_seconds_bucket{endpoint="recipe_get",'
+            'le="0.025"} 1', lines)
+        self.assertIn(
+            'knife_request_duration_seconds_bucket{endpoint="recipe_get",'
+            'le="+Inf"} 2', lines)
+        self.assertIn(
+            'knife_request_duration_seconds_count{endpoint="recipe_get"} 2',
+            lines)
+        self.assertIn('knife_queries_total{endpoint="recipe_get"} 4', lines)
+        self.assertIn(
+            'knife_errors_total{endpoint="recipe_get",error="KeyError",'
+            'status="404"} 1', lines)
+
+    def test_gauges(self):
+        self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(1),
+                             {'cache_hits': 4})
+        self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(1),
+                             {'cache_hits': 5})
+
+        lines = self.metrics.exposition().splitlines()
+
+        self.assertIn('# TYPE knife_cache_hits gauge', lines)
+        self.assertIn('knife_cache_hits 5', lines)
+
+    def test_workers(self):
+        with TemporaryDirectory() as directory:
+            self.metrics.directory = directory
+            self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(1),
+                                 {'pool_used': 1})
+
+            # Metrics left by a worker that exited
+            dump = {
+                'counters': [[
+                    'knife_queries_total', [['endpoint', 'recipe_get']], 2
+                ]],
+                'gauges': [['knife_pool_used', [], 3]],
+            }
+            name = '%d-99999999-exited.json' % os.getppid()
+            Path(directory, name).write_text(json.dumps(dump))
+
+            lines = self.metrics.exposition().splitlines()
+
+            self.assertTrue(Path(self.metrics.path).exists())
+
+        self.assertIn('knife_queries_total{endpoint="recipe_get"} 3', lines)
+        self.assertIn('knife_pool_used 1', lines)
+
+    def test_reused_pid(self):
+        with TemporaryDirectory() as directory:
+            # Metrics of a worker that exited, whose pid is now this one's
+            dump = {
+                'counters': [[
+                    'knife_queries_total', [['endpoint', 'recipe_get']], 2
+                ]],
+                'gauges': [['knife_pool_used', [], 3]],
+            }
+            path = Path(directory,
+                        '%d-%d-exited.json' % (os.getppid(), os.getpid()))
+            path.write_text(json.dumps(dump))
+            os.utime(path, (0, 0))
+
+            self.metrics.directory = directory
+            self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(1),
+                                 {'pool_used': 1})
+
+            lines = self.metrics.exposition().splitlines()
+
+        self.assertIn('knife_queries_total{endpoint="recipe_get"} 3', lines)
+        self.assertIn('knife_pool_used 1', lines)
+
+    def test_previous_runs(self):
+        with TemporaryDirectory() as directory:
+            # Files of an earlier run of the server, and of an older version
+            previous = [
+                Path(directory, '%d-99999999-run.json' % (os.getppid() + 1)),
+                Path(directory, '99999999.json'),
+            ]
+            for path in previous:
+                path.write_text('{"counters": [], "gauges": []}')
+
+            self.metrics.directory = directory
+            self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(1))
+            self.metrics.flush()
+
+            self.assertListEqual(list(Path(directory).iterdir()),
+                                 [Path(self.metrics.path)])
+
+    def test_threads(self):
+        self.assertListEqual(self.metrics.threads(), [])
+
+        with TemporaryDirectory() as directory:
+            self.metrics.directory = directory
+            self.metrics.observe('recipe_get', 'GET', 200, 0.02, traced(1))
+
+        self.assertListEqual(self.metrics.threads(),
+                             [self.metrics.flusher.ident])
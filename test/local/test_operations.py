@@ -1,7 +1,9 @@
 from pathlib import Path
-from knife.models import Recipe, Dependency
+from knife.models import Recipe, Dependency, Generation
+from knife.drivers import BATCH_SIZE
 from knife.drivers.json import JSONDriver
-from knife.operations import (dependency_nodes, dependency_list,
+from knife.operations import (bump_generation, current_generation,
+                              dependency_nodes, dependency_list, read_any,
                               requirement_list, tag_list)
 from test import TestCase
 from tempfile import NamedTemporaryFile
@@ -268,3 +270,40 @@ class TestOperations(TestCase):
 
         tags = tag_list(self.driver, self.guacamole_id)
         self.assertEqual(len(tags), 1)
+
+    def test_read_any(self):
+        ids = ["missing_%d" % index for index in range(2 * BATCH_SIZE)]
+
+        with self.driver.trace() as trace:
+            records = read_any(self.driver,
+                               Recipe,
+                               Recipe.fields.id,
+                               ids + [self.fajitas_id, self.horchata_id],
+                               columns=[Recipe.fields.name])
+
+        self.assertListEqual(
+            sorted(record[Recipe.fields.name] for record in records),
+            ['Fajitas', 'Horchata'])
+        self.assertEqual(trace.queries, 3)
+
+        self.assertListEqual(
+            read_any(self.driver, Recipe, Recipe.fields.id, []), [])
+
+    def test_generation(self):
+        # The store generation of a JSON database is the version of its file
+        first = current_generation(self.driver)
+        self.assertIsNotNone(first)
+
+        bump_generation(self.driver)
+        self.assertEqual(current_generation(self.driver), first)
+        self.assertListEqual(self.driver.read(Generation), [])
+
+        self.driver.erase(Recipe,
+                          filters=[{
+                              Recipe.fields.id: self.horchata_id
+                          }])
+        self.assertNotEqual(current_generation(self.driver), first)
+
+        self.assertIsNone(current_generation(self.driver, 'recipes'))
+        bump_generation(self.driver, 'recipes')
+        self.assertIsNotNone(current_generation(self.driver, 'recipes'))
@@ -0,0 +1,54 @@
+import threading
+from knife.drivers import AbstractDriver
+from knife.profiler import Profiler, format_stacks
+from test import TestCase
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler(interval=0.001)
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.done.set()
+
+    def test_sample(self):
+        # A thread stuck in a driver call, through a method of the package
+        driver = AbstractDriver('')
+        driver.begin = lambda readonly: self.done.wait()
+        worker = threading.Thread(target=driver.session().__enter__)
+        worker.start()
+
+        stacks = self.profiler.sample(0.05)
+        self.done.set()
+        worker.join()
+
+        self.assertTrue(stacks)
+        for stack in stacks:
+            self.assertTrue(stack.startswith('knife.'), stack)
+            self.assertNotIn('knife.profiler', stack)
+
+        # Functions are qualified by their class from python 3.11
+        self.assertTrue(
+            any(stack.startswith('knife.drivers.') and 'session' in stack
+                for stack in stacks), stacks)
+
+    def test_ignored(self):
+        driver = AbstractDriver('')
+        driver.begin = lambda readonly: self.done.wait()
+        worker = threading.Thread(target=driver.session().__enter__)
+        worker.start()
+
+        stacks = self.profiler.sample(0.05, ignored=[worker.ident])
+        self.done.set()
+        worker.join()
+
+        self.assertFalse(any('session' in stack for stack in stacks), stacks)
+
+    def test_single_profile(self):
+        with self.profiler.lock:
+            self.assertIsNone(self.profiler.sample(0.01))
+
+    def test_format(self):
+        self.assertEqual(format_stacks({'a;b': 2, 'a': 1}), "a 1\na;b 2\n")
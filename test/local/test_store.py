@@ -1,12 +1,17 @@
+import json
 from pathlib import Path
-from knife.store import Store
+from importlib import import_module
+from knife.cache import CachedDriver
+from knife.store import Store, decode_cursor, encode_cursor, paginated_ids
 from knife.exceptions import (
+    DependencyCycle,
     DependencyNotFound,
     EmptyQuery,
     IngredientAlreadyExists,
     IngredientInUse,
     IngredientNotFound,
     InvalidQuery,
+    InvalidValue,
     LabelAlreadyExists,
     #LabelInUse,
     LabelNotFound,
@@ -17,17 +22,22 @@ from knife.exceptions import (
     TagNotFound,
 )
 from knife.models import (
+    Classifications,
     Dependency,
     Ingredient,
     Label,
     Recipe,
+    RecipeClassification,
     Requirement,
     Tag,
 )
 from knife.drivers.json import JSONDriver
+from knife.indexes import CookableIndex
 from knife.operations import (
+    classify,
     dependency_nodes,
     dependency_list,
+    parse_documents,
     requirement_list,
     tag_list,
 )
@@ -36,6 +46,7 @@ from tempfile import NamedTemporaryFile
 
 
 class TestStore(TestCase):
+    location = ''
 
     def setUp(self):
         self.maxDiff = 8192
@@ -250,7 +261,7 @@ class TestStore(TestCase):
             self.datafile = temp
             self.datafile.write(json)
 
-        self.driver = JSONDriver(self.datafile.name)
+        self.driver = JSONDriver(self.datafile.name + self.location)
         self.store = Store(self.driver)
 
     def tearDown(self):
@@ -355,6 +366,471 @@ class TestStore(TestCase):
             "name": "Horchata",
         }])
 
+    def test_recipe_lookup_page(self):
+        lookup = self.store._recipe_lookup({}, {})
+
+        pages = [self.store._recipe_lookup(dict(limit='2'), {})]
+        while pages[-1].cursor:
+            pages.append(
+                self.store._recipe_lookup(
+                    dict(limit='2', cursor=pages[-1].cursor), {}))
+
+        self.assertListEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertListEqual([r['name'] for page in pages for r in page], [
+            'Chipotle Chicken', 'Fajitas', 'Guacamole', 'Horchata',
+            'Pico de Gallo'
+        ])
+        self.assertCountEqual([r for page in pages for r in page], lookup)
+
+        page = self.store._recipe_lookup(dict(limit='1', offset='3'), {})
+        self.assertListEqual(page, [{
+            "id": self.horchata_id,
+            "name": "Horchata",
+        }])
+
+        page = self.store._recipe_lookup(
+            dict(name='o', limit='2', cursor=pages[0].cursor), {})
+        self.assertListEqual([r['name'] for r in page],
+                             ['Guacamole', 'Horchata'])
+
+        with self.assertRaises(InvalidValue):
+            self.store._recipe_lookup(dict(limit='-1'), {})
+
+        with self.assertRaises(InvalidValue) as context:
+            self.store._recipe_lookup(dict(limit='two'), {})
+        self.assertIn('two', str(context.exception))
+
+        with self.assertRaises(InvalidValue):
+            self.store._recipe_lookup(dict(cursor='junk'), {})
+
+        for values in [[1, 'id'], ['name', None], [['name'], 'id']]:
+            with self.assertRaises(InvalidValue):
+                self.store._recipe_lookup(
+                    dict(limit='2', cursor=encode_cursor(values)), {})
+
+    def test_export(self):
+        response = self.store._export({}, {})
+        documents = [
+            json.loads(line)
+            for line in response.get_data(as_text=True).splitlines()
+        ]
+
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertListEqual([document['id'] for document in documents],
+                             sorted(recipe['id'] for recipe in
+                                    self.store._recipe_lookup({}, {})))
+
+        for document in documents:
+            details = self.store._recipe_get(document['id'])
+            details.pop('classifications')
+            self.assertDictEqual(document, details)
+
+        with self.assertRaises(InvalidValue):
+            self.store._export(dict(format='csv'), {})
+
+    def test_import(self):
+        documents = [{
+            'name': 'Quesadillas',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Onion'
+                },
+                'quantity': '1',
+            }, {
+                'ingredient': {
+                    'name': 'Cheese',
+                    'dairy': True,
+                },
+                'quantity': '200g',
+                'optional': True,
+            }],
+            'dependencies': [{
+                'recipe': {
+                    'id': self.pico_de_gallo_id
+                },
+                'quantity': '1 cup',
+            }, {
+                'recipe': {
+                    'name': 'Tortillas'
+                },
+            }],
+            'tags': [{
+                'name': 'mexican'
+            }, {
+                'name': 'cheesy'
+            }],
+        }, {
+            'name': 'Tortillas',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Flour',
+                    'gluten': True,
+                },
+                'quantity': '500g',
+            }],
+        }, {
+            'name': 'Horchata',
+        }]
+
+        report = self.store._import_documents({}, documents)
+
+        self.assertEqual(report['recipes'], 2)
+        self.assertEqual(report['ingredients'], 2)
+        self.assertEqual(report['labels'], 1)
+        self.assertEqual(report['requirements'], 3)
+        self.assertEqual(report['dependencies'], 2)
+        self.assertEqual(report['tags'], 2)
+        self.assertEqual(report['skipped'], 1)
+
+        recipe_id = self.store._recipe_lookup(dict(name='quesa'), {})[0]['id']
+        details = self.store._recipe_get(recipe_id)
+
+        self.assertCountEqual(
+            [(r['ingredient']['name'], r['quantity'], r['optional'])
+             for r in details['requirements']],
+            [('Onion', '1', False), ('Cheese', '200g', True)])
+        self.assertCountEqual(
+            [(d['recipe']['name'], d['quantity'])
+             for d in details['dependencies']],
+            [('Pico de Gallo', '1 cup'), ('Tortillas', '')])
+        self.assertCountEqual([t['name'] for t in details['tags']],
+                              ['mexican', 'cheesy'])
+        self.assertEqual(details['classifications'],
+                         classify(self.driver, recipe_id))
+        self.assertEqual(details['classifications'],
+                         Classifications(dairy=True, gluten=True))
+
+    def test_import_invalid(self):
+        recipes = self.store._recipe_lookup({}, {})
+
+        with self.assertRaises(DependencyCycle):
+            self.store._import_documents({}, [{
+                'name': 'Nachos',
+                'dependencies': [{
+                    'recipe': {
+                        'name': 'Salsa'
+                    }
+                }],
+            }, {
+                'name': 'Salsa',
+                'dependencies': [{
+                    'recipe': {
+                        'name': 'Nachos'
+                    }
+                }],
+            }])
+
+        self.assertCountEqual(self.store._recipe_lookup({}, {}), recipes)
+
+    def test_import_invalid_name(self):
+        report = self.store._import_documents({}, [{
+            'name': 'Nachos'
+        }, {}, ['Tacos'], {
+            'name': ''
+        }])
+
+        self.assertEqual(report['recipes'], 1)
+        self.assertEqual(report['skipped'], 3)
+        self.assertListEqual(report['invalid'], [
+            {
+                'document': 1,
+                'field': 'name',
+                'value': None
+            },
+            {
+                'document': 2,
+                'field': 'name',
+                'value': ['Tacos']
+            },
+            {
+                'document': 3,
+                'field': 'name',
+                'value': ''
+            },
+        ])
+        self.assertEqual(len(self.store._recipe_lookup(dict(name='Nachos'),
+                                                       {})), 1)
+
+    def test_import_invalid_requirements(self):
+        report = self.store._import_documents({}, [{
+            'name': 'Nachos',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Cheese'
+                },
+            }],
+        }, {
+            'name': 'Tacos',
+            'requirements': [{
+                'ingredient': {
+                    'name': ''
+                },
+                'quantity': '1',
+            }],
+        }, {
+            'name': 'Burritos',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Beans'
+                },
+                'quantity': '1 can',
+            }],
+        }])
+
+        self.assertEqual(report['recipes'], 1)
+        self.assertEqual(report['ingredients'], 1)
+        self.assertListEqual(report['invalid'], [
+            {
+                'document': 0,
+                'field': 'quantity',
+                'value': None
+            },
+            {
+                'document': 1,
+                'field': 'name',
+                'value': ''
+            },
+        ])
+        self.assertListEqual(
+            self.store._ingredient_lookup(dict(name='Cheese'), {}), [])
+
+    def test_import_missing_dependency(self):
+        report = self.store._import_documents({}, [{
+            'name': 'Nachos',
+            'dependencies': [{
+                'recipe': {
+                    'name': 'Salsa'
+                }
+            }],
+        }, {
+            'name': 'Tacos',
+        }])
+
+        self.assertEqual(report['recipes'], 1)
+        self.assertListEqual(report['invalid'], [{
+            'document': 0,
+            'field': 'recipe',
+            'value': 'Salsa'
+        }])
+        self.assertListEqual(
+            self.store._recipe_lookup(dict(name='Nachos'), {}), [])
+
+    def test_import_skipped_dependency(self):
+        report = self.store._import_documents({}, [{
+            'name': 'Nachos',
+            'dependencies': [{
+                'recipe': {
+                    'name': 'Salsa'
+                }
+            }],
+        }, {
+            'name': 'Salsa',
+            'tags': [{
+                'name': 'very hot'
+            }],
+        }, {
+            'name': 'Tacos',
+            'dependencies': [{
+                'recipe': {
+                    'name': 'Nachos'
+                }
+            }],
+        }, {
+            'name': 'Burritos',
+            'author': 1,
+        }, {
+            'name': 'Enchiladas',
+            'dependencies': [{
+                'recipe': {
+                    'name': 'Burritos'
+                }
+            }],
+        }])
+
+        self.assertEqual(report['recipes'], 0)
+        self.assertEqual(report['labels'], 0)
+        self.assertListEqual(report['invalid'], [
+            {
+                'document': 0,
+                'field': 'recipe',
+                'value': 'Salsa'
+            },
+            {
+                'document': 1,
+                'field': 'name',
+                'value': 'very hot'
+            },
+            {
+                'document': 2,
+                'field': 'recipe',
+                'value': 'Nachos'
+            },
+            {
+                'document': 3,
+                'field': 'author',
+                'value': 1
+            },
+            {
+                'document': 4,
+                'field': 'recipe',
+                'value': 'Burritos'
+            },
+        ])
+
+    def test_import_types(self):
+        documents = [{
+            'name': 'Nachos',
+            'author': ['me'],
+        }, {
+            'name': 'Quesadillas',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Cheese',
+                    'dairy': 'yes',
+                },
+                'quantity': '200g',
+            }],
+        }, {
+            'name': 'Tacos',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Onion'
+                },
+                'quantity': 1,
+            }],
+        }, {
+            'name': 'Burritos',
+            'dependencies': [{
+                'recipe': {
+                    'name': 'Guacamole'
+                },
+                'optional': 'no',
+            }],
+        }, {
+            'name': 'Enchiladas',
+            'requirements': [{
+                'ingredient': {
+                    'name': 'Onion'
+                },
+                'quantity': '1',
+                'group': 2,
+            }],
+        }, {
+            'name': 'Salsa',
+        }]
+
+        report = self.store._import_documents({}, documents)
+
+        self.assertEqual(report['recipes'], 1)
+        self.assertEqual(report['skipped'], 5)
+        self.assertListEqual(report['invalid'], [
+            {
+                'document': 0,
+                'field': 'author',
+                'value': ['me']
+            },
+            {
+                'document': 1,
+                'field': 'dairy',
+                'value': 'yes'
+            },
+            {
+                'document': 2,
+                'field': 'quantity',
+                'value': 1
+            },
+            {
+                'document': 3,
+                'field': 'optional',
+                'value': 'no'
+            },
+            {
+                'document': 4,
+                'field': 'group',
+                'value': 2
+            },
+        ])
+        self.assertListEqual(
+            self.store._recipe_lookup(dict(name='Quesadillas'), {}), [])
+
+    def test_import_export(self):
+        response = self.store._export({}, {})
+        documents = parse_documents(response.get_data(as_text=True))
+
+        with NamedTemporaryFile(suffix='.json', delete=False) as temp:
+            target = Store(JSONDriver(temp.name))
+
+        try:
+            report = target._import_documents({}, documents)
+            self.assertEqual(report['recipes'], len(documents))
+
+            exported = target._export({}, {}).get_data(as_text=True)
+            self.assertListEqual(parse_documents(exported), documents)
+        finally:
+            target.driver.db.close()
+            Path(temp.name).unlink()
+
+    def test_recipe_batch(self):
+        recipe_ids = [self.horchata_id, self.fajitas_id, self.horchata_id]
+        batch = self.store._recipe_batch({}, recipe_ids)
+
+        self.assertListEqual(batch, [
+            self.store._recipe_get(recipe_id) for recipe_id in recipe_ids
+        ])
+        self.assertListEqual(
+            self.store._recipe_batch({}, dict(ids=recipe_ids[:1])), batch[:1])
+        self.assertListEqual(self.store._recipe_batch({}, []), [])
+
+        with self.assertRaises(RecipeNotFound):
+            self.store._recipe_batch({}, [self.fajitas_id, 'missing'])
+
+        with self.assertRaises(InvalidValue):
+            self.store._recipe_batch({}, dict(ids=self.fajitas_id))
+
+    def test_shopping_list(self):
+        shopping = self.store._shopping_list({}, [self.fajitas_id])
+
+        self.assertListEqual(
+            [entry['ingredient']['name'] for entry in shopping],
+            ['Bell Pepper', 'Jalapeño', 'Onion'])
+        self.assertFalse(any(entry['optional'] for entry in shopping))
+        self.assertCountEqual(
+            [(quantity['recipe']['name'], quantity['quantity'])
+             for quantity in shopping[1]['quantities']],
+            [('Fajitas', '2'), ('Pico de Gallo', '2')])
+
+        with self.assertRaises(RecipeNotFound):
+            self.store._shopping_list({}, [self.fajitas_id, 'missing'])
+
+        with self.assertRaises(InvalidValue):
+            self.store._shopping_list({}, dict(ids=self.fajitas_id))
+
+    def test_shopping_list_optional(self):
+        self.store._requirement_add(
+            self.horchata_id, {},
+            dict(ingredient_id=self.serrano_id, quantity='1'))
+        self.store._requirement_add(
+            self.pico_de_gallo_id, {},
+            dict(ingredient_id=self.onion_id, quantity='1', optional=True))
+        self.store._dependency_add(
+            self.guacamole_id, {},
+            dict(requisite=self.horchata_id, optional=True))
+
+        shopping = dict(
+            (entry['ingredient']['name'], entry['optional'])
+            for entry in self.store._shopping_list(
+                {}, dict(ids=[self.guacamole_id])))
+        self.assertDictEqual(shopping, {
+            'Jalapeño': False,
+            'Onion': True,
+            'Serrano': True
+        })
+
+        shopping = dict((entry['ingredient']['name'], entry['optional'])
+                        for entry in self.store._shopping_list(
+                            {}, [self.guacamole_id, self.horchata_id]))
+        self.assertFalse(shopping['Serrano'])
+
     def test_recipe_lookup_junk_args(self):
         with self.assertRaises(InvalidQuery):
             self.store._recipe_lookup(dict(name='Tartare', btw='junk'), {})
@@ -501,6 +977,98 @@ class TestStore(TestCase):
         with self.assertRaises(RecipeNotFound):
             self.store._recipe_get('badid', {}, {})
 
+    def test_recipe_get_classifications(self):
+        # Pico de gallo is required by both guacamole and fajitas
+        self.store._ingredient_edit(self.jalapeno_id, {}, dict(dairy=True))
+        self.store._requirement_add(
+            self.chipotle_chicken_id, {},
+            dict(ingredient_id=self.serrano_id, quantity='1'))
+        self.store._ingredient_edit(self.serrano_id, {}, dict(meat=True))
+
+        fajitas = self.store._recipe_get(self.fajitas_id, {}, {})
+        self.assertEqual(fajitas['classifications'],
+                         Classifications(dairy=True, meat=True))
+
+        guacamole = self.store._recipe_get(self.guacamole_id, {}, {})
+        self.assertEqual(guacamole['classifications'],
+                         Classifications(dairy=True))
+
+        horchata = self.store._recipe_get(self.horchata_id, {}, {})
+        self.assertEqual(horchata['classifications'], Classifications())
+
+    def stored_classifications(self, recipe_id):
+        cf = RecipeClassification.fields
+        stored = self.driver.read(RecipeClassification,
+                                  filters=[{
+                                      cf.recipe_id: recipe_id
+                                  }])
+        if stored:
+            return Classifications(stored[0][cf.dairy], stored[0][cf.meat],
+                                   stored[0][cf.gluten],
+                                   stored[0][cf.animal_product])
+
+    def test_classifications_requirement(self):
+        self.store._ingredient_edit(self.serrano_id, {}, dict(meat=True))
+        self.store._requirement_add(
+            self.pico_de_gallo_id, {},
+            dict(ingredient_id=self.serrano_id, quantity='1'))
+
+        for recipe_id in [
+                self.pico_de_gallo_id, self.guacamole_id, self.fajitas_id
+        ]:
+            self.assertEqual(self.stored_classifications(recipe_id),
+                             Classifications(meat=True))
+        self.assertIsNone(self.stored_classifications(self.horchata_id))
+
+        self.store._requirement_delete(self.pico_de_gallo_id,
+                                       self.serrano_id, {}, {})
+
+        for recipe_id in [
+                self.pico_de_gallo_id, self.guacamole_id, self.fajitas_id
+        ]:
+            self.assertEqual(self.stored_classifications(recipe_id),
+                             Classifications())
+
+    def test_classifications_ingredient_edit(self):
+        self.store._ingredient_edit(self.jalapeno_id, {}, dict(dairy=True))
+
+        for recipe_id in [
+                self.pico_de_gallo_id, self.guacamole_id, self.fajitas_id
+        ]:
+            self.assertEqual(self.stored_classifications(recipe_id),
+                             Classifications(dairy=True))
+
+        self.store._ingredient_edit(self.jalapeno_id, {}, dict(dairy=False))
+
+        for recipe_id in [
+                self.pico_de_gallo_id, self.guacamole_id, self.fajitas_id
+        ]:
+            self.assertEqual(self.stored_classifications(recipe_id),
+                             Classifications())
+
+    def test_classifications_dependency(self):
+        self.store._ingredient_edit(self.serrano_id, {}, dict(gluten=True))
+        self.store._requirement_add(
+            self.horchata_id, {},
+            dict(ingredient_id=self.serrano_id, quantity='1'))
+
+        self.store._dependency_add(self.guacamole_id, {},
+                                   dict(requisite=self.horchata_id))
+        self.assertEqual(self.stored_classifications(self.fajitas_id),
+                         Classifications(gluten=True))
+
+        self.store._dependency_delete(self.guacamole_id, self.horchata_id,
+                                      {}, {})
+        self.assertEqual(self.stored_classifications(self.fajitas_id),
+                         Classifications())
+
+        self.store._dependency_add(self.guacamole_id, {},
+                                   dict(requisite=self.horchata_id))
+        self.store._recipe_delete(self.horchata_id, {}, {})
+        self.assertEqual(self.stored_classifications(self.guacamole_id),
+                         Classifications())
+        self.assertIsNone(self.stored_classifications(self.horchata_id))
+
     def test_recipe_edit_name(self):
         self.store._recipe_edit(
             self.fajitas_id,
@@ -1387,6 +1955,16 @@ class TestStore(TestCase):
                     Requirement.fields.ingredient_id.name: "badid",
                 })
 
+        # Lists are compared as they are, not as any of their items
+        with self.assertRaises(IngredientNotFound):
+            self.store._requirement_add(
+                self.fajitas_id, {}, {
+                    Requirement.fields.ingredient_id.name: [self.onion_id],
+                    Requirement.fields.quantity.name: '1',
+                })
+
+        self.assertIsNotNone(self.store._recipe_get(self.fajitas_id))
+
     def test_requirement_create_junk_args(self):
         with self.assertRaises(InvalidQuery):
             self.store._requirement_add(
@@ -1562,3 +2140,240 @@ class TestStore(TestCase):
 
         with self.assertRaises(TagNotFound):
             self.store._tag_delete(self.fajitas_id, "badid", {}, {})
+
+    def test_ingredient_complete(self):
+        self.store._ingredient_create({}, dict(name='Jalapeño Jack'))
+
+        names = lambda args: [
+            i['name'] for i in self.store._ingredient_complete(args, {})
+        ]
+        self.assertListEqual(names(dict(name='Jala')),
+                             ['Jalapeño', 'Jalapeño Jack'])
+        self.assertListEqual(names(dict(name='jalapeno j')), ['Jalapeño Jack'])
+        self.assertListEqual(names(dict(name='jala', limit='1')),
+                             ['Jalapeño'])
+
+        self.store._ingredient_edit(self.jalapeno_id, {},
+                                    dict(name='Habanero'))
+        self.assertListEqual(names(dict(name='jala')), ['Jalapeño Jack'])
+        self.assertListEqual(names(dict(name='haba')), ['Habanero'])
+
+        self.store._ingredient_delete(self.serrano_id, {}, {})
+        self.assertListEqual(names(dict(name='serr')), [])
+
+        with self.assertRaises(InvalidQuery):
+            self.store._ingredient_complete(dict(pattern='jala'), {})
+
+    def test_recipe_complete(self):
+        complete = self.store._recipe_complete(dict(name='fa'), {})
+        self.assertListEqual(complete, [{
+            'id': self.fajitas_id,
+            'name': 'Fajitas'
+        }])
+
+        self.store._recipe_delete(self.fajitas_id, {}, {})
+        self.assertListEqual(self.store._recipe_complete(dict(name='fa'), {}),
+                             [])
+
+    def test_paginated_ids(self):
+        ids = {
+            self.fajitas_id, self.guacamole_id, self.pico_de_gallo_id,
+            self.chipotle_chicken_id, self.horchata_id
+        }
+
+        self.assertCountEqual(
+            [record['id'] for record in paginated_ids(self.driver, Recipe,
+                                                      ids, {}, size=2)], ids)
+
+        names, page = [], dict(limit=2)
+        while True:
+            records = paginated_ids(self.driver, Recipe, ids, page, size=2)
+            names += [record['name'] for record in records]
+
+            if not records.cursor:
+                break
+            page['after'] = decode_cursor(records.cursor)
+
+        self.assertListEqual(names, [
+            'Chipotle Chicken', 'Fajitas', 'Guacamole', 'Horchata',
+            'Pico de Gallo'
+        ])
+
+    def test_deferred_indexes(self):
+        self.store._recipe_complete(dict(name='fa'), {})
+
+        # Changes are held until the block exits, and dropped if it fails
+        with self.assertRaises(ValueError):
+            with self.store.deferred():
+                self.store._recipe_delete(self.fajitas_id, {}, {})
+                raise ValueError()
+
+        self.assertEqual(len(self.store._recipe_complete(dict(name='fa'), {})),
+                         1)
+
+        with self.store.deferred():
+            self.store._recipe_create({}, dict(name='Falafels'))
+            self.assertEqual(
+                len(self.store._recipe_complete(dict(name='fa'), {})), 1)
+
+        self.assertEqual(len(self.store._recipe_complete(dict(name='fa'), {})),
+                         2)
+
+    def test_deferred_cookable(self):
+        self.store._recipe_cookable({}, [])
+
+        with self.store.deferred():
+            self.store._recipe_create({}, dict(name='Falafels'))
+            self.assertNotIn('Falafels', [
+                recipe['name']
+                for recipe in self.store._recipe_cookable({}, [])
+            ])
+
+        self.assertIn('Falafels', self.cookable([]))
+
+    def cookable(self, ingredient_ids):
+        """Names of the cookable recipes, checked against a rebuilt index"""
+        names = [
+            recipe['name']
+            for recipe in self.store._recipe_cookable({}, ingredient_ids)
+        ]
+
+        rebuilt = CookableIndex()
+        self.assertSetEqual(rebuilt.cookable(self.driver, ingredient_ids),
+                            self.store.cookable.cookable(
+                                self.driver, ingredient_ids))
+
+        return names
+
+    def test_recipe_cookable(self):
+        self.assertCountEqual(self.cookable([]),
+                             ['Chipotle Chicken', 'Horchata'])
+        self.assertCountEqual(
+            self.cookable([self.jalapeno_id]),
+            ['Chipotle Chicken', 'Guacamole', 'Horchata', 'Pico de Gallo'])
+        pantry = [self.bell_pepper_id, self.onion_id, self.jalapeno_id]
+        self.assertCountEqual(self.cookable(pantry), [
+            'Chipotle Chicken', 'Fajitas', 'Guacamole', 'Horchata',
+            'Pico de Gallo'
+        ])
+        self.assertEqual(
+            len(self.store._recipe_cookable({}, dict(ids=pantry))), 5)
+
+        with self.assertRaises(InvalidValue):
+            self.store._recipe_cookable({}, dict(ids=self.jalapeno_id))
+
+        with self.assertRaises(InvalidQuery):
+            self.store._recipe_cookable(dict(name='Fajitas'), [])
+
+    def test_recipe_cookable_edit(self):
+        self.assertNotIn('Guacamole', self.cookable([]))
+
+        self.store._requirement_edit(self.pico_de_gallo_id, self.jalapeno_id,
+                                     {}, dict(optional=True))
+        self.assertIn('Guacamole', self.cookable([]))
+
+        self.store._requirement_add(
+            self.horchata_id, {},
+            dict(ingredient_id=self.serrano_id, quantity='1'))
+        self.store._dependency_add(self.guacamole_id, {},
+                                   dict(requisite=self.horchata_id))
+        self.assertNotIn('Guacamole', self.cookable([]))
+        self.assertIn('Guacamole', self.cookable([self.serrano_id]))
+
+        self.store._dependency_edit(self.guacamole_id, self.horchata_id, {},
+                                    dict(optional=True))
+        self.assertIn('Guacamole', self.cookable([]))
+
+        self.store._requirement_delete(self.horchata_id, self.serrano_id)
+        self.store._recipe_delete(self.pico_de_gallo_id, {}, {})
+        self.store._recipe_create({}, dict(name='Tortillas'))
+        self.assertCountEqual(
+            self.cookable([]),
+            ['Chipotle Chicken', 'Guacamole', 'Horchata', 'Tortillas'])
+
+    def test_memo(self):
+        with self.store.driver.memoize() as memo:
+            requirements = self.store._recipe_requirements(self.fajitas_id)
+            self.assertEqual(memo.saved, 0)
+
+            requirements[0]['quantity'] = 'A lot'
+            self.assertListEqual(
+                self.store._recipe_requirements(self.fajitas_id),
+                self.store._recipe_requirements(self.fajitas_id, {}, {}))
+            self.assertEqual(memo.saved, memo.reads - 2)
+            self.assertNotIn('A lot', [
+                requirement['quantity'] for requirement in
+                self.store._recipe_requirements(self.fajitas_id)
+            ])
+
+            self.store._requirement_edit(self.fajitas_id, self.onion_id, {},
+                                         dict(quantity='A lot'))
+            self.assertIn('A lot', [
+                requirement['quantity'] for requirement in
+                self.store._recipe_requirements(self.fajitas_id)
+            ])
+
+        self.assertIsNone(self.store.driver.state.memo)
+
+
+class TestStoreIndexed(TestStore):
+    location = '?index=1'
+
+
+class TestStoreCached(TestStore):
+
+    def setUp(self):
+        super().setUp()
+        self.driver = CachedDriver(self.driver)
+        self.store = Store(self.driver)
+
+    def test_cache(self):
+        self.store._recipe_get(self.fajitas_id)
+        hits = self.driver.hits
+
+        self.store._recipe_get(self.fajitas_id)
+        self.assertGreater(self.driver.hits, hits)
+
+        self.store._recipe_edit(self.fajitas_id, {}, dict(author='me'))
+        self.assertEqual(
+            self.store._recipe_get(self.fajitas_id)['author'], 'me')
+
+    def test_cache_import(self):
+        lookup = self.store._recipe_lookup({}, {})
+
+        # The command line imports with the driver, past the cache
+        load = import_module('knife.import').load
+        load(self.driver.driver, [{'name': 'Nachos'}, {'name': 'Tacos'}])
+
+        self.assertEqual(len(self.store._recipe_lookup({}, {})),
+                         len(lookup) + 2)
+
+    def test_cache_failure(self):
+        filters = [{Recipe.fields.id: self.fajitas_id}]
+        self.driver.read(Recipe, filters=filters)
+
+        # The JSON driver keeps the writes of a failed session
+        with self.assertRaises(ValueError):
+            with self.driver.session():
+                self.driver.write(Recipe, {Recipe.fields.author: 'me'},
+                                  filters=filters)
+                raise ValueError()
+
+        self.assertEqual(
+            self.driver.read(Recipe, filters=filters)[0][Recipe.fields.author],
+            'me')
+
+    def test_cache_size(self):
+        self.driver.size = 2
+
+        for recipe_id in [
+                self.fajitas_id, self.guacamole_id, self.horchata_id
+        ]:
+            self.driver.read(Recipe, filters=[{Recipe.fields.id: recipe_id}])
+
+        self.assertDictEqual(self.driver.stats(), {
+            'cache_hits': 0,
+            'cache_misses': 3,
+            'cache_entries': 2,
+            'cache_size': 2
+        })